@@ -7,17 +7,18 @@ import logging
 
 class GtcFunctions:
 
-    def __init__(self, bpm, bpm_csv, gtcDir, outDir):
+    def __init__(self, bpm, bpm_csv, gtcDir, outDir, manifestCache=None):
         self.logger = logging.getLogger("classObject")
         self.bpm = bpm
         self.bpm_csv = bpm_csv
         self.gtcDir = gtcDir
         self.outDir = outDir
+        self.manifestCache = manifestCache
 
         self.logger.debug('New object initialized')
 
     
-    def manipulateUpdate(self, snpUpdateFile, overrides):
+    def manipulateUpdate(self, snpUpdateFile, overrides, workers=1, patch=False, validationThreads=0, resume=False, vcf=None, genotypeMatrix=None, sampleMap=None):
         import gthack.modules.manipulateGTC as manipulateGTC
         
         logger = logging.getLogger('manipulateGTC')
@@ -26,10 +27,17 @@ class GtcFunctions:
 
         self.snpUpdateFile = snpUpdateFile
         self.overrides = overrides
+        self.workers = workers
+        self.patch = patch
+        self.validationThreads = validationThreads
+        self.resume = resume
+        self.vcf = vcf
+        self.genotypeMatrix = genotypeMatrix
+        self.sampleMap = sampleMap
         manipulateGTC.manipulate_gtc(self)
 
    
-    def createSampleSheet(self, sampleSheetUpdates, pseudoInstID, pseudoMrn, fileOutName, config):
+    def createSampleSheet(self, sampleSheetUpdates, pseudoInstID, pseudoMrn, fileOutName, config, workers=1, sampleSheetBatch=None):
         import gthack.modules.sampleSheet as sampleSheet
 
         logger = logging.getLogger('createSampleSheet')
@@ -39,12 +47,13 @@ class GtcFunctions:
         self.config = config
         self.pseudoInstID = pseudoInstID
         self.pseudoMrn = pseudoMrn
-        sampleSheet.baseData(self)
-        sampleSheet.updateHeader(self)
-        sampleSheet.generateSampleSheet(outDir = self.outDir, fileName = fileOutName)
+        self.fileOutName = fileOutName
+        self.workers = workers
+        self.sampleSheetBatch = sampleSheetBatch
+        sampleSheet.createSampleSheets(self)
 
 
-    def extractSampleInfo(self, fileOutName, prefix, flag):
+    def extractSampleInfo(self, fileOutName, prefix, flag, inventoryFile=None, cache=None, cacheSizeMB=512, workers=1, noPlots=False, threads=1):
         import gthack.modules.getSampleInfo as getSampleInfo
         
         logger = logging.getLogger('extractSampleInfo')
@@ -52,13 +61,19 @@ class GtcFunctions:
         print('Running module: extractSampleInfo')
         self.fileOutName = fileOutName
         self.prefix = prefix
+        self.inventoryFile = inventoryFile
+        self.cache = cache
+        self.cacheSizeMB = cacheSizeMB
+        self.workers = workers
+        self.noPlots = noPlots
+        self.threads = threads
         if flag:
             getSampleInfo.reportSampleInfoRecursive(self)
         else:
             getSampleInfo.reportSampleInfo(self)
 
  
-    def getIntensities(self, fileOutName, prefix, flag):
+    def getIntensities(self, fileOutName, prefix, flag, inventoryFile=None, cache=None, cacheSizeMB=512, workers=1, noPlots=False):
         import gthack.modules.getIntensities as getIntensities
 
         logger = logging.getLogger('getIntensities')
@@ -66,12 +81,51 @@ class GtcFunctions:
         print('Running module: getIntensities')
         self.fileOutName = fileOutName
         self.prefix = prefix
+        self.inventoryFile = inventoryFile
+        self.cache = cache
+        self.cacheSizeMB = cacheSizeMB
+        self.workers = workers
+        self.noPlots = noPlots
         if flag:
             getIntensities.getIntensitiesRecursive(self)
         else:
             getIntensities.getIntensities(self)
     
     
+    def inventory(self, fileOutName, flag):
+        import gthack.modules.inventory as inventory
+
+        logger = logging.getLogger('inventory')
+        logger.debug('Running module: inventory')
+        print('Running module: inventory')
+        self.fileOutName = fileOutName
+        self.recursive = flag
+        inventory.gtcInventory(self)
+
+
+    def plots(self, fileOutName, prefix, workers=1):
+        import gthack.modules.qcPlots as qcPlots
+
+        logger = logging.getLogger('plots')
+        logger.debug('Running module: plots')
+        print('Running module: plots')
+        self.fileOutName = fileOutName
+        self.prefix = prefix
+        self.workers = workers
+        qcPlots.replot(self)
+
+
+    def synthesize(self, spec, workers=1):
+        import gthack.modules.synthesize as synthesize
+
+        logger = logging.getLogger('synthesize')
+        logger.debug('Running module: synthesize')
+        print('Running module: synthesize')
+        self.spec = spec
+        self.workers = workers
+        synthesize.synthesize(self)
+
+
     def getCallperSample(self):
         logger = logging.getLogger('getCallperSample')
         logger.debug('Running module: getCallperSample')
@@ -127,33 +181,114 @@ class GtcFunctions:
 
         '''
 
-    def query():
-        pass
+    def query(self, snps, fileOutName, flag, queryFormat='long', threads=1, inventoryFile=None, store=None):
+        import gthack.modules.query as query
+
+        logger = logging.getLogger('query')
+        logger.debug('Running module: query')
+        print('Running module: query')
+        self.snps = snps
+        self.fileOutName = fileOutName
+        self.recursive = flag
+        self.queryFormat = queryFormat
+        self.threads = threads
+        self.inventoryFile = inventoryFile
+        self.store = store
+        query.query(self)
+
+
+    def buildStore(self, store, flag, inventoryFile=None, float16=False, threads=1):
+        import gthack.modules.cohortStore as cohortStore
+
+        logger = logging.getLogger('buildStore')
+        logger.debug('Running module: buildStore')
+        print('Running module: buildStore')
+        self.store = store
+        self.recursive = flag
+        self.inventoryFile = inventoryFile
+        self.float16 = float16
+        self.threads = threads
+        cohortStore.buildStore(self)
+
+
+    def exportPlink(self, fileOutName, flag, inventoryFile=None, store=None, blockMB=256, threads=1):
+        import gthack.modules.plinkExport as plinkExport
+
+        logger = logging.getLogger('exportPlink')
+        logger.debug('Running module: exportPlink')
+        print('Running module: exportPlink')
+        self.fileOutName = fileOutName
+        self.recursive = flag
+        self.inventoryFile = inventoryFile
+        self.store = store
+        self.blockMB = blockMB
+        self.threads = threads
+        plinkExport.exportPlink(self)
 
 def main():
     parser = argparse.ArgumentParser(description='Functions and methods for gtc files')
-    parser.add_argument('method', choices=['manipulateGTCs', 'getIntensities', 'sampleInformation', 'createSampleSheet', 'allCombos'])
-    parser.add_argument('--bpm', required=True, type=str, help='Full path to bead pool manifest file (.bpm); must be same one used to generate gtc')
-    parser.add_argument('--bpm-csv',required=True, type=str, help='Full path to bead pool manifest file in CSV form (.csv); must be same one used to generate gtc')
+    parser.add_argument('method', choices=['manipulateGTCs', 'getIntensities', 'sampleInformation', 'createSampleSheet', 'inventory', 'synthesize', 'plots', 'query', 'buildStore', 'exportPlink', 'allCombos'])
+    parser.add_argument('--bpm', default=None, type=str, help='Full path to bead pool manifest file (.bpm); must be same one used to generate gtc')
+    parser.add_argument('--bpm-csv', default=None, type=str, help='Full path to bead pool manifest file in CSV form (.csv); must be same one used to generate gtc')
     parser.add_argument('--gtcDir', type=str, default=os.getcwd(), help='Full path to location of directory/folder containing gtc files to process (files must end in .gtc) -- will not recursively go into subdirectories')
     parser.add_argument('--outDir', default=os.getcwd(), type=str,help='Full path to directory or folder to output results.  If it path does not exist, program will attempt to create it')
     parser.add_argument('--updates', default=None, type=str, help='Full path to file containing snps and/or metadata to update')
     parser.add_argument('--overrides', default=None, type=str, help='a tab-delimited text file to temporary update the snp listed in the bpm file (not GTC!), one snp per line, of snp name and allele change.  Ex: rs12248560.1    [T/A], will update allele rs12248560.1 to have alleles T and A instead of what is listed on the bpm')
     parser.add_argument('--sampleSheetUpdates', default=None, type=str, help='Path and name of samplesheet updates.  Tab-delimited with following headers required: patientName, DOB, sex, mrn, instrumentID -- GThaCk wiki for help')
+    parser.add_argument('--sampleSheetBatch', default=None, type=str, help='Tab-delimited file with header gtcDir, fileOutName and optionally sampleSheetUpdates; one sample sheet is written per line instead of using --gtcDir, --fileOutName and --sampleSheetUpdates (method: createSampleSheet)')
     parser.add_argument('--config', default=None, type=str, help='Path and name to configuration file -- see GThaCk wiki for help')
     parser.add_argument('--prefix', default='', type=str, help='String prefix for saving images generated by sampleInformation')
-    parser.add_argument('--fileOutName', default=None, type=str, help='[default: method=createSampleSheet -> sampleSheet.csv\n method=sampleInformation -> allSampleInfo.txt\n] Name of output file to write results, will be created in directory --outDir')
+    parser.add_argument('--fileOutName', default=None, type=str, help='[default: method=createSampleSheet -> sampleSheet.csv\n method=sampleInformation -> allSampleInfo.txt\n] Name of output file to write results, will be created in directory --outDir; for method plots, the table in --outDir to plot again (default: allSampleInfo.txt and controlProbeIntensityValues.txt); for method exportPlink, the prefix of the .bed/.bim/.fam files (default: plinkExport)')
     parser.add_argument('--modDir', default=os.path.join(os.getcwd(), 'modules'), type=str, help='Full path to module files .py from github; default is current working directory with modules folder appended')
     parser.add_argument('--logName', default='gtcFuncs.log', type=str, help='Name of log file to output, will be created in directory --outDir')
     parser.add_argument('--pseudoInstID', default='7000000000,9999999999', type=str, help='A comma-separated pair of 2 integers with the minimum and maximum range to select instrument ID.  Both integers must be 10 digits.')
     parser.add_argument('--pseudoMrn', default='2000000,7999999', type=str, help='A comma-separated pair of 2 integers with the minimum and maximum range to select MRN.  Both integers must be 7 digits.')
-    parser.add_argument('--recursive', action='store_true', help="if flag is set, gtc files will be found recursively from base --gtcDir; only valid for methods: getIntensities and sampleInformation")
+    parser.add_argument('--recursive', action='store_true', help="if flag is set, gtc files will be found recursively from base --gtcDir; only valid for methods: getIntensities, sampleInformation, inventory, query, buildStore and exportPlink")
+    parser.add_argument('--workers', default=1, type=int, help='Number of worker processes (methods: manipulateGTCs, synthesize, sampleInformation and createSampleSheet; for getIntensities and plots, the processes rendering plots)')
+    parser.add_argument('--threads', default=1, type=int, help='Number of threads per worker process reading gtcs, so reads from slow file servers overlap (methods: sampleInformation, query, buildStore and exportPlink)')
+    parser.add_argument('--snps', default=None, type=str, help='File with one bpm SNP name per line (first tab-delimited column) to look up in every gtc (method: query)')
+    parser.add_argument('--queryFormat', default='long', choices=['long', 'wide'], help='long: one row per gtc and SNP; wide: one row per gtc with columns per SNP (method: query)')
+    parser.add_argument('--store', default=None, type=str, help='Path to a cohort store directory; buildStore creates it or adds new gtcs to it (default: cohortStore in --outDir) and query and exportPlink read from it instead of the gtcs')
+    parser.add_argument('--float16', action='store_true', help='if flag is set, a new cohort store keeps B allele frequencies and log R ratios as float16 (method: buildStore)')
+    parser.add_argument('--blockMB', default=256, type=int, help='Size in MB of the samples x SNPs block buffer used to transpose gtcs into SNP-major order (method: exportPlink)')
+    parser.add_argument('--patch', action='store_true', help='if flag is set, new gtcs are copies of their source gtc with only the updated bytes rewritten; gtcs whose metadata changes length are re-serialized (method: manipulateGTCs)')
+    parser.add_argument('--validationThreads', default=0, type=int, help='Number of background threads validating written gtcs while the next ones are written; 0 validates each gtc right after writing it (method: manipulateGTCs with --workers 1)')
+    parser.add_argument('--resume', action='store_true', help='if flag is set, outputs recorded as passed in manipulationJournal.txt of --outDir are not written again, provided their source gtc and update lines are unchanged (method: manipulateGTCs)')
+    parser.add_argument('--vcf', default=None, type=str, help='VCF (optionally bgzipped) whose calls are injected into template gtcs instead of using --updates; requires --sampleMap (method: manipulateGTCs)')
+    parser.add_argument('--genotypeMatrix', default=None, type=str, help='Tab-delimited sample x SNP matrix of allele pairs (header: first column name, then bpm SNP names) injected into template gtcs instead of using --updates; requires --sampleMap (method: manipulateGTCs)')
+    parser.add_argument('--sampleMap', default=None, type=str, help='Tab-delimited file of --vcf/--genotypeMatrix sample, template gtc in --gtcDir, output name and optional metadata as in the update file (method: manipulateGTCs)')
+    parser.add_argument('--spec', default=None, type=str, help='Path to synthesis spec of key:value lines (templates, count, seed, name patterns, sex, genotypeRate, noCallRate, intensityJitter) -- see synthesize.SPEC_DEFAULTS (method: synthesize)')
+    parser.add_argument('--no-plots', action='store_true', help='if flag is set, only the tables are written and the plotting libraries are never loaded; plots can be drawn later with method plots (methods: getIntensities and sampleInformation)')
+    parser.add_argument('--manifestCache', default=None, type=str, help='Directory to keep the compiled copy of --bpm/--bpm-csv in; default is the directory of the bpm file')
+    parser.add_argument('--cache', nargs='?', const='', default=None, type=str, help='Reuse values extracted from unchanged gtc files across runs (methods: getIntensities and sampleInformation).  Optionally give a path to the sqlite cache file or a directory to keep it in; default is --outDir')
+    parser.add_argument('--cacheSizeMB', default=512, type=int, help='Maximum size of the --cache file in MB; least recently used gtcs are evicted beyond this')
+    parser.add_argument('--inventory', default=None, type=str, help='Path to an index written by method inventory; gtc files are taken from the index instead of walking --gtcDir, with or without --recursive (methods: getIntensities, sampleInformation, query, buildStore and exportPlink)')
    
     # ONLY FOR allCombos if implemented
     parser.add_argument('--snpFile', default=None, type=str, help='A file with snpID followed by possible combinations and gene association')
  
 
     args = parser.parse_args()
+    if args.method not in ['inventory', 'plots'] and (args.bpm == None or args.bpm_csv == None):
+        parser.error('method {} requires arguments --bpm and --bpm-csv'.format(args.method))
+    if args.method == 'manipulateGTCs':
+        if args.vcf != None and args.genotypeMatrix != None:
+            parser.error('--vcf and --genotypeMatrix cannot be used together')
+        if (args.vcf != None or args.genotypeMatrix != None) and args.sampleMap == None:
+            parser.error('--vcf and --genotypeMatrix require --sampleMap')
+        if args.vcf == None and args.genotypeMatrix == None and args.updates == None:
+            parser.error('method manipulateGTCs requires --updates, --vcf or --genotypeMatrix')
+    if args.method == 'synthesize' and args.spec == None:
+        parser.error('method synthesize requires argument --spec')
+    if args.method == 'query' and args.snps == None:
+        parser.error('method query requires argument --snps')
+    if args.inventory != None:
+        if args.method not in ['getIntensities', 'sampleInformation', 'query', 'buildStore', 'exportPlink']:
+            parser.error('--inventory is not used by method {}'.format(args.method))
+        if args.store != None and args.method in ['query', 'exportPlink']:
+            parser.error('--inventory and --store cannot be used together with method {}'.format(args.method))
+        # the recursive variants of getIntensities and sampleInformation are the ones reading an inventory
+        args.recursive = True
 
     if os.path.isdir(args.outDir) == False:
         print('\nOutput directory {} does not exists'.format(args.outDir))
@@ -173,7 +308,7 @@ def main():
     else:
         logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p', filename=os.path.join(args.outDir, args.logName))
         logger = logging.getLogger('Initialization')
-        if any(files.endswith('.gtc') for files in os.listdir(args.outDir)) and (args.method != 'createSampleSheet'):
+        if any(files.endswith('.gtc') for files in os.listdir(args.outDir)) and (args.method != 'createSampleSheet') and not (args.method == 'manipulateGTCs' and args.resume):
             logger.critical('Output directory contains files with extension .gtc.  Please move these files to a new directory or create a new directory without gtc files.')
             print('\nOutput directory contains files with extension .gtc.  Please move these files to a new directory or create a new directory without gtc files.')
             sys.exit()
@@ -181,13 +316,16 @@ def main():
 
 
 
+    if args.cache == '':
+        args.cache = args.outDir
+
     sys.path.insert(1, args.modDir)
 
 
     if args.method == 'manipulateGTCs':
         logger.info('method manipulateGTCs selected \n creating new object of class GtcFunctions')
-        analysisObj = GtcFunctions(args.bpm, args.bpm_csv, args.gtcDir, args.outDir)
-        analysisObj.manipulateUpdate(args.updates, args.overrides)
+        analysisObj = GtcFunctions(args.bpm, args.bpm_csv, args.gtcDir, args.outDir, args.manifestCache)
+        analysisObj.manipulateUpdate(args.updates, args.overrides, args.workers, args.patch, args.validationThreads, args.resume, args.vcf, args.genotypeMatrix, args.sampleMap)
     
     elif args.method == 'createSampleSheet':
         if args.config == None:
@@ -200,23 +338,61 @@ def main():
             args.fileOutName = 'sampleSheet.csv'
 
         logger.info('method createSampleSheet selected \n creating new object of class GtcFunctions')
-        analysisObj = GtcFunctions(args.bpm, args.gtcDir, args.outDir)
-        analysisObj.createSampleSheet(args.sampleSheetUpdates, args.pseudoInstID, args.pseudoMrn, args.fileOutName, args.config)
+        analysisObj = GtcFunctions(args.bpm, args.bpm_csv, args.gtcDir, args.outDir, args.manifestCache)
+        analysisObj.createSampleSheet(args.sampleSheetUpdates, args.pseudoInstID, args.pseudoMrn, args.fileOutName, args.config, args.workers, args.sampleSheetBatch)
 
 
     elif args.method == 'getIntensities':
         logger.info('method getIntensities selected \n creating new object of class GtcFunctions')
         if args.fileOutName == None:
             args.fileOutName = 'controlProbeIntensityValues.txt'
-        analysisObj = GtcFunctions(args.bpm, args.gtcDir, args.outDir)
-        analysisObj.getIntensities(args.fileOutName, args.prefix, args.recursive)
+        analysisObj = GtcFunctions(args.bpm, args.bpm_csv, args.gtcDir, args.outDir, args.manifestCache)
+        analysisObj.getIntensities(args.fileOutName, args.prefix, args.recursive, args.inventory, args.cache, args.cacheSizeMB, args.workers, args.no_plots)
     
     elif args.method == 'sampleInformation':
         logger.info('method sampleInformation selected \n creating new object of class GtcFunctions')
         if args.fileOutName == None:
             args.fileOutName = 'allSampleInfo.txt'
-        analysisObj = GtcFunctions(args.bpm, args.bpm_csv, args.gtcDir, args.outDir)
-        analysisObj.extractSampleInfo(args.fileOutName, args.prefix, args.recursive)
+        analysisObj = GtcFunctions(args.bpm, args.bpm_csv, args.gtcDir, args.outDir, args.manifestCache)
+        analysisObj.extractSampleInfo(args.fileOutName, args.prefix, args.recursive, args.inventory, args.cache, args.cacheSizeMB, args.workers, args.no_plots, args.threads)
+
+    elif args.method == 'inventory':
+        logger.info('method inventory selected \n creating new object of class GtcFunctions')
+        if args.fileOutName == None:
+            args.fileOutName = 'gtcInventory.txt'
+        analysisObj = GtcFunctions(args.bpm, args.bpm_csv, args.gtcDir, args.outDir, args.manifestCache)
+        analysisObj.inventory(args.fileOutName, args.recursive)
+
+    elif args.method == 'synthesize':
+        logger.info('method synthesize selected \n creating new object of class GtcFunctions')
+        analysisObj = GtcFunctions(args.bpm, args.bpm_csv, args.gtcDir, args.outDir, args.manifestCache)
+        analysisObj.synthesize(args.spec, args.workers)
+
+    elif args.method == 'query':
+        logger.info('method query selected \n creating new object of class GtcFunctions')
+        if args.fileOutName == None:
+            args.fileOutName = 'snpQuery.txt'
+        analysisObj = GtcFunctions(args.bpm, args.bpm_csv, args.gtcDir, args.outDir, args.manifestCache)
+        analysisObj.query(args.snps, args.fileOutName, args.recursive, args.queryFormat, args.threads, args.inventory, args.store)
+
+    elif args.method == 'buildStore':
+        logger.info('method buildStore selected \n creating new object of class GtcFunctions')
+        if args.store == None:
+            args.store = os.path.join(args.outDir, 'cohortStore')
+        analysisObj = GtcFunctions(args.bpm, args.bpm_csv, args.gtcDir, args.outDir, args.manifestCache)
+        analysisObj.buildStore(args.store, args.recursive, args.inventory, args.float16, args.threads)
+
+    elif args.method == 'exportPlink':
+        logger.info('method exportPlink selected \n creating new object of class GtcFunctions')
+        if args.fileOutName == None:
+            args.fileOutName = 'plinkExport'
+        analysisObj = GtcFunctions(args.bpm, args.bpm_csv, args.gtcDir, args.outDir, args.manifestCache)
+        analysisObj.exportPlink(args.fileOutName, args.recursive, args.inventory, args.store, args.blockMB, args.threads)
+
+    elif args.method == 'plots':
+        logger.info('method plots selected \n creating new object of class GtcFunctions')
+        analysisObj = GtcFunctions(args.bpm, args.bpm_csv, args.gtcDir, args.outDir, args.manifestCache)
+        analysisObj.plots(args.fileOutName, args.prefix, args.workers)
     
     else:
         logger.critical('method {} does not exist!'.format(args.method))
@@ -0,0 +1,275 @@
+import os
+import sys
+import json
+import logging
+import numpy
+
+# per-SNP sections kept in a cohort store: toc ID, name (of the section file and query column) and dtype
+STORE_SECTIONS = [(1002, 'genotype', 'u1'), (1004, 'gcScore', '<f4'), (1012, 'bAlleleFreq', '<f4'), (1013, 'logRRatio', '<f4')]
+# sections stored as float16 when the store is built with --float16
+QUANTIZABLE = [1012, 1013]
+
+# samples per block.  A section file is a run of blocks of SNPs x SAMPLE_BLOCK values, so one SNP of every sample is
+# a short run in each block and one sample of every SNP is a stride of SAMPLE_BLOCK values within a single block
+SAMPLE_BLOCK = 16
+
+# gtcs read ahead of the writes at a time; the store is committed after each chunk
+CHUNK_SIZE = 64
+
+# blocks the section files are grown by when an append runs past the mapped blocks
+GROW_BLOCKS = 64
+
+# columns of samples.txt, one row per sample in store order
+SAMPLE_COLUMNS = ['gtc', 'sampleName', 'plate', 'well', 'sex', 'callRate', 'gc10', 'logrDev']
+
+
+'''
+function: writeJson(path, data)
+description: writes a json file through a temporary file and a rename, so readers never see a partial file
+input: path and data to write
+output: None
+'''
+def writeJson(path, data):
+    with open(path + '.tmp', 'w') as jsonFile:
+        json.dump(data, jsonFile)
+    os.replace(path + '.tmp', path)
+
+
+'''
+class: CohortStore(path, writable)
+description: memory-mapped SNP x sample matrices of genotypes, GC scores, B allele frequencies and log R ratios of
+gtcs made with one manifest, with a sample table (samples.txt) and meta.json holding the number of samples.  Samples
+are only counted once meta.json is rewritten by commit, so an interrupted append leaves the store as of its last commit
+input: path to store directory and whether samples can be appended (default: False)
+output: CohortStore object
+'''
+class CohortStore:
+
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.writable = writable
+        with open(os.path.join(path, 'meta.json')) as metaFile:
+            self.meta = json.load(metaFile)
+        self.manifest_name = self.meta['manifest_name']
+        self.num_snps = self.meta['num_snps']
+        self.num_samples = self.meta['num_samples']
+        self.sample_block = self.meta['sample_block']
+        self.names = {toc_id: name for toc_id, name, dtype in STORE_SECTIONS}
+        self.dtypes = {toc_id: numpy.dtype(self.meta['dtypes'][name]) for toc_id, name, dtype in STORE_SECTIONS}
+
+        with open(os.path.join(path, 'samples.txt')) as sampleFile:
+            next(sampleFile)
+            self.samples = [line.rstrip('\n').split('\t') for line, sample in zip(sampleFile, range(self.num_samples))]
+
+        self.sections = {}
+        self.mapBlocks(-(-self.num_samples // self.sample_block))
+
+    def __len__(self):
+        return self.num_samples
+
+    def sectionPath(self, toc_id):
+        return os.path.join(self.path, self.names[toc_id] + '.bin')
+
+    def mapBlocks(self, numBlocks):
+        self.mappedBlocks = numBlocks
+        for toc_id, name, dtype in STORE_SECTIONS:
+            if toc_id in self.sections and isinstance(self.sections[toc_id], numpy.memmap):
+                self.sections[toc_id].flush()
+            shape = (numBlocks, self.num_snps, self.sample_block)
+            if numBlocks == 0:
+                self.sections[toc_id] = numpy.zeros(shape, dtype=self.dtypes[toc_id])
+                continue
+            if self.writable:
+                # grown GROW_BLOCKS at a time as samples are appended; new blocks read as zeros (no call)
+                size = numBlocks * self.num_snps * self.sample_block * self.dtypes[toc_id].itemsize
+                with open(self.sectionPath(toc_id), 'r+b') as sectionFile:
+                    if os.fstat(sectionFile.fileno()).st_size < size:
+                        sectionFile.truncate(size)
+            self.sections[toc_id] = numpy.memmap(self.sectionPath(toc_id), dtype=self.dtypes[toc_id],
+                mode='r+' if self.writable else 'r', shape=shape)
+
+    '''
+    function: snps(locs, sections)
+    description: SNP-major slice; only the rows of the requested SNPs are read from each block
+    input: numpy array of bpm indices and optionally the toc IDs to read (default: every section)
+    output: dictionary of toc ID -> numpy array of shape (len(locs), samples)
+    '''
+    def snps(self, locs, sections=None):
+        values = {}
+        for toc_id, section in self.sections.items():
+            if sections is not None and toc_id not in sections:
+                continue
+            rows = section[:, locs, :].transpose(1, 0, 2).reshape(len(locs), -1)
+            values[toc_id] = rows[:, :self.num_samples]
+        return values
+
+    '''
+    function: sample(index)
+    description: sample-major slice; every SNP of one sample, read from the block holding the sample
+    input: position of the sample in the store
+    output: dictionary of toc ID -> numpy array of length num_snps
+    '''
+    def sample(self, index):
+        if index < 0 or index >= self.num_samples:
+            raise IndexError('sample {} is not in store {} of {} samples'.format(index, self.path, self.num_samples))
+        block, column = divmod(index, self.sample_block)
+        return {toc_id: numpy.array(section[block, :, column]) for toc_id, section in self.sections.items()}
+
+    def append(self, row, values):
+        block, column = divmod(self.num_samples, self.sample_block)
+        if block >= self.mappedBlocks:
+            self.mapBlocks(block + GROW_BLOCKS)
+        for toc_id, section in self.sections.items():
+            section[block, :, column] = values[toc_id]
+        self.samples.append(row)
+        self.num_samples += 1
+
+    def commit(self):
+        # section data first, then the sample table, then the count that makes both visible
+        for section in self.sections.values():
+            if isinstance(section, numpy.memmap):
+                section.flush()
+        with open(os.path.join(self.path, 'samples.txt.tmp'), 'w') as sampleFile:
+            sampleFile.write('\t'.join(SAMPLE_COLUMNS) + '\n')
+            sampleFile.writelines('\t'.join(row) + '\n' for row in self.samples)
+        os.replace(os.path.join(self.path, 'samples.txt.tmp'), os.path.join(self.path, 'samples.txt'))
+        self.meta['num_samples'] = self.num_samples
+        writeJson(os.path.join(self.path, 'meta.json'), self.meta)
+
+
+'''
+function: createStore(path, manifest_name, num_snps, float16)
+description: creates an empty cohort store
+input: path to store directory, manifest name, number of SNPs of the manifest and whether B allele frequencies and
+log R ratios are stored as float16
+output: writable CohortStore object
+'''
+def createStore(path, manifest_name, num_snps, float16=False):
+    os.makedirs(path, exist_ok=True)
+    dtypes = {}
+    for toc_id, name, dtype in STORE_SECTIONS:
+        dtypes[name] = '<f2' if float16 and toc_id in QUANTIZABLE else dtype
+        open(os.path.join(path, name + '.bin'), 'wb').close()
+    with open(os.path.join(path, 'samples.txt'), 'w') as sampleFile:
+        sampleFile.write('\t'.join(SAMPLE_COLUMNS) + '\n')
+    writeJson(os.path.join(path, 'meta.json'), {'manifest_name': manifest_name, 'num_snps': num_snps,
+        'num_samples': 0, 'sample_block': SAMPLE_BLOCK, 'dtypes': dtypes})
+    return CohortStore(path, writable=True)
+
+
+'''
+function: openStore(path, manifest, writable)
+description: opens a cohort store and checks it was built with the manifest given
+input: path to store directory, ManifestIndex of the bpm and whether samples can be appended (default: False)
+output: CohortStore object (exits if the store is missing or was built with another manifest)
+'''
+def openStore(path, manifest, writable=False):
+    logger = logging.getLogger('cohortStore')
+
+    if not os.path.isfile(os.path.join(path, 'meta.json')):
+        logger.critical('{} is not a cohort store; create it with method buildStore'.format(path))
+        print('{} is not a cohort store; create it with method buildStore'.format(path))
+        sys.exit(1)
+    store = CohortStore(path, writable)
+    if store.manifest_name != manifest.manifest_name or store.num_snps != len(manifest):
+        logger.critical('Cohort store {} was built with manifest {}, not {}'.format(path, store.manifest_name, manifest.manifest_name))
+        print('Cohort store {} was built with manifest {}, not {}'.format(path, store.manifest_name, manifest.manifest_name))
+        sys.exit(1)
+    return store
+
+
+'''
+function: readStoreValues(gtc, manifestName)
+description: sample table row and per-SNP sections of one gtc; the sections are views over the mapped file, so
+nothing is copied until they are written to the store
+input: gtc path and the manifest name the gtc has to be made with
+output: tuple of the row of samples.txt, dictionary of toc ID -> numpy array (None if the gtc was made with another
+manifest) and None, or None, None and the error if the gtc cannot be read
+'''
+def readStoreValues(gtc, manifestName):
+    import gthack.modules.gtcView as gtcView
+
+    # one unreadable gtc is reported and skipped instead of losing the rest of the append
+    try:
+        view = gtcView.GtcView(gtc)
+        row = [os.path.abspath(gtc), view.string(10), view.string(11), view.string(12), view.char(1007).decode(),
+            str(view.float(1006)), str(view.float(1009)), str(view.float(1008))]
+        if view.string(101) != manifestName:
+            view.close()
+            return row, None, None
+        values = {toc_id: view.array(toc_id) for toc_id, name, dtype in STORE_SECTIONS}
+        view.close()
+    except Exception as error:
+        return None, None, '{}: {}'.format(type(error).__name__, error)
+    return row, values, None
+
+
+'''
+function: buildStore(self)
+description: adds the gtcs of a directory to a cohort store, creating it on first use.  Gtcs already in the store
+(by absolute path) are skipped, so a store is extended by running the method again once new plates arrive
+input: gtcFunction object (bpm, gtcDir, store, recursive, inventoryFile, float16 and threads)
+output: writes the store directory
+'''
+def buildStore(self):
+    import gthack.modules.manifestIndex as manifestIndex
+    from concurrent.futures import ThreadPoolExecutor
+    from itertools import repeat
+    from pathlib import Path
+    from os import fspath
+
+    logger = logging.getLogger('buildStore')
+    logger.debug('In method buildStore()')
+
+    manifest = manifestIndex.loadManifestIndex(self.bpm, cacheDir=self.manifestCache)
+    if os.path.isfile(os.path.join(self.store, 'meta.json')):
+        store = openStore(self.store, manifest, writable=True)
+        if self.float16 != (store.dtypes[1012] == numpy.float16):
+            logger.warning('Cohort store {} keeps the precision it was created with; --float16 is ignored'.format(self.store))
+            print('Cohort store {} keeps the precision it was created with; --float16 is ignored'.format(self.store))
+        logger.info('Appending to cohort store {} of {} samples'.format(self.store, len(store)))
+        print('Appending to cohort store {} of {} samples'.format(self.store, len(store)))
+    else:
+        store = createStore(self.store, manifest.manifest_name, len(manifest), self.float16)
+        logger.info('Created cohort store {}'.format(self.store))
+        print('Created cohort store {}'.format(self.store))
+
+    if self.inventoryFile is not None:
+        import gthack.modules.inventory as inventory
+        input_gtc_list, mismatched = inventory.readInventory(self.inventoryFile, manifest.manifest_name)
+        input_gtc_list = [gtc for gtc in input_gtc_list if gtc not in mismatched]
+    elif self.recursive:
+        input_gtc_list = sorted(fspath(gtc) for gtc in Path(self.gtcDir).rglob('*.gtc'))
+    else:
+        input_gtc_list = sorted(os.path.join(self.gtcDir, gtc) for gtc in os.listdir(self.gtcDir) if gtc.endswith('.gtc'))
+
+    stored = set(row[0] for row in store.samples)
+    new_gtc_list = [gtc for gtc in input_gtc_list if os.path.abspath(gtc) not in stored]
+    if len(new_gtc_list) < len(input_gtc_list):
+        logger.info('Skipping {} gtcs already in the store'.format(len(input_gtc_list) - len(new_gtc_list)))
+        print('Skipping {} gtcs already in the store'.format(len(input_gtc_list) - len(new_gtc_list)))
+
+    added = 0
+    with ThreadPoolExecutor(max_workers=max(1, self.threads)) as executor:
+        for start in range(0, len(new_gtc_list), CHUNK_SIZE):
+            chunk = new_gtc_list[start:start + CHUNK_SIZE]
+            for gtc, (row, values, error) in zip(chunk, executor.map(readStoreValues, chunk, repeat(manifest.manifest_name))):
+                if error is not None:
+                    print('Could not read {} ({}).  Skipping sample.'.format(gtc, error))
+                    logger.warning('Could not read {} ({}).  Skipping sample.'.format(gtc, error))
+                    continue
+                if values is None:
+                    print("Sample {}, {} does not have a matching bpm for the manifest you are supplying. Skipping sample.".format(row[1], gtc))
+                    logger.warning("Sample {}, {} does not have a matching bpm for the manifest you are supplying. Skipping sample.".format(row[1], gtc))
+                    continue
+                if any(len(values[toc_id]) != store.num_snps for toc_id in values):
+                    print('{} does not have {} SNPs like its manifest.  Skipping sample.'.format(gtc, store.num_snps))
+                    logger.warning('{} does not have {} SNPs like its manifest.  Skipping sample.'.format(gtc, store.num_snps))
+                    continue
+                store.append(row, values)
+                added += 1
+            store.commit()
+            logger.debug('Committed {} samples to {}'.format(len(store), self.store))
+
+    logger.info('Added {} gtcs; cohort store {} holds {} samples x {} SNPs'.format(added, self.store, len(store), store.num_snps))
+    print('Added {} gtcs; cohort store {} holds {} samples x {} SNPs'.format(added, self.store, len(store), store.num_snps))
@@ -1,141 +1,98 @@
-from IlluminaBeadArrayFiles import *
+from IlluminaBeadArrayFiles import GenotypeCalls
 import struct
 from io import BytesIO
+from collections.abc import Mapping
 import logging
+
+
+def get_gc50_summary(genotype_calls):
+    return (genotype_calls.get_gc50(), genotype_calls.get_num_calls(),
+        genotype_calls.get_num_no_calls(),
+        genotype_calls.get_num_intensity_only())
+
+
+'''
+GTC_ELEMENTS: every toc entry extracted from a gtc file, paired with the GenotypeCalls getter used to decode it.
+The order is the order entries are returned by getGtcInfo and therefore the order write_gtc writes them back out.
+'''
+GTC_ELEMENTS = [
+    (GenotypeCalls._GenotypeCalls__ID_AUTOCALL_DATE, GenotypeCalls.get_autocall_date),  # key:201
+    (GenotypeCalls._GenotypeCalls__ID_AUTOCALL_VERSION, GenotypeCalls.get_autocall_version),  # key:300
+    (GenotypeCalls._GenotypeCalls__ID_B_ALLELE_FREQS, GenotypeCalls.get_ballele_freqs),  # key:1012 - per SNP on all SNPs on chip
+    (GenotypeCalls._GenotypeCalls__ID_BASE_CALLS, GenotypeCalls.get_base_calls),  # key:1003 - per SNP on all SNPs on chip (options: A/C/T/G/-/I/D)
+    (GenotypeCalls._GenotypeCalls__ID_CALL_RATE, GenotypeCalls.get_call_rate),  # key:1006 - per sample -- total number of valid SNPs with genotype calls divided by total SNPs clustered.  If a SNP has been zeroed out in the cluster file, it is not considered in the tatal # clustered snps; confirmed same value as in BCP
+    (GenotypeCalls._GenotypeCalls__ID_CLUSTER_FILE, GenotypeCalls.get_cluster_file),  # key:100
+    (GenotypeCalls._GenotypeCalls__ID_CONTROLS_X, GenotypeCalls.get_control_x_intensities),  # key:500 - 92 values
+    (GenotypeCalls._GenotypeCalls__ID_CONTROLS_Y, GenotypeCalls.get_control_y_intensities),  # key:501 - 92 values
+    (GenotypeCalls._GenotypeCalls__ID_GC10, GenotypeCalls.get_gc10),  # key:1009 - per samples - confirmed same as BCP
+    (GenotypeCalls._GenotypeCalls__ID_GC50, get_gc50_summary),  # key:1011 - per sample
+    (GenotypeCalls._GenotypeCalls__ID_GENDER, GenotypeCalls.get_gender),  # key:1007 - calculated from chip NOT from sample manifest
+    (GenotypeCalls._GenotypeCalls__ID_GENOTYPE_SCORES, GenotypeCalls.get_genotype_scores),  # key:1004
+    (GenotypeCalls._GenotypeCalls__ID_GENOTYPES, GenotypeCalls.get_genotypes),  # key:1002
+    (GenotypeCalls._GenotypeCalls__ID_IMAGING_DATE, GenotypeCalls.get_imaging_date),  # key:200
+    (GenotypeCalls._GenotypeCalls__ID_LOGR_DEV, GenotypeCalls.get_logr_dev),  # key:1008 - the standard deviation of the log(r ratio) across all snps. Essentially estimates noise per sample; confirmed same as in BCP
+    (GenotypeCalls._GenotypeCalls__ID_NORMALIZATION_TRANSFORMS, GenotypeCalls.get_normalization_transforms),  # key:400
+    (GenotypeCalls._GenotypeCalls__ID_NUM_SNPS, GenotypeCalls.get_num_snps),  # key:1
+    (GenotypeCalls._GenotypeCalls__ID_PERCENTILES_X, GenotypeCalls.get_percentiles_x),  # key:1014 - 3 values
+    (GenotypeCalls._GenotypeCalls__ID_PERCENTILES_Y, GenotypeCalls.get_percentiles_y),  # key:1015 - 3 values
+    (GenotypeCalls._GenotypeCalls__ID_PLOIDY, GenotypeCalls.get_ploidy),  # key:2 - per sample
+    (GenotypeCalls._GenotypeCalls__ID_PLOIDY_TYPE, GenotypeCalls.get_ploidy_type),  # key:3 - per sample
+    (GenotypeCalls._GenotypeCalls__ID_RAW_X, GenotypeCalls.get_raw_x_intensities),  # key:1000 - per SNP
+    (GenotypeCalls._GenotypeCalls__ID_RAW_Y, GenotypeCalls.get_raw_y_intensities),  # key:1001 - per SNP
+    (GenotypeCalls._GenotypeCalls__ID_SAMPLE_NAME, GenotypeCalls.get_sample_name),  # key:10
+    (GenotypeCalls._GenotypeCalls__ID_SAMPLE_PLATE, GenotypeCalls.get_sample_plate),  # key:11
+    (GenotypeCalls._GenotypeCalls__ID_SAMPLE_WELL, GenotypeCalls.get_sample_well),  # key:12
+    (GenotypeCalls._GenotypeCalls__ID_SCANNER_DATA, GenotypeCalls.get_scanner_data),  # key:1005
+    (GenotypeCalls._GenotypeCalls__ID_SLIDE_IDENTIFIER, GenotypeCalls.get_slide_identifier),  # key:1016 - Illumina barcode (not the RxCx part)
+    (GenotypeCalls._GenotypeCalls__ID_SNP_MANIFEST, GenotypeCalls.get_snp_manifest),  # key:101 - name of bpm file used
+    (GenotypeCalls._GenotypeCalls__ID_LOGR_RATIOS, GenotypeCalls.get_logr_ratios),  # key:1013 per SNP, the log(R ratio), 0 = perfect single copy while above and below indicate copy number anomoalies
+]
+
+
 '''
-function: getGtcInfo(gtc)
-description: extracts all data elements from a gtc file
-input: name of gtc file
-output: data dictionary of all elements of that gtc file
+class: LazyGtcInfo(gtc, fields)
+description: read-only dictionary view of a gtc file keyed by toc ID.  Only the header and table of contents
+are read when the object is created; each element is decoded the first time it is accessed and then kept.
+input: name of gtc file and optionally the toc IDs the caller needs (default: all elements in GTC_ELEMENTS)
+output: mapping of toc ID to decoded value
 '''
+class LazyGtcInfo(Mapping):
 
-def getGtcInfo(gtc):
+    def __init__(self, gtc, fields=None):
+        self.gtc = gtc
+        self.genotype_calls = GenotypeCalls(gtc)
+        if fields is None:
+            self.getters = dict(GTC_ELEMENTS)
+        else:
+            fields = set(fields)
+            self.getters = {toc_id: getter for toc_id, getter in GTC_ELEMENTS if toc_id in fields}
+        self.values = {}
+
+    def __getitem__(self, toc_id):
+        if toc_id not in self.values:
+            self.values[toc_id] = self.getters[toc_id](self.genotype_calls)
+        return self.values[toc_id]
+
+    def __iter__(self):
+        return iter(self.getters)
+
+    def __len__(self):
+        return len(self.getters)
+
+
+'''
+function: getGtcInfo(gtc, fields)
+description: extracts data elements from a gtc file
+input: name of gtc file and optionally a list of toc IDs to extract; when not given all elements are extracted
+output: data dictionary of the requested elements of that gtc file
+'''
+def getGtcInfo(gtc, fields=None):
     logger = logging.getLogger('getGtcInfo')
     logger.debug('In method getGtcInfo')
 
     logger.info('Extracting information from {}'.format(gtc.split('/')[-1]))
-    
-    genotype_calls = GenotypeCalls(gtc)
-    data = {}
-    
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_AUTOCALL_DATE] = genotype_calls.get_autocall_date(
-        )  # key:201
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_AUTOCALL_VERSION] = genotype_calls.get_autocall_version(
-        )  # key:300
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_B_ALLELE_FREQS] = genotype_calls.get_ballele_freqs(
-        )  # key:1012 - per SNP on all SNPs on chip
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_BASE_CALLS] = genotype_calls.get_base_calls(
-        )  # key:1003 - per SNP on all SNPs on chip (options: A/C/T/G/-/I/D)
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_CALL_RATE] = genotype_calls.get_call_rate(
-        )  # key:1006 - per sample -- total number of valid SNPs with genotype calls divided by total SNPs clustered.  If a SNP has been zeroed out in the cluster file, it is not considered in the tatal # clustered snps; confirmed same value as in BCP
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_CLUSTER_FILE] = genotype_calls.get_cluster_file(
-        )  # key:100
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_CONTROLS_X] = genotype_calls.get_control_x_intensities(
-        )  # key:500 - 92 values
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_CONTROLS_Y] = genotype_calls.get_control_y_intensities(
-        )  # key:501 - 92 values
-    data[
-        GenotypeCalls._GenotypeCalls__ID_GC10] = genotype_calls.get_gc10(
-        )  # key:1009 - per samples - confirmed same as BCP
-    data[GenotypeCalls._GenotypeCalls__ID_GC50] = (
-        genotype_calls.get_gc50(), genotype_calls.get_num_calls(),
-        genotype_calls.get_num_no_calls(),
-        genotype_calls.get_num_intensity_only()
-        )  # key:1011 - per sample
-    data[GenotypeCalls.
-        _GenotypeCalls__ID_GENDER] = genotype_calls.get_gender(
-        )  # key:1007 - calculated from chip NOT from sample manifest
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_GENOTYPE_SCORES] = genotype_calls.get_genotype_scores(
-        )  # key:1004
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_GENOTYPES] = genotype_calls.get_genotypes(
-        )  # key:1002
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_IMAGING_DATE] = genotype_calls.get_imaging_date(
-        )  # key:200
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_LOGR_DEV] = genotype_calls.get_logr_dev(
-        )  # key:1008 - the standard deviation of the log(r ratio) across all snps. Essentially estimates noise per sample; confirmed same as in BCP
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_NORMALIZATION_TRANSFORMS] = genotype_calls.get_normalization_transforms(
-        )  # key:400
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_NUM_SNPS] = genotype_calls.get_num_snps(
-        )  # key:1
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_PERCENTILES_X] = genotype_calls.get_percentiles_x(
-        )  # key:1014 - 3 values
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_PERCENTILES_Y] = genotype_calls.get_percentiles_y(
-        )  # key:1015 - 3 values
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_PLOIDY] = genotype_calls.get_ploidy(
-        )  # key:2 - per sample
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_PLOIDY_TYPE] = genotype_calls.get_ploidy_type(
-        )  # key:3 - per sample
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_RAW_X] = genotype_calls.get_raw_x_intensities(
-        )  # key:1000 - per SNP
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_RAW_Y] = genotype_calls.get_raw_y_intensities(
-        )  # key:1001 - per SNP
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_SAMPLE_NAME] = genotype_calls.get_sample_name(
-        )  # key:10
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_SAMPLE_PLATE] = genotype_calls.get_sample_plate(
-        )  # key:11
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_SAMPLE_WELL] = genotype_calls.get_sample_well(
-        )  # key:12
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_SCANNER_DATA] = genotype_calls.get_scanner_data(
-        )  # key:1005
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_SLIDE_IDENTIFIER] = genotype_calls.get_slide_identifier(
-        )  # key:1016 - Illumina barcode (not the RxCx part)
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_SNP_MANIFEST] = genotype_calls.get_snp_manifest(
-        )  # key:101 - name of bpm file used
-    data[
-        GenotypeCalls.
-        _GenotypeCalls__ID_LOGR_RATIOS] = genotype_calls.get_logr_ratios(
-        )  # key:1013 per SNP, the log(R ratio), 0 = perfect single copy while above and below indicate copy number anomoalies
+
+    gtcInfo = LazyGtcInfo(gtc, fields=fields)
+    data = {toc_id: gtcInfo[toc_id] for toc_id in gtcInfo}
 
     return data
@@ -0,0 +1,383 @@
+import os
+import logging
+import numpy
+
+# records translated together; each block holds one genotype per record and mapped sample
+BLOCK_SIZE = 4096
+
+# slot of the allele code table a missing allele ('.') is looked up in; slots 0-9 are VCF allele indices
+MISSING_ALLELE = 10
+
+NO_CALL = ord('-')
+
+
+'''
+function: readSampleMap(sampleMap)
+description: reads the tab-delimited file pairing each input sample with the template gtc its calls are injected into.
+Columns are sample, template gtc, output name and optionally metadata as in the update file (key=value pairs separated
+by commas); blank lines and lines starting with # are skipped.  A sample can be listed more than once
+input: path to sample map
+output: tuple of a list of dictionaries with keys sample, gtc, outputName and metaData, and a list of error messages
+'''
+def readSampleMap(sampleMap):
+    entries = []
+    errors = []
+    with open(sampleMap) as samples:
+        for lineNumber, line in enumerate(samples, 1):
+            if line.strip() == '' or line.startswith('#'):
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) not in (3, 4):
+                errors.append('sample map line {}: {} is not sample, template gtc, output name [, metadata]'.format(lineNumber, line.rstrip()))
+                continue
+            entries.append({'sample': fields[0], 'gtc': fields[1], 'outputName': fields[2],
+                'metaData': fields[3] if len(fields) == 4 and fields[3] != '' else None})
+
+    return entries, errors
+
+
+'''
+function: vcfAlleleCodes(ref, alts)
+description: the allele each allele index of a VCF record stands for in a gtc allele pair: the base of a single base
+allele, or I/D for the longer/shorter allele of a biallelic indel.  Spanning deletions (*) and other non-ACGT alleles
+read as missing
+input: REF and ALT fields of the record (bytes)
+output: uint8 array indexed by allele index (0-9, MISSING_ALLELE for '.'), '-' for missing or unused indices; None
+for records that are neither SNVs nor indels
+'''
+def vcfAlleleCodes(ref, alts):
+    alleles = [ref] + [alt for alt in alts.split(b',') if alt != b'.']
+    codes = numpy.full(MISSING_ALLELE + 1, NO_CALL, dtype=numpy.uint8)
+    lengths = [len(allele) for allele in alleles]
+    if max(lengths) == 1:
+        for i, allele in enumerate(alleles[:MISSING_ALLELE]):
+            if allele.upper() in (b'A', b'C', b'G', b'T'):
+                codes[i] = allele.upper()[0]
+    elif len(set(lengths)) == len(alleles) == 2 and all(allele.isalpha() for allele in alleles):
+        for i, allele in enumerate(alleles):
+            codes[i] = ord('I') if len(allele) == max(lengths) else ord('D')
+    else:
+        return None
+    return codes
+
+
+'''
+function: slowGenotypes(fields, codes, alleles)
+description: allele pairs of sample fields the fast path of vcfGenotypes cannot read: haploid calls (taken as
+homozygous), allele indices above 9 and GT fields of unusual length
+input: list of sample fields (bytes), the allele codes and number of alleles of the record
+output: (n, 2) uint8 array of allele pairs; '--' for anything that is not a haploid or diploid call
+'''
+def slowGenotypes(fields, codes, alleles):
+    pairs = numpy.full((len(fields), 2), NO_CALL, dtype=numpy.uint8)
+    for i, field in enumerate(fields):
+        gt = field.split(b':')[0].replace(b'|', b'/').split(b'/')
+        if len(gt) == 1:
+            gt = gt * 2
+        if len(gt) != 2 or not all(allele.isdigit() for allele in gt):
+            continue
+        indices = [int(allele) for allele in gt]
+        if max(indices) >= alleles:
+            continue
+        if max(indices) < MISSING_ALLELE:
+            pairs[i] = codes[indices]
+    return pairs
+
+
+'''
+function: vcfGenotypes(line, columns, codes, alleles)
+description: allele pairs of the requested samples of one VCF data line.  The GT field is the first of each sample
+field (readVcf only passes records whose FORMAT starts with GT), so for diploid single digit calls ('0/1', '1|1',
+'./.') the allele indices sit at fixed positions after each tab and all samples are read at once with numpy; other
+samples fall back to slowGenotypes
+input: the data line (bytes), sample column of each requested sample (0 = first sample), allele codes and number of
+alleles of the record
+output: (n, 2) uint8 array of allele pairs; a call with a missing allele is '--'
+'''
+def vcfGenotypes(line, columns, codes, alleles):
+    buffer = numpy.frombuffer(line, dtype=numpy.uint8)
+    tabs = numpy.flatnonzero(buffer == 9)
+    if len(tabs) - 8 <= columns.max():
+        raise ValueError('record {} has fewer sample columns than the header'.format(line[:60].decode(errors='replace')))
+    starts = tabs[8:] + 1
+    ends = numpy.append(tabs[9:], len(buffer))
+    starts = starts[columns]
+    ends = ends[columns]
+
+    lengths = ends - starts
+    first = buffer[numpy.minimum(starts, len(buffer) - 1)]
+    separator = buffer[numpy.minimum(starts + 1, len(buffer) - 1)]
+    second = buffer[numpy.minimum(starts + 2, len(buffer) - 1)]
+    after = buffer[numpy.minimum(starts + 3, len(buffer) - 1)]
+    digit_first = (first >= ord('0')) & (first <= ord('9'))
+    digit_second = (second >= ord('0')) & (second <= ord('9'))
+    fast = (lengths >= 3) & ((separator == ord('/')) | (separator == ord('|'))) \
+        & (digit_first | (first == ord('.'))) & (digit_second | (second == ord('.'))) \
+        & ((lengths == 3) | (after == ord(':')))
+
+    first = numpy.where(first == ord('.'), MISSING_ALLELE, first.astype(numpy.int64) - ord('0'))
+    second = numpy.where(second == ord('.'), MISSING_ALLELE, second.astype(numpy.int64) - ord('0'))
+    # indices past the alleles of the record are treated as missing
+    first = numpy.where(first < alleles, first, MISSING_ALLELE)
+    second = numpy.where(second < alleles, second, MISSING_ALLELE)
+    pairs = numpy.stack([codes[first], codes[second]], axis=1)
+
+    slow = numpy.flatnonzero(~fast)
+    if len(slow) > 0:
+        pairs[slow] = slowGenotypes([line[start:end] for start, end in zip(starts[slow], ends[slow])], codes, alleles)
+
+    pairs[(pairs == NO_CALL).any(axis=1)] = NO_CALL
+    return pairs
+
+
+'''
+function: manifestPositions(manifest)
+description: chromosome/position -> SNP index of a manifest, chromosome names without a chr prefix
+input: ManifestIndex object
+output: dictionary of (chromosome, position) -> SNP index
+'''
+def manifestPositions(manifest):
+    return {(str(chrom).upper().replace('CHR', ''), int(position)): loc
+        for loc, (chrom, position) in enumerate(zip(manifest.chroms.tolist(), manifest.map_infos.tolist()))}
+
+
+'''
+function: locateRecord(manifest, positions, fields)
+description: finds the bpm SNP of a VCF record, by any of its IDs and otherwise by chromosome and position
+input: ManifestIndex object, dictionary from manifestPositions and the fields of the record (bytes)
+output: SNP index or None
+'''
+def locateRecord(manifest, positions, fields):
+    for name in fields[2].split(b';'):
+        loc = manifest.index.get(name)
+        if loc is not None:
+            return loc
+    if not fields[1].isdigit():
+        return None
+    return positions.get((fields[0].decode().upper().replace('CHR', ''), int(fields[1])))
+
+
+'''
+function: readVcf(vcf, samples, translator)
+description: streams a (bgzipped) VCF once and translates the calls of the requested samples at every record that
+maps to a bpm SNP into gtc genotype codes, BLOCK_SIZE records at a time.  Records of other variant types, not on
+the bpm, or whose REF/ALT alleles are not the bpm alleles of the SNP (on either strand) are skipped; when several
+records map to the same SNP the last one wins.  Calls that match no genotype are reported as errors
+input: path to VCF, list of VCF sample names to read and GenotypeTranslator of the bpm
+output: tuple of SNP indices, (SNPs, samples) genotype matrix and a list of error messages
+'''
+def readVcf(vcf, samples, translator):
+    import pysam
+
+    logger = logging.getLogger('readVcf')
+    manifest = translator.manifest
+    errors = []
+
+    handle = pysam.BGZFile(vcf, 'rb')
+    header = None
+    for line in handle:
+        if line.startswith(b'#CHROM'):
+            header = line.rstrip(b'\r\n').decode().split('\t')
+            break
+    if header is None:
+        handle.close()
+        return None, None, ['{} has no #CHROM header line'.format(vcf)]
+
+    vcfSamples = {sample: column for column, sample in enumerate(header[9:])}
+    missing = [sample for sample in samples if sample not in vcfSamples]
+    errors.extend('sample {} is not in {}'.format(sample, vcf) for sample in missing)
+    if len(missing) > 0:
+        handle.close()
+        return None, None, errors
+    columns = numpy.array([vcfSamples[sample] for sample in samples], dtype=numpy.int64)
+
+    positions = None
+    blockLocs, blockPairs = [], []
+    allLocs, allGenotypes = [], []
+    skipped = 0
+    noGenotype = 0
+    mismatched = 0
+
+    def translateBlock():
+        locs = numpy.array(blockLocs, dtype=numpy.int64)
+        pairs = numpy.stack(blockPairs)
+        genotypes, base_calls, valid = translator.translate(numpy.repeat(locs, len(samples)), pairs.reshape(-1, 2))
+        for i in numpy.flatnonzero(~valid)[:10]:
+            errors.append('{}: allele pair {} of sample {} at {} matches no genotype'.format(vcf,
+                pairs.reshape(-1, 2)[i].tobytes().decode(errors='replace'), samples[i % len(samples)], manifest.name(locs[i // len(samples)])))
+        allLocs.append(locs)
+        allGenotypes.append(genotypes.reshape(len(locs), len(samples)))
+        blockLocs.clear()
+        blockPairs.clear()
+
+    for line in handle:
+        line = line.rstrip(b'\r\n')
+        if line == b'' or line.startswith(b'#'):
+            continue
+        fields = line.split(b'\t', 9)
+        loc = manifest.index.get(fields[2]) if b';' not in fields[2] else None
+        if loc is None:
+            if positions is None:
+                positions = manifestPositions(manifest)
+            loc = locateRecord(manifest, positions, fields)
+        codes = vcfAlleleCodes(fields[3], fields[4]) if loc is not None else None
+        if codes is None:
+            skipped += 1
+            continue
+        # sample fields are only read as calls when GT is the first FORMAT key
+        if len(fields) < 10 or fields[8].split(b':')[0] != b'GT':
+            noGenotype += 1
+            continue
+
+        alleles = 1 + len([alt for alt in fields[4].split(b',') if alt != b'.'])
+        # translate() would complement a homozygous call of any other allele onto the bpm alleles
+        if not translator.onBpmAlleles(numpy.array([loc]), codes[None, :min(alleles, MISSING_ALLELE)])[0]:
+            mismatched += 1
+            continue
+        blockLocs.append(loc)
+        try:
+            blockPairs.append(vcfGenotypes(line, columns, codes, alleles))
+        except ValueError as error:
+            handle.close()
+            return None, None, errors + ['{}: {}'.format(vcf, error)]
+        if len(blockLocs) == BLOCK_SIZE:
+            try:
+                translateBlock()
+            except KeyError as error:
+                handle.close()
+                return None, None, errors + ['{}: {}'.format(vcf, error.args[0])]
+    handle.close()
+    if noGenotype > 0:
+        logger.warning('{} records of {} that map to bpm SNPs have no GT as first FORMAT key and were skipped'.format(noGenotype, vcf))
+        print('{} records of {} that map to bpm SNPs have no GT as first FORMAT key and were skipped'.format(noGenotype, vcf))
+    if mismatched > 0:
+        logger.warning('{} records of {} that map to bpm SNPs have REF/ALT alleles other than the bpm alleles and were skipped'.format(mismatched, vcf))
+        print('{} records of {} that map to bpm SNPs have REF/ALT alleles other than the bpm alleles and were skipped'.format(mismatched, vcf))
+    if len(blockLocs) > 0:
+        try:
+            translateBlock()
+        except KeyError as error:
+            return None, None, errors + ['{}: {}'.format(vcf, error.args[0])]
+
+    if len(allLocs) == 0:
+        return None, None, errors + ['no record of {} maps to a SNP of bpm {}'.format(vcf, manifest.manifest_name)]
+    locs = numpy.concatenate(allLocs)
+    genotypes = numpy.concatenate(allGenotypes)
+    logger.info('{} records of {} map to bpm SNPs, {} skipped'.format(len(locs), vcf, skipped))
+
+    last = len(locs) - 1 - numpy.unique(locs[::-1], return_index=True)[1]
+    return locs[last], genotypes[last], errors
+
+
+'''
+function: readGenotypeMatrix(genotypeMatrix, samples, translator)
+description: streams a dense tab-delimited sample x SNP matrix (optionally gzipped) and translates the rows of the
+requested samples.  The header line is a first column name followed by the bpm SNP names; each row is the sample name
+followed by one allele pair per SNP as in the update file ('AG', '--'); a cell without a pair is a no call.  Pairs
+naming alleles other than the bpm alleles of the SNP (on either strand) or matching no genotype are reported as errors
+input: path to the matrix, list of sample names to read and GenotypeTranslator of the bpm
+output: tuple of SNP indices, (SNPs, samples) genotype matrix and a list of error messages
+'''
+def readGenotypeMatrix(genotypeMatrix, samples, translator):
+    import pysam
+
+    manifest = translator.manifest
+    errors = []
+    columns = {sample: column for column, sample in enumerate(samples)}
+
+    handle = pysam.BGZFile(genotypeMatrix, 'rb')
+    header = handle.readline().rstrip(b'\r\n').decode().split('\t')
+    locs = numpy.empty(len(header) - 1, dtype=numpy.int64)
+    for i, name in enumerate(header[1:]):
+        try:
+            locs[i] = manifest.locate(name)
+        except ValueError as error:
+            errors.append('{}: {}'.format(genotypeMatrix, error))
+    if len(errors) > 0:
+        handle.close()
+        return None, None, errors
+
+    # last column of each SNP
+    last = len(locs) - 1 - numpy.unique(locs[::-1], return_index=True)[1]
+    genotypes = numpy.zeros((len(last), len(samples)), dtype=numpy.uint8)
+    found = set()
+    for line in handle:
+        fields = line.rstrip(b'\r\n').split(b'\t')
+        sample = fields[0].decode()
+        if sample not in columns:
+            continue
+        if len(fields) != len(header):
+            errors.append('{}: row {} has {} columns, the header has {}'.format(genotypeMatrix, sample, len(fields), len(header)))
+            continue
+        pairs = numpy.array(fields[1:], dtype='S2').view(numpy.uint8).reshape(-1, 2)[last]
+        pairs[(pairs == 0).any(axis=1)] = NO_CALL
+        try:
+            sampleGenotypes, base_calls, valid = translator.translate(locs[last], pairs)
+        except KeyError as error:
+            errors.append('{}: {}'.format(genotypeMatrix, error.args[0]))
+            continue
+        for i in numpy.flatnonzero(~valid)[:10]:
+            errors.append('{}: allele pair {} of sample {} at {} matches no genotype'.format(genotypeMatrix,
+                pairs[i].tobytes().decode(errors='replace'), sample, manifest.name(locs[last][i])))
+        # translate() would complement a homozygous pair of any other allele onto the bpm alleles
+        for i in numpy.flatnonzero(valid & ~translator.onBpmAlleles(locs[last], pairs))[:10]:
+            errors.append('{}: allele pair {} of sample {} at {} is not an allele pair of bpm SNP {}'.format(genotypeMatrix,
+                pairs[i].tobytes().decode(errors='replace'), sample, manifest.name(locs[last][i]), manifest.snps[locs[last][i]]))
+        genotypes[:, columns[sample]] = sampleGenotypes
+        found.add(sample)
+    handle.close()
+
+    errors.extend('sample {} is not in {}'.format(sample, genotypeMatrix) for sample in samples if sample not in found)
+    return locs[last], genotypes, errors
+
+
+'''
+function: compileInjection(vcf, genotypeMatrix, sampleMap, gtcDir, translator)
+description: builds compiled manipulation jobs (as manipulateGTC.compileUpdates does for the update file) that inject
+every call of a VCF or genotype matrix sample into its template gtc in one batch.  The sample map is checked before
+the input is read, and the input is read once for all samples
+input: path to VCF or genotype matrix (the other None), path to sample map, gtc directory and GenotypeTranslator of the bpm
+output: tuple of a list of compiled job dictionaries and a list of error messages
+'''
+def compileInjection(vcf, genotypeMatrix, sampleMap, gtcDir, translator):
+    import gthack.modules.manipulateGTC as manipulateGTC
+
+    logger = logging.getLogger('compileInjection')
+
+    entries, errors = readSampleMap(sampleMap)
+    outputNames = set()
+    for entry in entries:
+        entry['snps'] = []
+        block = '{} -> {}'.format(entry['sample'], entry['outputName'])
+        if not os.path.isfile(os.path.join(gtcDir, entry['gtc'])):
+            errors.append('{}: template gtc {} does not exist'.format(block, os.path.join(gtcDir, entry['gtc'])))
+        if entry['outputName'] in outputNames:
+            errors.append('{}: output {} is written by an earlier sample'.format(block, entry['outputName']))
+        outputNames.add(entry['outputName'])
+        entry['metaDataUpdates'] = {}
+        if entry['metaData'] is not None:
+            entry['metaDataUpdates'], metaDataErrors = manipulateGTC.compileMetaData(entry['metaData'])
+            errors.extend('{}: {}'.format(block, error) for error in metaDataErrors)
+    if len(entries) == 0:
+        errors.append('{} lists no samples'.format(sampleMap))
+    if len(errors) > 0:
+        return [], errors
+
+    samples = list(dict.fromkeys(entry['sample'] for entry in entries))
+    if vcf is not None:
+        logger.info('Reading {} samples from {}'.format(len(samples), vcf))
+        locs, genotypes, inputErrors = readVcf(vcf, samples, translator)
+    else:
+        logger.info('Reading {} samples from {}'.format(len(samples), genotypeMatrix))
+        locs, genotypes, inputErrors = readGenotypeMatrix(genotypeMatrix, samples, translator)
+    if len(inputErrors) > 0:
+        return [], inputErrors
+
+    # base calls of I/D SNPs use the bpm alleles, all others the TOP alleles
+    indels = numpy.isin(translator.allele_a[locs], [ord('I'), ord('D')])
+    columns = {sample: column for column, sample in enumerate(samples)}
+    for entry in entries:
+        sampleGenotypes = numpy.ascontiguousarray(genotypes[:, columns[entry['sample']]])
+        entry['snpUpdates'] = (locs, sampleGenotypes, translator.baseCalls(locs, sampleGenotypes, indels))
+
+    return entries, errors
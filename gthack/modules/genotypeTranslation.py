@@ -0,0 +1,187 @@
+from IlluminaBeadArrayFiles import RefStrand
+import logging
+import numpy
+
+COMPLEMENT_MAP = dict(zip("ABCDGHKMRTVYNID", "TVGHCDMKYABRNID"))
+
+# byte -> complemented byte, 0 where the base has no complement
+COMPLEMENT_TABLE = numpy.zeros(256, dtype=numpy.uint8)
+for base, complement in COMPLEMENT_MAP.items():
+    COMPLEMENT_TABLE[ord(base)] = ord(complement)
+
+NO_CALL = ord('-')
+INDEL = [ord('I'), ord('D')]
+
+
+'''
+function: alleleCodes(alleles)
+description: converts an array of strings to the byte code of each character position
+input: numpy array of str
+output: 2D uint8 array, one row per string (characters outside ASCII become 0)
+'''
+def alleleCodes(alleles):
+    alleles = numpy.ascontiguousarray(alleles, dtype=str)
+    codes = alleles.view(numpy.uint32).reshape(len(alleles), -1)
+    return numpy.where(codes < 128, codes, 0).astype(numpy.uint8)
+
+
+'''
+class: GenotypeTranslator(manifest)
+description: per-manifest lookup tables translating requested allele pairs into gtc genotype codes and base calls.
+Built once (after overrides) from the ManifestIndex: the strand-adjusted bpm alleles of every SNP and the TOP alleles
+from the manifest csv, as byte codes.  translate() is then a batch gather over all update lines of a sample.
+input: ManifestIndex object
+output: GenotypeTranslator object
+'''
+class GenotypeTranslator:
+
+    def __init__(self, manifest):
+        self.manifest = manifest
+
+        snps = numpy.asarray(manifest.snps, dtype=str)
+        codes = alleleCodes(snps)
+        lengths = numpy.char.str_len(snps)
+        rows = numpy.arange(len(snps))
+        # bpm snp strings are [A/B]; alleles are the second and second to last characters
+        bpm_a = codes[rows, 1]
+        bpm_b = codes[rows, lengths - 2]
+
+        minus = numpy.asarray(manifest.ref_strands) == RefStrand.Minus
+        self.allele_a = numpy.where(minus, COMPLEMENT_TABLE[bpm_a], bpm_a)
+        self.allele_b = numpy.where(minus, COMPLEMENT_TABLE[bpm_b], bpm_b)
+        self.uncomplementable = minus & ((self.allele_a == 0) | (self.allele_b == 0))
+
+        self.top_a = alleleCodes(manifest.allele_a)[:, 0]
+        self.top_b = alleleCodes(manifest.allele_b)[:, 0]
+
+    '''
+    function: translate(locs, pairs)
+    description: genotype code and base call of every (SNP index, allele pair).  A pair of different alleles is AB,
+    '--' is a no call and a homozygous pair is AA or BB by the strand-adjusted bpm A allele, after complementing the
+    pair if it is on the other strand.  Base calls of I/D pairs use the bpm alleles, all others the TOP alleles.
+    Pairs starting with '-' but not '--' match none of these and are flagged invalid.
+    input: array of SNP indices and an (n, 2) uint8 array of requested allele pairs
+    output: genotype codes, (n, 2) uint8 base calls and a mask of valid pairs
+    '''
+    def translate(self, locs, pairs):
+        first = pairs[:, 0]
+        second = pairs[:, 1]
+        allele_a = self.allele_a[locs]
+        allele_b = self.allele_b[locs]
+
+        if self.uncomplementable[locs].any():
+            bad = locs[self.uncomplementable[locs]][0]
+            raise KeyError('bpm alleles of {} cannot be complemented'.format(self.manifest.name(bad)))
+
+        het = (first != second) & (first != NO_CALL)
+        no_call = (first == NO_CALL) & (second == NO_CALL)
+        hom = (first == second) & ~no_call
+        valid = het | no_call | hom
+
+        on_strand = (first == allele_a) | (first == allele_b)
+        hom_allele = numpy.where(on_strand, first, COMPLEMENT_TABLE[first])
+        if (hom & (hom_allele == 0)).any():
+            bad = numpy.flatnonzero(hom & (hom_allele == 0))[0]
+            raise KeyError('allele {} of {} cannot be complemented'.format(chr(first[bad]), self.manifest.name(locs[bad])))
+
+        genotypes = numpy.zeros(len(locs), dtype=numpy.uint8)
+        genotypes[het] = 2
+        genotypes[hom] = numpy.where(hom_allele[hom] == allele_a[hom], 1, 3)
+
+        indel = numpy.isin(first, INDEL)
+        base_calls = self.baseCalls(locs, genotypes, indel)
+
+        return genotypes, base_calls, valid
+
+    '''
+    function: onBpmAlleles(locs, alleles)
+    description: whether the alleles given at each SNP are all alleles of its strand-adjusted bpm pair, or all
+    alleles of the complemented pair; '-' is ignored.  translate() complements any homozygous pair that is not on
+    the strand, so input that may name other alleles (a VCF or genotype matrix) is checked with this first
+    input: array of SNP indices and an (n, k) uint8 array of alleles at each SNP
+    output: mask of SNPs whose alleles match the bpm
+    '''
+    def onBpmAlleles(self, locs, alleles):
+        allele_a = self.allele_a[locs][:, None]
+        allele_b = self.allele_b[locs][:, None]
+        called = alleles != NO_CALL
+        on_strand = (alleles == allele_a) | (alleles == allele_b)
+        complemented = (alleles == COMPLEMENT_TABLE[allele_a]) | (alleles == COMPLEMENT_TABLE[allele_b])
+        return (on_strand | ~called).all(axis=1) | (complemented | ~called).all(axis=1)
+
+    '''
+    function: baseCalls(locs, genotypes, indel)
+    description: base call pair of each SNP for a genotype code; '--' for a no call
+    input: array of SNP indices, their genotype codes and a mask of SNPs whose calls use the bpm (I/D) alleles
+    output: (n, 2) uint8 array of base calls
+    '''
+    def baseCalls(self, locs, genotypes, indel):
+        allele_a = numpy.where(indel, self.allele_a[locs], self.top_a[locs])
+        allele_b = numpy.where(indel, self.allele_b[locs], self.top_b[locs])
+
+        base_calls = numpy.empty((len(locs), 2), dtype=numpy.uint8)
+        base_calls[:, 0] = numpy.where((genotypes == 1) | (genotypes == 2), allele_a, allele_b)
+        base_calls[:, 1] = numpy.where(genotypes == 1, allele_a, allele_b)
+        base_calls[genotypes == 0] = NO_CALL
+        return base_calls
+
+
+'''
+function: compileLines(lines, translator)
+description: resolves the snp lines of one gtc sample into the values they write, without touching any gtc.  Every
+SNP name is looked up and every allele pair translated; when a SNP is listed more than once the last line wins
+input: the snp lines (name and allele pair) for that sample and a GenotypeTranslator
+output: tuple of SNP indices, their genotype codes and (n, 2) uint8 base calls, and a list of error messages for
+lines that name an unknown SNP or an allele pair that cannot be translated
+'''
+def compileLines(lines, translator):
+    errors = []
+    locs = numpy.empty(len(lines), dtype=numpy.int64)
+    pairs = numpy.empty((len(lines), 2), dtype=numpy.uint8)
+    keep = numpy.ones(len(lines), dtype=bool)
+    for i, line in enumerate(lines):
+        fields = line.rstrip().split()
+        try:
+            locs[i] = translator.manifest.locate(fields[0])
+            if len(fields) < 2 or len(fields[1]) != 2 or not fields[1].isascii():
+                raise ValueError('snp line {} does not have an allele pair'.format(line.rstrip()))
+            pairs[i] = numpy.frombuffer(fields[1].encode(), dtype=numpy.uint8)
+        except ValueError as error:
+            errors.append(str(error))
+            keep[i] = False
+
+    locs = locs[keep]
+    pairs = pairs[keep]
+    kept = [line for line, ok in zip(lines, keep) if ok]
+    try:
+        genotypes, base_calls, valid = translator.translate(locs, pairs)
+    except KeyError as error:
+        errors.append(error.args[0])
+        return locs[:0], numpy.empty(0, dtype=numpy.uint8), numpy.empty((0, 2), dtype=numpy.uint8), errors
+    for i in numpy.flatnonzero(~valid):
+        errors.append('snp line {} matches no genotype'.format(kept[i].rstrip()))
+
+    # last line of each SNP
+    last = len(locs) - 1 - numpy.unique(locs[::-1], return_index=True)[1]
+    return locs[last], genotypes[last], base_calls[last], errors
+
+
+'''
+function: applyUpdates(data, locs, genotypes, base_calls)
+description: writes compiled snp updates (see compileLines) into the genotype and base call arrays of a sample
+input: data dictionary of a sample gtc (or any dictionary holding its 1002 and 1003 arrays) and the compiled update
+output: returns data dictionary for that sample with updated snps (update both base call in bytes and genotype)
+'''
+def applyUpdates(data, locs, genotypes, base_calls):
+    logger = logging.getLogger('applyUpdates')
+
+    if len(locs) == 0:
+        return data
+
+    data[1002] = numpy.asarray(data[1002], dtype=numpy.uint8)
+    data[1003] = numpy.asarray(data[1003], dtype='S2')
+    data[1002][locs] = genotypes
+    data[1003].view(numpy.uint8).reshape(-1, 2)[locs] = base_calls
+
+    logger.debug('Updated {} snps'.format(len(locs)))
+    return data
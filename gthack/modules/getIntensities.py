@@ -1,7 +1,112 @@
-from IlluminaBeadArrayFiles import *
 import logging
 import os
 
+# toc IDs read from each gtc: sample name, plate, well, manifest, control X/Y intensities, sex
+INTENSITY_FIELDS = [10, 11, 12, 101, 500, 501, 1007]
+
+# the control sections hold 4 values per control probe; the first of each group is the probe intensity
+CONTROL_STRIDE = 4
+
+
+'''
+function: readControlIntensities(gtc, fields, manifestName)
+description: reads only the toc entries getIntensities needs by seeking straight to them through the gtc table of
+contents (gtcView), instead of parsing the gtc with GenotypeCalls.  The manifest name is read first; the control
+intensities of a gtc made with another manifest than manifestName are not read
+input: name of gtc file, the list of toc IDs to read (strings, 500/501 and 1007) and optionally the manifest name
+output: data dictionary of the requested elements of that gtc file
+'''
+def readControlIntensities(gtc, fields=INTENSITY_FIELDS, manifestName=None):
+    import gthack.modules.gtcView as gtcView
+    import numpy as np
+
+    data = {}
+    with gtcView.GtcView(gtc) as view:
+        for toc_id in sorted(fields, key=lambda toc_id: toc_id != 101):
+            if toc_id in gtcView.CONTROL_TYPES:
+                if manifestName is not None and data.get(101) != manifestName:
+                    continue
+                # copied so the mapping can be closed
+                data[toc_id] = np.array(view.array(toc_id))
+            elif toc_id == 1007:
+                data[toc_id] = view.char(toc_id)
+            else:
+                data[toc_id] = view.string(toc_id)
+    return data
+
+
+'''
+function: intensityProbes(manifest)
+description: names of the control probes of a manifest, in the order of the control intensity sections
+input: manifestIndex object
+output: list of probe names
+'''
+def intensityProbes(manifest):
+    controls = manifest.control_config.split('\n')
+    # checks if split leaves an empty string, if yes, pop off
+    if len(controls[-1]) == 0:
+        controls.pop(len(controls)-1)
+
+    tmp = [control.split(":")[3].split(',', 1)[1] for control in controls]
+    return [i.replace(',', '_').replace(' ', '_') for i in tmp]
+
+
+'''
+function: collectIntensities(gtcs, manifest, cache, mismatched, logger)
+description: reads the control probe intensities of every gtc made with the manifest into one array.  A sample seen
+twice (same plate, well and name) keeps its first position with the values of the later gtc
+input: list of gtc paths, manifestIndex object, GtcCache object (or None), dictionary of gtc path -> data of gtcs
+already known not to match the manifest and the logger to report skipped gtcs to
+output: tuple of sample keys (plate-well-name), sexes and a samples x probes x channel (X, Y) uint16 array
+'''
+def collectIntensities(gtcs, manifest, cache, mismatched, logger):
+    import gthack.modules.gtcCache as gtcCache
+    import numpy as np
+    import sys
+    from functools import partial
+
+    numProbes = len(intensityProbes(manifest))
+    rows = {}
+    sexes = []
+    intensities = np.zeros((len(gtcs), numProbes, 2), dtype=np.uint16)
+    extract = partial(readControlIntensities, manifestName=manifest.manifest_name)
+
+    for gtc in gtcs:
+        data = mismatched.get(gtc) or gtcCache.getGtcInfo(cache, gtc, INTENSITY_FIELDS, extract)
+        if data[101] != manifest.manifest_name:
+            print("Sample {}, {} does not have a matching bpm for the manifest you are supplying. Skipping sample.".format(data[10], gtc))
+            sys.stdout.flush()
+            logger.warning("Sample {}, {} does not have a matching bpm for the manifest you are supplying. Skipping sample.".format(data[10], gtc))
+            continue
+
+        key = '{}-{}-{}'.format(data[11], data[12], data[10])
+        if key not in rows:
+            rows[key] = len(rows)
+            sexes.append(None)
+        row = rows[key]
+        sexes[row] = data[1007]
+        for channel, toc_id in enumerate([500, 501]):
+            values = np.asarray(data[toc_id])[::CONTROL_STRIDE][:numProbes]
+            intensities[row, :len(values), channel] = values
+
+    return list(rows), sexes, intensities[:len(rows)]
+
+
+'''
+function: intensityTable(samples, sexes, intensities, probes)
+description: table of control probe intensities as written by getIntensities: one row per sample, sex and then the X
+and Y intensity of each probe
+input: sample keys, sexes and samples x probes x channel array from collectIntensities, and the probe names
+output: pandas DataFrame
+'''
+def intensityTable(samples, sexes, intensities, probes):
+    import pandas
+
+    columns = [probe + channel for probe in probes for channel in ['_1X', '_1Y']]
+    table = pandas.DataFrame(intensities.reshape(len(samples), -1), index=samples, columns=columns)
+    table.insert(0, 'sex', sexes)
+    return table
+
 
 '''
 function: getIntensities(gtcDir, bpm, outDir)
@@ -10,14 +115,11 @@ input:
 output:
 '''
 def getIntensities(self):
-    import gthack.modules.extractInformation as extractInformation
-    import pandas
-    import seaborn as sns
-    import matplotlib.pyplot as plt 
-    import numpy as np
-    import sys
+    import gthack.modules.gtcCache as gtcCache
+    import gthack.modules.manifestIndex as manifestIndex
+    import gthack.modules.qcPlots as qcPlots
 
-    logging.getLogger('getIntensities')
+    logger = logging.getLogger('getIntensities')
 
     gtcDir = self.gtcDir
     bpm = self.bpm
@@ -26,119 +128,38 @@ def getIntensities(self):
     prefix = self.prefix
 
     # reading in manifest more than once carries lot of overhead
-    manifest = BeadPoolManifest(bpm)
+    manifest = manifestIndex.loadManifestIndex(bpm, cacheDir=self.manifestCache)
+    cache = gtcCache.openCache(self.cache, manifest.manifest_name, self.cacheSizeMB)
 
 
     input_gtc_list = [
         gtc for gtc in os.listdir(gtcDir) if gtc.endswith(".gtc")
     ]
 
-    #detect which probes are available based on bpm input
-    controls = manifest.control_config.split('\n')
-    # checks if split leaves an empty string, if yes, pop off
-    if len(manifest.control_config.split('\n')[-1]) == 0:
-        controls.pop(len(controls)-1)
+    intensity_probes = intensityProbes(manifest)
+    samples, sexes, intensities = collectIntensities([os.path.join(gtcDir, gtc) for gtc in input_gtc_list], manifest, cache, {}, logger)
 
-    # list of control probes in order
-    tmp = [controls[i].split(":")[3].split(',', 1)[1] for i in range(0, len(controls))]
-    intensity_probes = [i.replace(',', '_').replace(' ', '_') for i in tmp]
-
-    
-    intensities_per_sample = {}
-
-    for gtc in input_gtc_list:
-        data = extractInformation.getGtcInfo(gtc=os.path.join(gtcDir, gtc))
-        try:
-            assert data[101] == manifest.manifest_name
-            intensities_per_sample['{}-{}-{}'.format(data[11], data[12], data[10])] = {}
-            intensities_per_sample['{}-{}-{}'.format(data[11], data[12], data[10])]['sex'] = data[1007]
-
-            intensityIndex = 0
-            for i in range(0, len(data[500])):
-                if i%4 == 0:
-                    intensities_per_sample['{}-{}-{}'.format(data[11], data[12], data[10])][intensity_probes[intensityIndex] + '_1X'] = data[500][i]
-                    intensities_per_sample['{}-{}-{}'.format(data[11], data[12], data[10])][intensity_probes[intensityIndex] + '_1Y'] = data[501][i]
-                    intensityIndex += 1
-                else:
-                    continue
-        except AssertionError:
-            print("Sample {}, {} does not have a matching bpm for the manifest you are supplying. Skipping sample.".format(data[10], gtc))
-            sys.stdout.flush()
-            logger.warning("Sample {}, {} does not have a matching bpm for the manifest you are supplying. Skipping sample.".format(data[10], gtc))
-            continue
-            
+    if cache is not None:
+        cache.close()
 
-    allIntesities = pandas.DataFrame(intensities_per_sample)
-    allIntensities_transpose = allIntesities.T
+    allIntensities_transpose = intensityTable(samples, sexes, intensities, intensity_probes)
     if os.path.exists(outDir) == False:
         os.mkdir(outDir)
     allIntensities_transpose.to_csv(os.path.join(outDir, fileOutName), index = True, sep = '\t')
 
 
-    allIntensities_transpose['sampleGroup'] = "samples"
-
-    images = list(allIntensities_transpose)
-    images.pop(images.index('sex'))
-    images.pop(images.index('sampleGroup'))
-    
-    for i in images:
-        mean = allIntensities_transpose[i].astype(int).mean()
-        upperStdSix = mean + (allIntensities_transpose[i].astype(int).std()*6)
-        lowerStdSix = mean - (allIntensities_transpose[i].astype(int).std()*6)
-        upperStdThree = mean + (allIntensities_transpose[i].astype(int).std()*3)
-        lowerStdThree = mean - (allIntensities_transpose[i].astype(int).std()*3)
-
-        removeOutliers = allIntensities_transpose.loc[(allIntensities_transpose[i].astype(int) > lowerStdThree) & 
-            (allIntensities_transpose[i].astype(int) < upperStdThree)]
-
-        fig, axs = plt.subplots(ncols=3)
-
-        sns.boxplot(x='sampleGroup', y=i, data = allIntensities_transpose, showfliers=False, color='white', ax=axs[0])
-        sns.stripplot(x='sampleGroup', y=i, data = allIntensities_transpose, hue='sex', palette="colorblind", ax=axs[0]).set_title(str(i) + '\n across all samples', fontsize=10)
-        axs[0].tick_params(axis='y', which='major', labelsize=8)
-
-        plotDevs = sns.boxplot(x='sampleGroup', y=i, data = allIntensities_transpose, showfliers=False, color='white', ax=axs[1])
-        plotDevs = sns.stripplot(x='sampleGroup', y=i, hue='sex', data = allIntensities_transpose, palette="colorblind", ax=axs[1])
-        axs[1].set_ylabel('')
-        axs[1].legend_.remove()
-        plotDevs.axhline(upperStdThree, ls='--', color='blue')
-        plotDevs.axhline(lowerStdThree, ls='--', color='blue')
-        plotDevs.axhline(upperStdSix, ls=':', color='orange')
-        plotDevs.axhline(lowerStdSix, ls=':', color='orange')
-        plotDevs.axhline(mean, ls='-.', color = 'green', linewidth=2)
-        axs[1].tick_params(axis='y', which='major', labelsize=8)
-        plotDevs.set_title(str(i) + '\n across all samples \n annotated mean and std devs', fontsize=10)
-        
-        sns.boxplot(x='sampleGroup', y=i, data = removeOutliers, showfliers=False, color='white', ax=axs[2])
-        sns.stripplot(x='sampleGroup', y=i, data = removeOutliers, hue='sex', palette="colorblind", ax=axs[2]).set_title(str(i) + '\n across all samples \n with < 3 std devs from mean', fontsize=10)
-        axs[2].set_ylabel('')
-        axs[2].tick_params(axis='y', which='major', labelsize=8)
-
-        axs[0].legend(loc=0)
-        axs[1].legend(loc=0)
-        axs[2].legend(loc=0)
-        plt.setp(axs)
-        
-        fig.set_size_inches(11, 7)
-        fig.savefig(prefix + str(i) + "Plots.png")
-
-        del removeOutliers
-        del plotDevs
-        del fig
-        del axs
+    if not self.noPlots:
+        qcPlots.intensityPlots(allIntensities_transpose, prefix, self.workers)
 
 
 def getIntensitiesRecursive(self):
-    import gthack.modules.extractInformation as extractInformation
-    import pandas
-    import seaborn as sns
-    import matplotlib.pyplot as plt 
-    import numpy as np
-    import sys
+    import gthack.modules.gtcCache as gtcCache
+    import gthack.modules.manifestIndex as manifestIndex
+    import gthack.modules.qcPlots as qcPlots
     from pathlib import Path
     from os import fspath
 
-    logger.getLogger('getIntensitiesRecursive')
+    logger = logging.getLogger('getIntensitiesRecursive')
 
     gtcDir = self.gtcDir
     bpm = self.bpm
@@ -147,100 +168,27 @@ def getIntensitiesRecursive(self):
     prefix = self.prefix
 
     # reading in manifest more than once carries lot of overhead
-    manifest = BeadPoolManifest(bpm)
+    manifest = manifestIndex.loadManifestIndex(bpm, cacheDir=self.manifestCache)
+    cache = gtcCache.openCache(self.cache, manifest.manifest_name, self.cacheSizeMB)
 
-    input_gtc_list = [fspath(gtc) for gtc in Path(gtcDir).rglob('*.gtc')]
+    if self.inventoryFile is not None:
+        import gthack.modules.inventory as inventory
+        input_gtc_list, mismatched = inventory.readInventory(self.inventoryFile, manifest.manifest_name)
+    else:
+        input_gtc_list = [fspath(gtc) for gtc in Path(gtcDir).rglob('*.gtc')]
+        mismatched = {}
 
-    #detect which probes are available based on bpm input
-    controls = manifest.control_config.split('\n')
-    # checks if split leaves an empty string, if yes, pop off
-    if len(manifest.control_config.split('\n')[-1]) == 0:
-        controls.pop(len(controls)-1)
+    intensity_probes = intensityProbes(manifest)
+    samples, sexes, intensities = collectIntensities(input_gtc_list, manifest, cache, mismatched, logger)
 
-    # list of control probes in order
-    tmp = [controls[i].split(":")[3].split(',', 1)[1] for i in range(0, len(controls))]
-    intensity_probes = [i.replace(',', '_').replace(' ', '_') for i in tmp]
-
-    
-    intensities_per_sample = {}
-
-    for gtc in input_gtc_list:
-        data = extractInformation.getGtcInfo(gtc)
-        try:
-            assert data[101] == manifest.manifest_name
-            intensities_per_sample['{}-{}-{}'.format(data[11], data[12], data[10])] = {}
-            intensities_per_sample['{}-{}-{}'.format(data[11], data[12], data[10])]['sex'] = data[1007]
-
-            intensityIndex = 0
-            for i in range(0, len(data[500])):
-                if i%4 == 0:
-                    intensities_per_sample['{}-{}-{}'.format(data[11], data[12], data[10])][intensity_probes[intensityIndex] + '_1X'] = data[500][i]
-                    intensities_per_sample['{}-{}-{}'.format(data[11], data[12], data[10])][intensity_probes[intensityIndex] + '_1Y'] = data[501][i]
-                    intensityIndex += 1
-                else:
-                    continue
-        except AssertionError:
-            print("Sample {}, {} does not have a matching bpm for the manifest you are supplying. Skipping sample.".format(data[10], gtc))
-            sys.stdout.flush()
-            logger.warning("Sample {}, {} does not have a matching bpm for the manifest you are supplying. Skipping sample.".format(data[10], gtc))
-            continue
-            
+    if cache is not None:
+        cache.close()
 
-    allIntesities = pandas.DataFrame(intensities_per_sample)
-    allIntensities_transpose = allIntesities.T
+    allIntensities_transpose = intensityTable(samples, sexes, intensities, intensity_probes)
     if os.path.exists(outDir) == False:
         os.mkdir(outDir)
     allIntensities_transpose.to_csv(os.path.join(outDir, fileOutName), index = True, sep = '\t')
 
 
-    allIntensities_transpose['sampleGroup'] = "samples"
-
-    images = list(allIntensities_transpose)
-    images.pop(images.index('sex'))
-    images.pop(images.index('sampleGroup'))
-    
-    for i in images:
-        mean = allIntensities_transpose[i].astype(int).mean()
-        upperStdSix = mean + (allIntensities_transpose[i].astype(int).std()*6)
-        lowerStdSix = mean - (allIntensities_transpose[i].astype(int).std()*6)
-        upperStdThree = mean + (allIntensities_transpose[i].astype(int).std()*3)
-        lowerStdThree = mean - (allIntensities_transpose[i].astype(int).std()*3)
-
-        removeOutliers = allIntensities_transpose.loc[(allIntensities_transpose[i].astype(int) > lowerStdThree) & 
-            (allIntensities_transpose[i].astype(int) < upperStdThree)]
-
-        fig, axs = plt.subplots(ncols=3)
-
-        sns.boxplot(x='sampleGroup', y=i, data = allIntensities_transpose, showfliers=False, color='white', ax=axs[0])
-        sns.stripplot(x='sampleGroup', y=i, data = allIntensities_transpose, hue='sex', palette="colorblind", ax=axs[0]).set_title(str(i) + '\n across all samples', fontsize=10)
-        axs[0].tick_params(axis='y', which='major', labelsize=8)
-
-        plotDevs = sns.boxplot(x='sampleGroup', y=i, data = allIntensities_transpose, showfliers=False, color='white', ax=axs[1])
-        plotDevs = sns.stripplot(x='sampleGroup', y=i, hue='sex', data = allIntensities_transpose, palette="colorblind", ax=axs[1])
-        axs[1].set_ylabel('')
-        axs[1].legend_.remove()
-        plotDevs.axhline(upperStdThree, ls='--', color='blue')
-        plotDevs.axhline(lowerStdThree, ls='--', color='blue')
-        plotDevs.axhline(upperStdSix, ls=':', color='orange')
-        plotDevs.axhline(lowerStdSix, ls=':', color='orange')
-        plotDevs.axhline(mean, ls='-.', color = 'green', linewidth=2)
-        axs[1].tick_params(axis='y', which='major', labelsize=8)
-        plotDevs.set_title(str(i) + '\n across all samples \n annotated mean and std devs', fontsize=10)
-        
-        sns.boxplot(x='sampleGroup', y=i, data = removeOutliers, showfliers=False, color='white', ax=axs[2])
-        sns.stripplot(x='sampleGroup', y=i, data = removeOutliers, hue='sex', palette="colorblind", ax=axs[2]).set_title(str(i) + '\n across all samples \n with < 3 std devs from mean', fontsize=10)
-        axs[2].set_ylabel('')
-        axs[2].tick_params(axis='y', which='major', labelsize=8)
-
-        axs[0].legend(loc=0)
-        axs[1].legend(loc=0)
-        axs[2].legend(loc=0)
-        plt.setp(axs)
-        
-        fig.set_size_inches(11, 7)
-        fig.savefig(prefix + str(i) + "Plots.png")
-
-        del removeOutliers
-        del plotDevs
-        del fig
-        del axs
\ No newline at end of file
+    if not self.noPlots:
+        qcPlots.intensityPlots(allIntensities_transpose, prefix, self.workers)
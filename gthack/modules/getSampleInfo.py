@@ -1,247 +1,161 @@
 import os
-import pandas
-import matplotlib.pyplot as plt
-import seaborn as sns
-import numpy as np
-from IlluminaBeadArrayFiles import *
+
+# toc IDs read from each gtc: sample name, plate, well, manifest, call rate, sex, logR dev, gc10
+SAMPLE_INFO_FIELDS = [10, 11, 12, 101, 1006, 1007, 1008, 1009]
+
+# gtcs handed to a worker process at a time
+CHUNK_SIZE = 64
+
 
 '''
-function: getSampleInfo(bpm, gtcDir, outDir)
-description: gets sample level information for all gtcs in a directory
-input:
-output:
+function: readSampleInfoChunk(gtcs, threads)
+description: extracts SAMPLE_INFO_FIELDS from a run of gtcs, on a pool of threads when threads > 1 so the reads of
+several gtcs wait on the file server at the same time
+input: list of gtc paths and number of threads
+output: list of data dictionaries, in the order of gtcs
 '''
-def reportSampleInfo(self):
+def readSampleInfoChunk(gtcs, threads=1):
     import gthack.modules.extractInformation as extractInformation
-    import logging
+    from concurrent.futures import ThreadPoolExecutor
+    from itertools import repeat
 
-    logger = logging.getLogger('reportSampleInfo')
+    if threads > 1 and len(gtcs) > 1:
+        with ThreadPoolExecutor(max_workers=min(threads, len(gtcs))) as executor:
+            return list(executor.map(extractInformation.getGtcInfo, gtcs, repeat(SAMPLE_INFO_FIELDS)))
+    return [extractInformation.getGtcInfo(gtc, SAMPLE_INFO_FIELDS) for gtc in gtcs]
+
+
+'''
+function: sampleInfo(gtcs, cache, mismatched, workers, threads)
+description: data of every gtc in order.  Gtcs known not to match the manifest or found in the cache are answered in
+this process; the others are parsed in chunks by a pool of worker processes (each with its own threads) and
+stored in the cache as they come back
+input: list of gtc paths, GtcCache object (or None), dictionary of gtc path -> data of gtcs already known not to match
+the manifest, number of worker processes and number of threads per process
+output: generator of (gtc path, data dictionary), in the order of gtcs
+'''
+def sampleInfo(gtcs, cache, mismatched, workers=1, threads=1):
+    from concurrent.futures import ProcessPoolExecutor
+    from itertools import repeat
+
+    known = {}
+    for gtc in gtcs:
+        data = mismatched.get(gtc) or (cache.get(gtc, SAMPLE_INFO_FIELDS) if cache is not None else None)
+        if data is not None:
+            known[gtc] = data
+    pending = [gtc for gtc in gtcs if gtc not in known]
+    chunks = [pending[start:start + CHUNK_SIZE] for start in range(0, len(pending), CHUNK_SIZE)]
+
+    def ordered(parsed):
+        parsed = (data for chunk in parsed for data in chunk)
+        for gtc in gtcs:
+            if gtc in known:
+                yield gtc, known[gtc]
+                continue
+            data = next(parsed)
+            if cache is not None:
+                cache.put(gtc, data)
+            yield gtc, data
+
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+            yield from ordered(executor.map(readSampleInfoChunk, chunks, repeat(threads)))
+    else:
+        yield from ordered(readSampleInfoChunk(chunk, threads) for chunk in chunks)
+
+
+'''
+function: writeSampleInfo(self, manifest, cache, gtcs, mismatched, logger)
+description: writes one row per gtc matching the manifest to fileOutName, in the order given, then the per-plate
+summary and plots.  Shared by reportSampleInfo and reportSampleInfoRecursive
+input: gtcFunction object, manifestIndex object, GtcCache object (or None), list of (gtc path, name reported for the
+gtc, location column), dictionary of gtc path -> data of gtcs already known not to match the manifest and the
+logger to report skipped gtcs to
+output: writes fileOutName, summaryStatsTable.txt and plots to the output directory
+'''
+def writeSampleInfo(self, manifest, cache, gtcs, mismatched, logger):
+    import gthack.modules.plateStats as plateStats
+    import gthack.modules.qcPlots as qcPlots
+    import pandas
 
-    bpm = self.bpm
-    gtcDir = self.gtcDir
     outDir = self.outDir
-    fileOutName = self.fileOutName
     if self.prefix != '':
         prefix = self.prefix + "_"
     else:
         prefix = self.prefix
 
-    nameMatch = open(os.path.join(outDir, fileOutName), 'w')
-    manifest = BeadPoolManifest(bpm)
-    input_gtc_list = [gtc for gtc in os.listdir(gtcDir) if gtc.endswith(".gtc")]
-
+    nameMatch = open(os.path.join(outDir, self.fileOutName), 'w')
+    summary = plateStats.PlateSummary()
     header = ['BTID', 'plate', 'well', 'gtcName', 'sampleID', 'callRate', 'gc10', 'sex', 'logrDev', 'location']
     nameMatch.write('\t'.join(header) + '\n')
-    
-    for sampleGtc in input_gtc_list:
-        try:
-            names = extractInformation.getGtcInfo(gtc=os.path.join(gtcDir, sampleGtc))
-            assert manifest.manifest_name == names[101]
-            nameMatch.write(names[10] + '\t' + 
-                names[11] + '\t' + names[12] + '\t' + 
-                sampleGtc + '\t' +
-                '{}-{}-{}'.format(names[11], names[12], names[10]) + 
-                '\t' + str(names[1006]) + '\t' + str(names[1009]) + '\t' +
-                str(names[1007]) + '\t' + str(names[1008]) + '\t' + gtcDir + '\n')
-
-        except AssertionError:
+
+    labels = {gtc: (sampleGtc, location) for gtc, sampleGtc, location in gtcs}
+    for gtc, names in sampleInfo([gtc for gtc, sampleGtc, location in gtcs], cache, mismatched, self.workers, self.threads):
+        sampleGtc, location = labels[gtc]
+        if manifest.manifest_name != names[101]:
             print("Error, sample {} in gtc {} does not have matching manifest/bpm file. Sample manifest is listed as {}.  Skipping sample.".format(
-             names[10], sampleGtc, names[101])) 
+             names[10], sampleGtc, names[101]))
             logger.warning('Error, sample {} in gtc {} does not have matching manifest/bpm file. Sample manifest is listed as {}.  Skipping sample.'.format(
              names[10], sampleGtc, names[101]))
+            continue
+
+        nameMatch.write(names[10] + '\t' +
+            names[11] + '\t' + names[12] + '\t' +
+            gtc.split('/')[-1] + '\t' +
+            '{}-{}-{}'.format(names[11], names[12], names[10]) +
+            '\t' + str(names[1006]) + '\t' + str(names[1009]) + '\t' +
+            str(names[1007]) + '\t' + str(names[1008]) + '\t' + location + '\n')
+        summary.add(names[11], names[12], names[10], {'callRate': names[1006], 'gc10': names[1009], 'logrDev': names[1008]})
+
+    if cache is not None:
+        cache.close()
 
-    nameMatch.flush()
-    
-    summaryData = pandas.read_table(nameMatch.name)
     nameMatch.close()
+    summary.write(os.path.join(outDir, prefix + 'summaryStatsTable.txt'))
+
+    if not self.noPlots:
+        summaryData = pandas.read_table(nameMatch.name)
+        qcPlots.sampleInfoPlots(summaryData, outDir, prefix, self.workers)
+
+
+'''
+function: getSampleInfo(bpm, gtcDir, outDir)
+description: gets sample level information for all gtcs in a directory
+input:
+output:
+'''
+def reportSampleInfo(self):
+    import gthack.modules.gtcCache as gtcCache
+    import gthack.modules.manifestIndex as manifestIndex
+    import logging
+
+    logger = logging.getLogger('reportSampleInfo')
+
+    gtcDir = self.gtcDir
+    manifest = manifestIndex.loadManifestIndex(self.bpm, cacheDir=self.manifestCache)
+    cache = gtcCache.openCache(self.cache, manifest.manifest_name, self.cacheSizeMB)
+    input_gtc_list = sorted(gtc for gtc in os.listdir(gtcDir) if gtc.endswith(".gtc"))
+
+    writeSampleInfo(self, manifest, cache, [(os.path.join(gtcDir, gtc), gtc, gtcDir) for gtc in input_gtc_list], {}, logger)
 
-    summaryStatsTable = summaryData.groupby('plate').agg(totalSamples=pandas.NamedAgg(column="plate", aggfunc='count'),
-        totalUniqueWells=pandas.NamedAgg(column='well', aggfunc='nunique'), 
-        totalUniqueBTID=pandas.NamedAgg(column='BTID', aggfunc='nunique'), 
-        meanCallrate=pandas.NamedAgg(column='callRate', aggfunc='mean'), 
-        stdDevCallrate=pandas.NamedAgg(column='callRate', aggfunc='std'), 
-        minCallrate=pandas.NamedAgg(column='callRate', aggfunc='min'), 
-        maxCallrate=pandas.NamedAgg(column='callRate', aggfunc='max'), 
-        medianCallrate=pandas.NamedAgg(column='callRate', aggfunc="median"), 
-        varianceCallrate=pandas.NamedAgg(column='callRate', aggfunc="var"),
-        meanGC10=pandas.NamedAgg(column='gc10', aggfunc='mean'), 
-        stdDevGC10=pandas.NamedAgg(column='gc10', aggfunc='std'), 
-        minGC10=pandas.NamedAgg(column='gc10', aggfunc='min'), 
-        maxGC10=pandas.NamedAgg(column='gc10', aggfunc='max'), 
-        medianGC10=pandas.NamedAgg(column='gc10', aggfunc="median"), 
-        varianceGC10=pandas.NamedAgg(column='gc10', aggfunc="var"),
-        meanLogRdev=pandas.NamedAgg(column='logrDev', aggfunc='mean'), 
-        stdDevLogRdev=pandas.NamedAgg(column='logrDev', aggfunc='std'), 
-        minLogRdev=pandas.NamedAgg(column='logrDev', aggfunc='min'), 
-        maxLogRdev=pandas.NamedAgg(column='logrDev', aggfunc='max'), 
-        medianLogRdev=pandas.NamedAgg(column='logrDev', aggfunc="median"), 
-        varianceLogRdev=pandas.NamedAgg(column='logrDev', aggfunc="var"))
-
-    summaryStatsTable.to_csv(os.path.join(outDir, prefix + 'summaryStatsTable.txt'), sep='\t', index=True)
-    summaryData['sampleGroup'] = "samples"
-
-    images = ['callRate', 'gc10', 'logrDev']
-    for i in images:
-        mean = summaryData[i].mean()
-        upperStdSix = mean + (summaryData[i].std()*6)
-        lowerStdSix = mean - (summaryData[i].std()*6)
-        upperStdThree = mean + (summaryData[i].std()*3)
-        lowerStdThree = mean - (summaryData[i].std()*3)
-
-        removeOutliers = summaryData.loc[(summaryData[i].astype(float) > lowerStdThree) & 
-            (summaryData[i].astype(float) < upperStdThree)]
-
-        fig, axs = plt.subplots(ncols=3)
-
-        sns.boxplot(x='sampleGroup', y=i, data = summaryData, showfliers=False, color='white', ax=axs[0])
-        sns.stripplot(x='sampleGroup', y=i, data = summaryData, hue='sex', palette="colorblind", ax=axs[0]).set_title(str(i) + ' across all samples', fontsize=10)
-        axs[0].tick_params(axis='y', which='major', labelsize=8)
-
-
-        plotDevs = sns.boxplot(x='sampleGroup', y=i, data = summaryData, showfliers=False, color='white', ax=axs[1])
-        plotDevs = sns.stripplot(x='sampleGroup', y=i, hue='sex', data = summaryData, palette="colorblind", ax=axs[1])
-        axs[1].set_ylabel('')
-        axs[1].legend_.remove()
-        plotDevs.axhline(upperStdThree, ls='--', color='blue')
-        plotDevs.axhline(lowerStdThree, ls='--', color='blue')
-        plotDevs.axhline(upperStdSix, ls=':', color='orange')
-        plotDevs.axhline(lowerStdSix, ls=':', color='orange')
-        plotDevs.axhline(mean, ls='-.', color = 'green', linewidth=2)
-        plotDevs.set_title(str(i) + ' across all samples \n annotated mean and std devs', fontsize=10)
-        axs[1].tick_params(axis='y', which='major', labelsize=8)
-
-
-        sns.boxplot(x='sampleGroup', y=i, data = removeOutliers, showfliers=False, color='white', ax=axs[2])
-        sns.stripplot(x='sampleGroup', y=i, data = removeOutliers, hue='sex', palette="colorblind", ax=axs[2]).set_title(str(i) + ' across all samples \n with < 3 std devs from mean', fontsize=10)
-        axs[2].set_ylabel('')
-        axs[2].tick_params(axis='y', which='major', labelsize=8)
-
-        axs[0].legend(loc=0)
-        axs[1].legend(loc=0)
-        axs[2].legend(loc=0)
-        plt.setp(axs)
-
-        fig.set_size_inches(11, 7)
-        fig.savefig(os.path.join(outDir, prefix + str(i)+"Plots.png"))
-
-        del removeOutliers
-      
 
 def reportSampleInfoRecursive(self):
-    import gthack.modules.extractInformation as extractInformation
+    import gthack.modules.gtcCache as gtcCache
+    import gthack.modules.manifestIndex as manifestIndex
     from pathlib import Path
     from os import fspath
     import logging
 
     logger = logging.getLogger('reportSampleInfoRecursive')
 
-    bpm = self.bpm
     gtcDir = self.gtcDir
-    outDir = self.outDir
-    fileOutName = self.fileOutName
-    if self.prefix != '':
-        prefix = self.prefix + "_"
+    manifest = manifestIndex.loadManifestIndex(self.bpm, cacheDir=self.manifestCache)
+    cache = gtcCache.openCache(self.cache, manifest.manifest_name, self.cacheSizeMB)
+    if self.inventoryFile is not None:
+        import gthack.modules.inventory as inventory
+        input_gtc_list, mismatched = inventory.readInventory(self.inventoryFile, manifest.manifest_name)
     else:
-        prefix = self.prefix
-
-    nameMatch = open(os.path.join(outDir, fileOutName), 'w')
-    manifest = BeadPoolManifest(bpm)
-    input_gtc_list = [fspath(gtc) for gtc in Path(gtcDir).rglob('*.gtc')]
- 
-    header = ['BTID', 'plate', 'well', 'gtcName', 'sampleID', 'callRate', 'gc10', 'sex', 'logrDev', 'location']
-    nameMatch.write('\t'.join(header) + '\n')
-    
-    for sampleGtc in input_gtc_list:
-        try:
-            names = extractInformation.getGtcInfo(gtc=sampleGtc)
-            assert manifest.manifest_name == names[101]
-            nameMatch.write(names[10] + '\t' + 
-                names[11] + '\t' + names[12] + '\t' + 
-                sampleGtc.split('/')[-1] + '\t' +
-                '{}-{}-{}'.format(names[11], names[12], names[10]) + 
-                '\t' + str(names[1006]) + '\t' + str(names[1009]) + '\t' +
-                str(names[1007]) + '\t' + str(names[1008]) + '\t' + '/'.join(sampleGtc.split('/')[:-1]) + '\n')
-
-        except AssertionError:
-            print("Error, sample {} in gtc {} does not have matching manifest/bpm file. Sample manifest is listed as {}.  Skipping sample.".format(
-             names[10], sampleGtc, names[101]))
-            logger.warning("Error, sample {} in gtc {} does not have matching manifest/bpm file. Sample manifest is listed as {}.  Skipping sample.".format(
-             names[10], sampleGtc, names[101]))
-
-    nameMatch.flush()
-    
-    summaryData = pandas.read_table(nameMatch.name)
-    nameMatch.close()
+        input_gtc_list = sorted(fspath(gtc) for gtc in Path(gtcDir).rglob('*.gtc'))
+        mismatched = {}
 
-    summaryStatsTable = summaryData.groupby('plate').agg(
-        totalSamples=pandas.NamedAgg(column="plate", aggfunc='count'),
-        totalUniqueWells=pandas.NamedAgg(column='well', aggfunc='nunique'),
-        totalUniqueBTID=pandas.NamedAgg(column='BTID', aggfunc='nunique'),
-        meanCallrate=pandas.NamedAgg(column='callRate', aggfunc='mean'),
-        stdDevCallrate=pandas.NamedAgg(column='callRate', aggfunc='std'),
-        minCallrate=pandas.NamedAgg(column='callRate', aggfunc='min'),
-        maxCallrate=pandas.NamedAgg(column='callRate', aggfunc='max'),
-        medianCallrate=pandas.NamedAgg(column='callRate', aggfunc="median"),
-        varianceCallrate=pandas.NamedAgg(column='callRate', aggfunc="var"),
-        meanGC10=pandas.NamedAgg(column='gc10', aggfunc='mean'),
-        stdDevGC10=pandas.NamedAgg(column='gc10', aggfunc='std'),
-        minGC10=pandas.NamedAgg(column='gc10', aggfunc='min'),
-        maxGC10=pandas.NamedAgg(column='gc10', aggfunc='max'),
-        medianGC10=pandas.NamedAgg(column='gc10', aggfunc="median"),
-        varianceGC10=pandas.NamedAgg(column='gc10', aggfunc="var"),
-        meanLogRdev=pandas.NamedAgg(column='logrDev', aggfunc='mean'),
-        stdDevLogRdev=pandas.NamedAgg(column='logrDev', aggfunc='std'),
-        minLogRdev=pandas.NamedAgg(column='logrDev', aggfunc='min'),
-        maxLogRdev=pandas.NamedAgg(column='logrDev', aggfunc='max'),
-        medianLogRdev=pandas.NamedAgg(column='logrDev', aggfunc="median"),
-        varianceLogRdev=pandas.NamedAgg(column='logrDev', aggfunc="var"))
-
-    summaryStatsTable.to_csv(os.path.join(outDir, prefix + 'summaryStatsTable.txt'),sep='\t',index=True)
-
-    summaryData['sampleGroup'] = "samples"
-
-    images = ['callRate', 'gc10', 'logrDev']
-    for i in images:
-        mean = summaryData[i].mean()
-        upperStdSix = mean + (summaryData[i].std()*6)
-        lowerStdSix = mean - (summaryData[i].std()*6)
-        upperStdThree = mean + (summaryData[i].std()*3)
-        lowerStdThree = mean - (summaryData[i].std()*3)
-
-        removeOutliers = summaryData.loc[(summaryData[i].astype(float) > lowerStdThree) & 
-            (summaryData[i].astype(float) < upperStdThree)]
-
-        fig, axs = plt.subplots(ncols=3)
-
-        sns.boxplot(x='sampleGroup', y=i, data = summaryData, showfliers=False, color='white', ax=axs[0])
-        sns.stripplot(x='sampleGroup', y=i, data = summaryData, hue='sex', palette="colorblind", ax=axs[0]).set_title(str(i) + ' across all samples', fontsize=10)
-        axs[0].tick_params(axis='y', which='major', labelsize=8)
-
-
-        plotDevs = sns.boxplot(x='sampleGroup', y=i, data = summaryData, showfliers=False, color='white', ax=axs[1])
-        plotDevs = sns.stripplot(x='sampleGroup', y=i, hue='sex', data = summaryData, palette="colorblind", ax=axs[1])
-        axs[1].set_ylabel('')
-        axs[1].legend_.remove()
-        plotDevs.axhline(upperStdThree, ls='--', color='blue')
-        plotDevs.axhline(lowerStdThree, ls='--', color='blue')
-        plotDevs.axhline(upperStdSix, ls=':', color='orange')
-        plotDevs.axhline(lowerStdSix, ls=':', color='orange')
-        plotDevs.axhline(mean, ls='-.', color = 'green', linewidth=2)
-        plotDevs.set_title(str(i) + ' across all samples \n annotated mean and std devs', fontsize=10)
-        axs[1].tick_params(axis='y', which='major', labelsize=8)
-
-
-        sns.boxplot(x='sampleGroup', y=i, data = removeOutliers, showfliers=False, color='white', ax=axs[2])
-        sns.stripplot(x='sampleGroup', y=i, data = removeOutliers, hue='sex', palette="colorblind", ax=axs[2]).set_title(str(i) + ' across all samples \n with < 3 std devs from mean', fontsize=10)
-        axs[2].set_ylabel('')
-        axs[2].tick_params(axis='y', which='major', labelsize=8)
-
-        axs[0].legend(loc=0)
-        axs[1].legend(loc=0)
-        axs[2].legend(loc=0)
-        plt.setp(axs)
-
-        fig.set_size_inches(11, 7)
-        fig.savefig(os.path.join(outDir, prefix + str(i)+"Plots.png"))
-
-        del removeOutliers
+    writeSampleInfo(self, manifest, cache, [(gtc, gtc, '/'.join(gtc.split('/')[:-1])) for gtc in input_gtc_list], mismatched, logger)
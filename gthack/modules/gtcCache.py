@@ -0,0 +1,166 @@
+import os
+import json
+import sqlite3
+import time
+import logging
+import numpy
+
+CACHE_FILE_NAME = 'gtcCache.sqlite'
+
+
+'''
+function: encodeData(data)
+description: serializes a data dictionary of gtc elements for the cache as JSON; strings and numbers are stored as
+they are, bytes and numpy arrays as tagged objects.  JSON is used so a cache file written by someone else can hold
+nothing but data
+input: data dictionary of toc ID -> element
+output: JSON as bytes
+'''
+def encodeData(data):
+    encoded = {}
+    for toc_id, value in data.items():
+        if isinstance(value, numpy.ndarray):
+            value = {'dtype': value.dtype.str, 'values': value.tolist()}
+        elif isinstance(value, bytes):
+            value = {'bytes': value.decode('latin-1')}
+        elif isinstance(value, numpy.generic):
+            value = value.item()
+        encoded[str(toc_id)] = value
+    return json.dumps(encoded).encode()
+
+
+'''
+function: decodeData(blob)
+description: data dictionary of an entry written by encodeData
+input: JSON as bytes
+output: data dictionary of toc ID -> element (raises ValueError for anything else, e.g. entries of older versions)
+'''
+def decodeData(blob):
+    data = {}
+    for toc_id, value in json.loads(blob).items():
+        if isinstance(value, dict) and 'dtype' in value:
+            value = numpy.array(value['values'], dtype=value['dtype'])
+        elif isinstance(value, dict) and 'bytes' in value:
+            value = value['bytes'].encode('latin-1')
+        data[int(toc_id)] = value
+    return data
+
+'''
+class: GtcCache(cachePath, manifestName, maxSizeMB)
+description: persistent on-disk cache of elements extracted from gtc files.  Entries are keyed by the absolute path
+of the gtc together with its size, modification time and the manifest name of the bpm in use; a gtc that has been
+rewritten or is read against a different manifest is a cache miss.  When the cache grows past maxSizeMB the least
+recently used entries are evicted on close.
+input: path to a sqlite file or a directory to create gtcCache.sqlite in, manifest name of the bpm, size bound in MB
+output: GtcCache object
+'''
+class GtcCache:
+
+    def __init__(self, cachePath, manifestName, maxSizeMB=512):
+        self.logger = logging.getLogger('gtcCache')
+        if os.path.isdir(cachePath):
+            cachePath = os.path.join(cachePath, CACHE_FILE_NAME)
+        self.cachePath = cachePath
+        self.manifestName = manifestName
+        self.maxSize = maxSizeMB * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self.pending = 0
+
+        self.connection = sqlite3.connect(cachePath)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS gtcs (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, '
+            'manifest TEXT, data BLOB, lastUsed REAL)')
+        self.logger.debug('Opened gtc cache {}'.format(cachePath))
+
+    def key(self, gtc):
+        stats = os.stat(gtc)
+        return os.path.abspath(gtc), stats.st_size, stats.st_mtime_ns
+
+    def get(self, gtc, fields):
+        path, size, mtime = self.key(gtc)
+        row = self.connection.execute('SELECT size, mtime, manifest, data FROM gtcs WHERE path = ?', (path,)).fetchone()
+        if row is None or row[:3] != (size, mtime, self.manifestName):
+            self.misses += 1
+            return None
+
+        try:
+            data = decodeData(row[3])
+        except (ValueError, TypeError):
+            self.misses += 1
+            return None
+        if data.get(101, self.manifestName) != self.manifestName and 10 in data:
+            # a gtc made with another manifest is only reported (sample name and manifest) and skipped by every
+            # method, and its other elements may never have been read, so the entry answers any request
+            self.connection.execute('UPDATE gtcs SET lastUsed = ? WHERE path = ?', (time.time(), path))
+            self.hits += 1
+            return {toc_id: data[toc_id] for toc_id in fields if toc_id in data}
+        if any(toc_id not in data for toc_id in fields):
+            self.misses += 1
+            return None
+
+        self.connection.execute('UPDATE gtcs SET lastUsed = ? WHERE path = ?', (time.time(), path))
+        self.hits += 1
+        return {toc_id: data[toc_id] for toc_id in fields}
+
+    def put(self, gtc, data):
+        path, size, mtime = self.key(gtc)
+        # keep elements cached by other methods for the same unchanged file
+        row = self.connection.execute('SELECT size, mtime, manifest, data FROM gtcs WHERE path = ?', (path,)).fetchone()
+        if row is not None and row[:3] == (size, mtime, self.manifestName):
+            try:
+                cached = decodeData(row[3])
+                cached.update(data)
+                data = cached
+            except (ValueError, TypeError):
+                pass
+
+        self.connection.execute('INSERT OR REPLACE INTO gtcs VALUES (?, ?, ?, ?, ?, ?)',
+            (path, size, mtime, self.manifestName, encodeData(data), time.time()))
+        self.pending += 1
+        if self.pending >= 1000:
+            self.connection.commit()
+            self.pending = 0
+
+    def evict(self):
+        self.connection.execute('DELETE FROM gtcs WHERE path IN (SELECT path FROM (SELECT path, '
+            'SUM(LENGTH(data)) OVER (ORDER BY lastUsed DESC) AS running FROM gtcs) WHERE running > ?)', (self.maxSize,))
+
+    def close(self):
+        self.evict()
+        self.connection.commit()
+        self.connection.close()
+        self.logger.info('gtc cache {}: {} hits, {} misses'.format(self.cachePath, self.hits, self.misses))
+
+
+'''
+function: openCache(cachePath, manifestName)
+description: opens the gtc cache if one was requested at runtime
+input: value of --cache (None when caching is off) and the manifest name of the bpm in use
+output: GtcCache object or None
+'''
+def openCache(cachePath, manifestName, maxSizeMB=512):
+    if cachePath is None:
+        return None
+    return GtcCache(cachePath, manifestName, maxSizeMB)
+
+
+'''
+function: getGtcInfo(cache, gtc, fields, extract)
+description: extractInformation.getGtcInfo served from the cache when the gtc is unchanged since it was cached
+input: GtcCache object (or None), name of gtc file, the list of toc IDs to extract and optionally a function
+(gtc, fields) -> data dictionary to read them with instead of extractInformation.getGtcInfo
+output: data dictionary of the requested elements of that gtc file
+'''
+def getGtcInfo(cache, gtc, fields, extract=None):
+    if extract is None:
+        import gthack.modules.extractInformation as extractInformation
+        extract = extractInformation.getGtcInfo
+
+    if cache is None:
+        return extract(gtc, fields)
+
+    data = cache.get(gtc, fields)
+    if data is None:
+        data = extract(gtc, fields)
+        cache.put(gtc, data)
+    return data
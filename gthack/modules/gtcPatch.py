@@ -0,0 +1,85 @@
+import os
+import shutil
+import logging
+
+# metadata entries that are written as a length-prefixed string; 1007 (sex) is a single fixed-width character
+STRING_TOC_IDS = [10, 11, 12, 1016]
+
+
+'''
+function: copyGtc(source, destination)
+description: copies a gtc inside the kernel with copy_file_range, falling back to shutil (sendfile) where that is not available
+input: path of source gtc and path of the copy
+output: None
+'''
+def copyGtc(source, destination):
+    with open(source, 'rb') as sourceHandle, open(destination, 'wb') as destinationHandle:
+        remaining = os.fstat(sourceHandle.fileno()).st_size
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(sourceHandle.fileno(), destinationHandle.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+            if remaining == 0:
+                return
+        except (AttributeError, OSError):
+            pass
+
+    shutil.copyfile(source, destination)
+
+
+'''
+function: metaDataPatches(view, metaDataUpdates)
+description: finds where each metadata update can be written over the bytes of the original value
+input: GtcView of the source gtc and dictionary of toc ID -> new value in bytes (as made by manipulateGTC.updateMetaData)
+output: list of (offset, bytes) to write, or None if a value changes length and the gtc has to be re-serialized
+'''
+def metaDataPatches(view, metaDataUpdates):
+    patches = []
+    for toc_id, value in metaDataUpdates.items():
+        if toc_id in STRING_TOC_IDS:
+            offset, length = view.stringSpan(toc_id)
+        elif toc_id == 1007:
+            offset, length = view.toc[toc_id], 1
+        else:
+            return None
+        if len(value) != length:
+            return None
+        patches.append((offset, value))
+
+    return patches
+
+
+'''
+function: patchGtc(source, output, metaDataUpdates, snpUpdates)
+description: writes a manipulated gtc by copying the source and rewriting only the genotype (1002) and base call (1003)
+bytes of the updated snps and any metadata of unchanged length; every other byte stays identical to the source
+input: path of source gtc, path of new gtc, metadata updates (toc ID -> bytes) and the compiled snp updates
+(SNP indices, genotypes and base calls from genotypeTranslation.compileLines)
+output: True if the gtc was patched, False if metadata changes length and the caller has to re-serialize it instead
+'''
+def patchGtc(source, output, metaDataUpdates, snpUpdates):
+    import gthack.modules.gtcView as gtcView
+    import gthack.modules.genotypeTranslation as genotypeTranslation
+
+    logger = logging.getLogger('patchGtc')
+
+    with gtcView.GtcView(source) as view:
+        patches = metaDataPatches(view, metaDataUpdates)
+    if patches is None:
+        logger.info('Metadata of {} changes length, re-serializing instead of patching'.format(output))
+        return False
+
+    copyGtc(source, output)
+    view = gtcView.GtcView(output, writable=True)
+    for offset, value in patches:
+        view.buffer[offset:offset + len(value)] = value
+    data = {1002: view.genotypes, 1003: view.base_calls}
+    genotypeTranslation.applyUpdates(data, *snpUpdates)
+    del data
+    view.buffer.flush()
+    view.close()
+
+    logger.info('Patched {} snps and {} metadata values into {}'.format(len(snpUpdates[0]), len(patches), output))
+    return True
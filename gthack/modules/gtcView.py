@@ -0,0 +1,196 @@
+import mmap
+import struct
+import hashlib
+import logging
+import numpy
+
+'''
+PER_SNP_TYPES: numpy dtype of every per-SNP toc entry.  Each of these entries is stored in the gtc as an int32
+element count followed by the packed elements, so they can be exposed directly as arrays over the file buffer.
+'''
+PER_SNP_TYPES = {
+    1000: numpy.dtype('<u2'),  # raw X intensities
+    1001: numpy.dtype('<u2'),  # raw Y intensities
+    1002: numpy.dtype('u1'),  # genotypes (0=NC, 1=AA, 2=AB, 3=BB)
+    1003: numpy.dtype('S2'),  # base calls, 2 characters per SNP (diploid)
+    1004: numpy.dtype('<f4'),  # genotype scores
+    1012: numpy.dtype('<f4'),  # B allele frequencies
+    1013: numpy.dtype('<f4'),  # log R ratios
+}
+
+# control probe intensities (92 values each), stored like the per-SNP sections
+CONTROL_TYPES = {
+    500: numpy.dtype('<u2'),
+    501: numpy.dtype('<u2'),
+}
+
+# size in bytes of the fixed-width toc entries: call rate, gender, logR dev, GC10, GC50 (+ call counts), percentiles
+FIXED_SIZES = {1006: 4, 1007: 1, 1008: 4, 1009: 4, 1011: 16, 1014: 6, 1015: 6}
+
+# toc entries whose value is stored directly in the table of contents instead of at an offset
+INLINE_TOC_IDS = [1, 2, 3]
+
+# toc entries stored as a single string: sample name, plate, well, cluster file, manifest, imaging and autocall dates,
+# autocall version and slide identifier
+STRING_TOC_IDS = [10, 11, 12, 100, 101, 200, 201, 300, 1016]
+
+# size in bytes of one normalization transform (version and 12 floats); toc 400 is a count followed by these records
+NORMALIZATION_TRANSFORM_SIZE = 52
+
+
+'''
+class: GtcView(gtc, writable)
+description: memory-mapped view of a gtc file.  The header and table of contents are parsed on creation; per-SNP
+sections are returned as numpy arrays over the mapped file without copying.  By default the mapping is copy-on-write,
+so arrays can be edited in place while the file on disk stays untouched; a writable view writes edits to the file.
+input: name of gtc file and whether edits go to the file (default: False)
+output: GtcView object
+'''
+class GtcView:
+
+    def __init__(self, gtc, writable=False):
+        self.gtc = gtc
+        with open(gtc, 'r+b' if writable else 'rb') as handle:
+            self.buffer = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_COPY)
+
+        if self.buffer[:3] != b'gtc':
+            raise Exception('GTC format error: bad format identifier in {}'.format(gtc))
+        self.version = self.buffer[3]
+        num_entries = struct.unpack_from('<i', self.buffer, 4)[0]
+        self.toc = {}
+        for entry in range(num_entries):
+            toc_id, offset = struct.unpack_from('<Hi', self.buffer, 8 + entry * 6)
+            self.toc[toc_id] = offset
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        # numpy views keep the mapping exported; it is released once the last view is garbage collected
+        try:
+            self.buffer.close()
+        except BufferError:
+            pass
+
+    def inline(self, toc_id):
+        return self.toc[toc_id]
+
+    def count(self, toc_id):
+        return struct.unpack_from('<i', self.buffer, self.toc[toc_id])[0]
+
+    def array(self, toc_id):
+        offset = self.toc[toc_id]
+        dtype = PER_SNP_TYPES[toc_id] if toc_id in PER_SNP_TYPES else CONTROL_TYPES[toc_id]
+        return numpy.frombuffer(self.buffer, dtype=dtype, count=self.count(toc_id), offset=offset + 4)
+
+    def stringSpan(self, toc_id):
+        return self.stringAt(self.toc[toc_id])
+
+    def stringAt(self, offset):
+        # strings are a 7-bit variable length integer followed by that many bytes
+        length, shift = 0, 0
+        while True:
+            partial = self.buffer[offset]
+            offset += 1
+            length |= (partial & 0x7F) << shift
+            shift += 7
+            if partial & 0x80 == 0:
+                break
+        return offset, length
+
+    def span(self, toc_id):
+        # byte range of an entry: array sections (count included), fixed-width values and strings (length included)
+        offset = self.toc[toc_id]
+        if toc_id in PER_SNP_TYPES or toc_id in CONTROL_TYPES:
+            dtype = PER_SNP_TYPES[toc_id] if toc_id in PER_SNP_TYPES else CONTROL_TYPES[toc_id]
+            return offset, offset + 4 + self.count(toc_id) * dtype.itemsize
+        if toc_id in FIXED_SIZES:
+            return offset, offset + FIXED_SIZES[toc_id]
+        if toc_id in STRING_TOC_IDS:
+            start, length = self.stringAt(offset)
+            return offset, start + length
+        if toc_id == 400:
+            return offset, offset + 4 + self.count(toc_id) * NORMALIZATION_TRANSFORM_SIZE
+        if toc_id == 1005:
+            # scanner data: name, PMT green (int), PMT red (int), scanner version and imaging user
+            start, length = self.stringAt(offset)
+            start, length = self.stringAt(start + length + 8)
+            start, length = self.stringAt(start + length)
+            return offset, start + length
+        raise ValueError('toc entry {} of {} has no known byte range'.format(toc_id, self.gtc))
+
+    def digest(self, start, end):
+        # hashlib releases the GIL on large buffers, so digests of different files can be taken on parallel threads
+        if end > len(self.buffer):
+            raise ValueError('{} ends at byte {}, before byte {}'.format(self.gtc, len(self.buffer), end))
+        with memoryview(self.buffer) as view:
+            return hashlib.sha1(view[start:end]).digest()
+
+    def string(self, toc_id):
+        offset, length = self.stringSpan(toc_id)
+        return self.buffer[offset:offset + length].decode()
+
+    def float(self, toc_id):
+        return struct.unpack_from('<f', self.buffer, self.toc[toc_id])[0]
+
+    def char(self, toc_id):
+        offset = self.toc[toc_id]
+        return self.buffer[offset:offset + 1]
+
+    @property
+    def raw_x(self):
+        return self.array(1000)
+
+    @property
+    def raw_y(self):
+        return self.array(1001)
+
+    @property
+    def genotypes(self):
+        return self.array(1002)
+
+    @property
+    def base_calls(self):
+        return self.array(1003)
+
+    @property
+    def genotype_scores(self):
+        return self.array(1004)
+
+    @property
+    def ballele_freqs(self):
+        return self.array(1012)
+
+    @property
+    def logr_ratios(self):
+        return self.array(1013)
+
+
+'''
+function: getGtcInfo(gtc)
+description: same data dictionary as extractInformation.getGtcInfo, but the per-SNP sections (1000-1004, 1012, 1013)
+are copy-on-write numpy views over the memory-mapped file, so they can be edited in place before write_gtc
+input: name of gtc file
+output: data dictionary of all elements of that gtc file
+'''
+def getGtcInfo(gtc):
+    import gthack.modules.extractInformation as extractInformation
+
+    logger = logging.getLogger('gtcView')
+    logger.info('Mapping {}'.format(gtc.split('/')[-1]))
+
+    view = GtcView(gtc)
+    gtcInfo = extractInformation.LazyGtcInfo(gtc, fields=[toc_id for toc_id, getter in extractInformation.GTC_ELEMENTS if toc_id not in PER_SNP_TYPES])
+
+    data = {}
+    for toc_id, getter in extractInformation.GTC_ELEMENTS:
+        if toc_id in PER_SNP_TYPES:
+            data[toc_id] = view.array(toc_id)
+        else:
+            data[toc_id] = gtcInfo[toc_id]
+    view.close()
+
+    return data
@@ -0,0 +1,97 @@
+import os
+import sys
+import logging
+
+INVENTORY_COLUMNS = ['path', 'gtcName', 'location', 'BTID', 'plate', 'well', 'manifest', 'slideID', 'autocallVersion', 'autocallDate']
+
+'''
+function: inventoryRow(gtc)
+description: reads the header, table of contents and the small string sections of a single gtc; per-SNP sections are never touched
+input: full path to a gtc file
+output: tuple of the list of values in the order of INVENTORY_COLUMNS and None, or None and the error if the file
+cannot be read as a gtc
+'''
+def inventoryRow(gtc):
+    import gthack.modules.gtcView as gtcView
+
+    # a truncated, old or foreign file is reported instead of stopping the whole scan
+    try:
+        with gtcView.GtcView(gtc) as view:
+            return [gtc, os.path.basename(gtc), os.path.dirname(gtc),
+                view.string(10), view.string(11), view.string(12), view.string(101),
+                view.string(1016), view.string(300), view.string(201)], None
+    except Exception as error:
+        return None, '{}: {}'.format(type(error).__name__, error)
+
+
+'''
+function: gtcInventory(self)
+description: writes an index of every gtc under --gtcDir (sample name, plate, well, manifest, slide ID, autocall version and date)
+input: gtcFunction object
+output: tab-delimited file, or parquet file if --fileOutName ends with .parquet, in the output directory
+'''
+def gtcInventory(self):
+    import pandas
+    from concurrent.futures import ThreadPoolExecutor
+    from pathlib import Path
+
+    logger = logging.getLogger('gtcInventory')
+    logger.debug('In method gtcInventory')
+
+    gtcDir = self.gtcDir
+    outDir = self.outDir
+    fileOutName = self.fileOutName
+
+    if self.recursive:
+        input_gtc_list = sorted(os.fspath(gtc) for gtc in Path(gtcDir).rglob('*.gtc'))
+    else:
+        input_gtc_list = sorted(os.path.join(gtcDir, gtc) for gtc in os.listdir(gtcDir) if gtc.endswith('.gtc'))
+
+    logger.info('Indexing {} gtc files'.format(len(input_gtc_list)))
+
+    # reads are latency bound on network storage, threads keep many headers in flight at once
+    with ThreadPoolExecutor() as executor:
+        rows = []
+        for gtc, (row, error) in zip(input_gtc_list, executor.map(inventoryRow, input_gtc_list)):
+            if row is None:
+                logger.warning('Could not read {} ({}).  Leaving it out of the inventory.'.format(gtc, error))
+                print('Could not read {} ({}).  Leaving it out of the inventory.'.format(gtc, error))
+                continue
+            rows.append(row)
+    if len(rows) < len(input_gtc_list):
+        logger.warning('{} of {} gtc files could not be read'.format(len(input_gtc_list) - len(rows), len(input_gtc_list)))
+
+    inventoryTable = pandas.DataFrame(rows, columns=INVENTORY_COLUMNS)
+    if fileOutName.endswith('.parquet'):
+        try:
+            inventoryTable.to_parquet(os.path.join(outDir, fileOutName), index=False)
+        except ImportError:
+            logger.critical('Writing parquet requires pyarrow or fastparquet to be installed')
+            print('Writing parquet requires pyarrow or fastparquet to be installed')
+            sys.exit()
+    else:
+        inventoryTable.to_csv(os.path.join(outDir, fileOutName), sep='\t', index=False)
+
+    logger.info('Wrote inventory of {} gtc files to {}'.format(len(rows), os.path.join(outDir, fileOutName)))
+    print('Wrote inventory of {} gtc files to {}'.format(len(rows), os.path.join(outDir, fileOutName)))
+
+
+'''
+function: readInventory(inventoryFile, manifestName)
+description: loads an index written by gtcInventory in place of walking --gtcDir
+input: path to an inventory file (tab-delimited or .parquet) and the manifest name of the bpm in use
+output: list of gtc paths, and a dictionary of path -> {10: sample name, 101: manifest} for gtcs whose manifest does not match
+'''
+def readInventory(inventoryFile, manifestName):
+    import pandas
+
+    if inventoryFile.endswith('.parquet'):
+        inventoryTable = pandas.read_parquet(inventoryFile)
+    else:
+        inventoryTable = pandas.read_table(inventoryFile, dtype=str, keep_default_na=False)
+
+    input_gtc_list = list(inventoryTable['path'])
+    mismatched = {row.path: {10: row.BTID, 101: row.manifest}
+        for row in inventoryTable.itertuples() if row.manifest != manifestName}
+
+    return input_gtc_list, mismatched
@@ -0,0 +1,237 @@
+import os
+import json
+import logging
+import numpy
+
+# per-SNP arrays of a ManifestIndex, all indexed by bpm position; these are what the manifest cache stores
+COLUMNS = ['names', 'snps', 'ref_strands', 'normalization_ids', 'chroms', 'map_infos', 'allele_a', 'allele_b']
+
+'''
+function: read_csv(file_path)
+description: streams the assay rows of a bpm manifest in csv form (the 7 heading lines are skipped)
+input: path to manifest csv
+output: generator of dictionaries of column name -> value, one per row
+'''
+def read_csv(file_path):
+    import csv
+
+    with open(file_path) as f:
+        reader = csv.reader(f)
+        for i in range(7):
+            next(reader)
+        header = next(reader)
+        for row in reader:
+            yield dict(zip(header, row))
+
+
+'''
+function: parse_top_genomic_seq(top_genomic_seq)
+description: gets the alleles of a TopGenomicSeq, which are in the format [alphabet/alphabet] anywhere in the sequence
+input: TopGenomicSeq string from the manifest csv
+output: tuple of (allele A, allele B), or 'NA' if the sequence has no allele pair
+'''
+def parse_top_genomic_seq(top_genomic_seq):
+    for i in range(len(top_genomic_seq) - 4):
+        if top_genomic_seq[i] == '[' and top_genomic_seq[i + 4] == ']':
+            return top_genomic_seq[i + 1], top_genomic_seq[i + 3]
+    return 'NA'
+
+
+'''
+class: ManifestIndex(columns, manifest_name, control_config)
+description: per-SNP lookups of a bpm manifest built once and shared by the manipulation, override and query paths.
+Holds the SNP names with a name -> index hash map, the bpm snp strings, ref strands and normalization IDs, the
+chromosome/position of every SNP and the A/B alleles parsed from the TopGenomicSeq column of the manifest csv.
+input: dictionary of the numpy arrays listed in COLUMNS, manifest name and control config of the bpm
+output: ManifestIndex object
+'''
+class ManifestIndex:
+
+    def __init__(self, columns, manifest_name, control_config):
+        self.manifest_name = manifest_name
+        self.control_config = control_config
+        for column in COLUMNS:
+            setattr(self, column, columns[column])
+        self._index = None
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def index(self):
+        # built on first lookup, commands that never resolve SNP names do not pay for it
+        if self._index is None:
+            self._index = {name: loc for loc, name in enumerate(self.names.tolist())}
+        return self._index
+
+    def locate(self, name):
+        try:
+            return self.index[name.encode()]
+        except KeyError:
+            raise ValueError('{} is not in manifest {}'.format(name, self.manifest_name))
+
+    def name(self, loc):
+        return self.names[loc].decode()
+
+    def snpWidth(self):
+        # characters a bpm snp string can hold; longer values would be cut silently by the fixed-width column
+        return self.snps.dtype.itemsize // numpy.dtype('U1').itemsize
+
+    def override(self, name, snp):
+        if len(snp) > self.snpWidth():
+            raise ValueError('{} is longer than the {} characters of the snp column of manifest {}'.format(snp, self.snpWidth(), self.manifest_name))
+        self.snps[self.locate(name)] = snp
+
+    def save(self, cachePath, metaData):
+        import tempfile
+        import shutil
+
+        # written to a temporary directory and renamed so readers never see a partial cache
+        tmpPath = tempfile.mkdtemp(prefix='.tmp_', dir=os.path.dirname(cachePath))
+        try:
+            for column in COLUMNS:
+                numpy.save(os.path.join(tmpPath, column + '.npy'), getattr(self, column))
+            metaData = dict(metaData, manifest_name=self.manifest_name, control_config=self.control_config)
+            with open(os.path.join(tmpPath, 'meta.json'), 'w') as metaFile:
+                json.dump(metaData, metaFile)
+            os.rename(tmpPath, cachePath)
+        finally:
+            shutil.rmtree(tmpPath, ignore_errors=True)
+
+
+'''
+function: buildManifestIndex(manifest, bpm_csv)
+description: builds the ManifestIndex of a parsed bpm; alleles, chromosome and position are taken from the
+manifest csv when given, csv rows are matched to bpm SNPs by name
+input: BeadPoolManifest object and optionally the path to the manifest in csv form
+output: ManifestIndex object
+'''
+def buildManifestIndex(manifest, bpm_csv=None):
+    logger = logging.getLogger('buildManifestIndex')
+
+    names = list(manifest.names)
+    chroms = list(manifest.chroms)
+    map_infos = list(manifest.map_infos)
+    alleles = ['NA'] * len(names)
+
+    if bpm_csv is not None:
+        index = {name: loc for loc, name in enumerate(names)}
+        missing = 0
+        for row in read_csv(bpm_csv):
+            if 'Name' not in row or 'TopGenomicSeq' not in row:
+                continue
+            loc = index.get(row['Name'])
+            if loc is None:
+                missing += 1
+                continue
+            alleles[loc] = parse_top_genomic_seq(row['TopGenomicSeq'])
+            if row.get('Chr'):
+                chroms[loc] = row['Chr']
+            if row.get('MapInfo', '').isdigit():
+                map_infos[loc] = int(row['MapInfo'])
+        if missing > 0:
+            logger.warning('{} SNPs in {} are not in bpm {}'.format(missing, bpm_csv, manifest.manifest_name))
+
+    columns = {
+        'names': numpy.array([name.encode() for name in names], dtype=bytes),
+        'snps': numpy.array([snp.decode() if isinstance(snp, bytes) else snp for snp in manifest.snps], dtype=str),
+        'ref_strands': numpy.array(manifest.ref_strands, dtype=numpy.int8),
+        'normalization_ids': numpy.array(manifest.normalization_ids, dtype=numpy.int32),
+        'chroms': numpy.array(chroms, dtype=str),
+        'map_infos': numpy.array(map_infos, dtype=numpy.int64),
+        # a SNP without a TopGenomicSeq allele pair keeps 'NA' -> ('N', 'A')
+        'allele_a': numpy.array([allele[0] for allele in alleles], dtype='U1'),
+        'allele_b': numpy.array([allele[1] for allele in alleles], dtype='U1'),
+    }
+
+    logger.debug('Indexed {} SNPs of manifest {}'.format(len(names), manifest.manifest_name))
+    return ManifestIndex(columns, manifest.manifest_name, manifest.control_config)
+
+
+'''
+function: checksum(file_path)
+description: sha1 of a file, read in 1 MB blocks
+input: path to file
+output: hex digest
+'''
+def checksum(file_path):
+    import hashlib
+
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as handle:
+        for block in iter(lambda: handle.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+'''
+function: loadManifestIndex(bpm, bpm_csv, cacheDir)
+description: returns the ManifestIndex of a bpm (and manifest csv when given).  A compiled copy is kept in
+{bpm name}.{checksum}.gthack next to the bpm, or in cacheDir, as one memory-mapped .npy file per column; later runs
+against the same bpm map it instead of re-parsing the bpm and csv.  The bpm checksum is kept in the cache with the
+path, size and modification time of the bpm, so the bpm is only hashed again once one of these has changed.  The
+cache is rebuilt if the csv has changed or was not part of it, and skipped with a warning if it cannot be written.
+input: path to bpm file, optionally path to manifest csv and a directory for the compiled manifest
+output: ManifestIndex object
+'''
+def loadManifestIndex(bpm, bpm_csv=None, cacheDir=None):
+    import glob
+
+    logger = logging.getLogger('loadManifestIndex')
+
+    if cacheDir is None:
+        cacheDir = os.path.dirname(os.path.abspath(bpm))
+    bpmStats = os.stat(bpm)
+    bpmKey = [os.path.abspath(bpm), bpmStats.st_size, bpmStats.st_mtime_ns]
+    bpm_checksum = None
+    for candidate in sorted(glob.glob(os.path.join(glob.escape(cacheDir), glob.escape(os.path.basename(bpm)) + '.*.gthack'))):
+        try:
+            with open(os.path.join(candidate, 'meta.json')) as metaFile:
+                metaData = json.load(metaFile)
+        except (OSError, ValueError):
+            continue
+        if metaData.get('bpm_key') == bpmKey:
+            bpm_checksum = metaData['bpm_checksum']
+            break
+    if bpm_checksum is None:
+        bpm_checksum = checksum(bpm)
+    cachePath = os.path.join(cacheDir, '{}.{}.gthack'.format(os.path.basename(bpm), bpm_checksum[:16]))
+    if bpm_csv is not None:
+        csvStats = os.stat(bpm_csv)
+        csvKey = [os.path.abspath(bpm_csv), csvStats.st_size, csvStats.st_mtime_ns]
+    else:
+        csvKey = None
+
+    if os.path.isdir(cachePath):
+        with open(os.path.join(cachePath, 'meta.json')) as metaFile:
+            metaData = json.load(metaFile)
+        if metaData['bpm_checksum'] == bpm_checksum and (csvKey is None or metaData['bpm_csv'] == csvKey):
+            logger.debug('Loading compiled manifest {}'.format(cachePath))
+            if metaData.get('bpm_key') != bpmKey:
+                # same bpm content under a new path or modification time; remembered so the next run skips the hash
+                try:
+                    with open(os.path.join(cachePath, 'meta.json.tmp'), 'w') as metaFile:
+                        json.dump(dict(metaData, bpm_key=bpmKey), metaFile)
+                    os.replace(os.path.join(cachePath, 'meta.json.tmp'), os.path.join(cachePath, 'meta.json'))
+                except OSError as error:
+                    logger.warning('Could not update compiled manifest {}: {}'.format(cachePath, error))
+            # copy-on-write so overrides never reach the cached files
+            columns = {column: numpy.load(os.path.join(cachePath, column + '.npy'), mmap_mode='c') for column in COLUMNS}
+            return ManifestIndex(columns, metaData['manifest_name'], metaData['control_config'])
+
+        import shutil
+        logger.info('Compiled manifest {} is out of date, rebuilding'.format(cachePath))
+        shutil.rmtree(cachePath, ignore_errors=True)
+
+    logger.debug('Preparing to read in bpm file...')
+    from IlluminaBeadArrayFiles import BeadPoolManifest
+
+    manifest = buildManifestIndex(BeadPoolManifest(bpm), bpm_csv)
+
+    try:
+        manifest.save(cachePath, {'bpm_checksum': bpm_checksum, 'bpm_key': bpmKey, 'bpm_csv': csvKey})
+        logger.info('Wrote compiled manifest {}'.format(cachePath))
+    except OSError as error:
+        logger.warning('Could not write compiled manifest {}: {}'.format(cachePath, error))
+
+    return manifest
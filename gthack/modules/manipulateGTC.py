@@ -1,308 +1,550 @@
-from IlluminaBeadArrayFiles import *
 import struct
-from io import BytesIO
 import os
 import sys
 import logging
+from collections import OrderedDict
+
+# metadata that can be updated in the update file -> toc ID of the gtc entry it replaces
+METADATA_KEYS = {'sampleName': 10, 'sentrixBarcode': 1016, 'plateName': 11, 'well': 12, 'sex': 1007}
 
 '''
-function: manipulate_gtc(self)
-description: wrapper method to update metadata, snps, validate them and convert to bytes for writing
-input: gtcFunction object
-output: writes updated gtcs to output directory specified at runtime
+function: updateMetaData(data, metaData)
+description: update sample metadata (not snps) pertaining to sampleName, sentrixBarcode, plateName, well
+input: data dictionary of a sample gtc and the metadata line pertaining to that sample
+output: data dictionary with update information listed in meta data lines
 '''
-def manipulate_gtc(self):
-    import gthack.modules.extractInformation as extractInformation
-    import gthack.modules.write_gtc as write_gtc
-    logger = logging.getLogger('manipulate_gtc')
-    logger.debug('In method manipulate_gtc()')
-    
-    bpm=self.bpm
-    bpm_csv=self.bpm_csv
-    gtcDir=self.gtcDir
-    outDir=self.outDir
-    snpsToUpdate=self.snpUpdateFile
-    overrides=self.overrides
+def updateMetaData(data, metaData):
+    logger = logging.getLogger('updateMetaData')
+    logger.debug("In sub-method of manipulate_gtc() -- updateMetaData()")
+    dataDict = {}
+
+    metaDataUpdates = metaData.rstrip().split(',')
+    for update in metaDataUpdates:
+        key = update.rstrip().split('=')[0]
+        if key in METADATA_KEYS:
+            dataDict[METADATA_KEYS[key]] = update.rstrip().split('=')[1].encode()
+        else:
+            logger.warning(
+                'MetaData {} does not exist; please make sure spelling is correct and case sensitive!  Ignoring...'
+                .format(key))
+            print('MetaData {} does not exist; please make sure spelling is correct and case sensitive!  Ignoring...'
+                .format(key))
+            sys.stdout.flush()
 
+    for key, value in dataDict.items():
+        data[key] = value
 
-    '''
-    function: updateMetaData(data, metaData)
-    description: update sample metadata (not snps) pertaining to sampleName, sentrixBarcode, plateName, well
-    input: data dictionary of a sample gtc and the metadata line pertaining to that sample
-    output: data dictionary with update information listed in meta data lines
-    '''
-    def updateMetaData(data, metaData):
-        import itertools
-
-        logger = logging.getLogger('updateMetaData')
-        logger.debug("In sub-method of manipulate_gtc() -- updateMetaData()")
-        dataDict = {}
-
-        metaDataUpdates = metaData.rstrip().split(',')
-        for update in metaDataUpdates:
-            if update.rstrip().split('=')[0] == 'sampleName':
-                dataDict[10] = update.rstrip().split('=')[1].encode()
-            elif update.rstrip().split('=')[0] == 'sentrixBarcode':
-                dataDict[1016] = update.rstrip().split('=')[1].encode()
-            elif update.rstrip().split('=')[0] == 'plateName':
-                dataDict[11] = update.rstrip().split('=')[1].encode()
-            elif update.rstrip().split('=')[0] == 'well':
-                dataDict[12] = update.rstrip().split('=')[1].encode()
-            elif update.rstrip().split('=')[0] == 'sex':
-                dataDict[1007] = update.rstrip().split('=')[1].encode()
-            else:
-                logger.warning(
-                    'MetaData {} does not exist; please make sure spelling is correct and case sensitive!  Ignoring...'
-                    .format(update.rstrip().split('=')[0]))
-                print('MetaData {} does not exist; please make sure spelling is correct and case sensitive!  Ignoring...'
-                    .format(update.rstrip().split('=')[0]))
-                sys.stdout.flush()
-
-        for key, value in dataDict.items():
-            data[key] = value
-
-        return data
-
-    
-    '''
-    function: snpUpdate(data, line)
-    description: updates the snps in a gtc if the input text-file indicates a snp needs to be updated
-    input: data dictionary and a snp line in the text-file for the gtc sample
-    output: returns data dictionary for that sample with updated snp (update both base call in bytes and genotype)
-    '''
-    def snpUpdate(data, line):
-        logger = logging.getLogger('snpUpdate')
-        logger.debug("In sub-method of manipulate_gtc() -- snpUpdate()")
-        
-        COMPLEMENT_MAP = dict(zip("ABCDGHKMRTVYNID", "TVGHCDMKYABRNID"))
-        
-        loc = manifest.names.index(line.rstrip().split()[0])
-        manifest_name = manifest.names[loc]
-        manifest_name_csv = manifest_csv.names[loc]
-        assert manifest_name == manifest_name_csv
-
-
-        manifestSnpsStr = manifest.snps[loc]
-        manifestSnps = [manifestSnpsStr[1], manifestSnpsStr[-2]]
-        if manifest.ref_strands[loc] == RefStrand.Minus:
-            manifestSnps = [COMPLEMENT_MAP[snp] for snp in manifestSnps]
-
-
-        newSnpsStr = str(line.rstrip().split()[1])
-        newSnps = [newSnpsStr[0], newSnpsStr[1]]
-
-        # Getting genotype byte
-        if newSnps[0] != newSnps[1] and newSnps[0] != '-':
-            data[1002][loc] = 2
-        elif newSnps[0] == '-' and newSnps[1] == '-':
-            data[1002][loc] = 0
-            data[1003][loc] = '--'.encode()
-        elif newSnps[0] == newSnps[1]:
-            if newSnps[0] in manifestSnps:
-                if newSnps[0] == manifestSnps[0]:
-                    data[1002][loc] = 1
-                else:
-                    data[1002][loc] = 3
-            else:
-                newSnps = [COMPLEMENT_MAP[snp] for snp in newSnps]
-                if newSnps[0] == manifestSnps[0]:
-                    data[1002][loc] = 1
-                else:
-                    data[1002][loc] = 3
-        else:
-            print("NO CONDITION MET; SOMETHING IS WRONG")
+    return data
 
-        # Getting base call byte
-        if data[1002][loc] == 0:
-            data[1003][loc] = '--'.encode()
-        else:
-            if newSnps[0] in ['I', 'D']:
-                if data[1002][loc] == 1:
-                    data[1003][loc] = (manifestSnps[0] + manifestSnps[0]).encode()
-                elif data[1002][loc] == 2:
-                    data[1003][loc] = (manifestSnps[0] + manifestSnps[1]).encode()
-                else:
-                    data[1003][loc] = (manifestSnps[1] + manifestSnps[1]).encode()
-            else:
-                allele_a = manifest_csv.alleles[loc][0]
-                allele_b = manifest_csv.alleles[loc][1]
-                if data[1002][loc] == 1:
-                    data[1003][loc] = (allele_a + allele_a).encode()
-                elif data[1002][loc] == 2:
-                    data[1003][loc] = (allele_a + allele_b).encode()
-                else:
-                    data[1003][loc] = (allele_b + allele_b).encode()
-        return data
-
-    
-    '''
-    function: validateUpdate(originalGTC, outputName, outDir)
-    description: a function to validate the manipulated gtc against the original gtc it is based off
-    input: requires the orginal gtc, the name of the new gtc, and the output directory
-    output: None - Raises an AssertionError if a gtc fail validation and records in the log file and standard out
-    '''
-    def validateUpdate(originalGTC, outputName, outDir):
-        import gthack.modules.extractInformation as extractInformation
-        import gthack.modules.write_gtc as write_gtc
-
-
-        logger = logging.getLogger('validateUpdate')
-        logger.debug("In sub-method of manipulate_gtc() -- validateUpdate()")
-
-        original_genotype = GenotypeCalls(originalGTC)
-        gtc_copy = GenotypeCalls(os.path.join(outDir,'{}.gtc'.format(outputName)),check_write_complete=False)
-        
+
+'''
+function: compileMetaData(metaData)
+description: checks the metadata field of an update block before anything is written
+input: the metadata field (key=value pairs separated by commas)
+output: tuple of the metadata updates (toc ID -> bytes) and a list of error messages
+'''
+def compileMetaData(metaData):
+    errors = []
+    for update in metaData.rstrip().split(','):
+        fields = update.split('=')
+        if len(fields) != 2 or fields[0] not in METADATA_KEYS:
+            errors.append('metadata {} is not one of {}=value; please make sure spelling is correct and case sensitive'
+                .format(update, '/'.join(METADATA_KEYS)))
+        elif fields[0] == 'sex' and len(fields[1].encode()) != 1:
+            errors.append('metadata {} must be a single character'.format(update))
+        elif len(fields[1].encode()) > 127:
+            errors.append('metadata {} is longer than 127 characters'.format(update))
+    if len(errors) > 0:
+        return {}, errors
+
+    return updateMetaData(data={}, metaData=metaData), errors
+
+
+# toc entries a manipulation never changes: autocall date and version, cluster file, control x/y intensities,
+# genotype scores, x percentiles and raw x intensities
+UNCHANGED_SECTIONS = [201, 300, 100, 500, 501, 1004, 1014, 1000]
+
+# toc entries a manipulation rewrites, which must still hold one value per SNP of the manifest
+EDITED_SECTIONS = [1002, 1003, 1012, 1013]
+
+'''
+function: validateUpdate(originalGTC, outputName, outDir, manifest)
+description: a function to validate the manipulated gtc against the original gtc it is based off.  Sections that must
+not change are compared by digest of their byte ranges in the two files (the number of no calls within the GC50 entry
+included); edited sections are only checked for their size and genotype codes.  Neither gtc is decoded
+input: requires the orginal gtc, the name of the new gtc, the output directory and the ManifestIndex of the bpm
+output: True if the gtc passed validation; a failure is recorded in the log file and standard out
+'''
+def validateUpdate(originalGTC, outputName, outDir, manifest):
+    import gthack.modules.gtcView as gtcView
+
+    logger = logging.getLogger('validateUpdate')
+    logger.debug("In sub-method of manipulate_gtc() -- validateUpdate()")
+
+    with gtcView.GtcView(originalGTC) as original_genotype, \
+            gtcView.GtcView(os.path.join(outDir,'{}.gtc'.format(outputName))) as gtc_copy:
         try:
-            assert gtc_copy.get_autocall_date() == original_genotype.get_autocall_date()
-            assert gtc_copy.get_autocall_version() == original_genotype.get_autocall_version()
-            #assert gtc_copy.get_base_calls() == genotype_calls.get_base_calls() -- do not activate, will def fail if snps are changed
-            assert gtc_copy.get_cluster_file() == original_genotype.get_cluster_file()
-            assert (gtc_copy.get_control_x_intensities() ==original_genotype.get_control_x_intensities()).all()
-            assert (gtc_copy.get_control_y_intensities() ==original_genotype.get_control_y_intensities()).all()
-            assert gtc_copy.get_num_no_calls() == original_genotype.get_num_no_calls()
-            #assert gtc_copy.get_gender() == original_genotype.get_gender()
-            assert (gtc_copy.get_genotype_scores() ==original_genotype.get_genotype_scores()).all()
-            #assert gtc_copy.get_genotypes() == genotype_calls.get_genotypes()  -- do not activate, will def fail if snps are changed
-            assert gtc_copy.get_percentiles_x() == original_genotype.get_percentiles_x()
-            assert (gtc_copy.get_raw_x_intensities() == original_genotype.get_raw_x_intensities()).all()
-
-            all_genotypes = gtc_copy.get_genotypes()
-            assert len(manifest.names) == len(all_genotypes)
-            assert len(manifest.names) == len(gtc_copy.get_logr_ratios())
-            assert len(manifest.names) == len(gtc_copy.get_ballele_freqs())
+            for toc_id in UNCHANGED_SECTIONS:
+                assert gtc_copy.digest(*gtc_copy.span(toc_id)) == original_genotype.digest(*original_genotype.span(toc_id))
+            # GC50 entry is (GC50, calls, no calls, intensity only); only the number of no calls is carried over unchanged
+            no_calls = [gtc.digest(gtc.toc[1011] + 8, gtc.toc[1011] + 12) for gtc in (original_genotype, gtc_copy)]
+            assert no_calls[0] == no_calls[1]
+
+            for toc_id in EDITED_SECTIONS:
+                gtc_copy.digest(*gtc_copy.span(toc_id))  # section lies within the file
+                assert gtc_copy.count(toc_id) == len(manifest.names)
+            genotypes = gtc_copy.genotypes
+            assert (genotypes <= 3).all()
+            del genotypes
 
             logger.info(os.path.join(outDir, '{}.gtc'.format(outputName)) +' passed validation!')
             print(os.path.join(outDir, '{}.gtc'.format(outputName)) +' passed validation!')
             sys.stdout.flush()
+            return True
 
-        except AssertionError:
+        except (AssertionError, KeyError, ValueError, struct.error):
             logger.warning(os.path.join(outDir, '{}.gtc'.format(outputName)) +' failed validation -- please re-run this gtc')
             print(os.path.join(outDir, '{}.gtc'.format(outputName)) +' failed validation -- please re-run this gtc')
             sys.stdout.flush()
-    
-    '''
-    function: snpOverride()
-    description: will temporarily overwrite the original call in the bpm
-    input: bpm manifest and a text-file gathered at run time containing snps name and override value
-    output: returns an ephemeral bpm manifest used during the duration of the run only
-    '''
-    def snpOverride(manifest, overrides):
-        logger = logging.getLogger('snpOverride')
-        logger.debug('Opening snp override file...')
-        
-        with open(overrides, 'r') as snpsOverrides:
-            for snp in snpsOverrides:
-                snp = snp.split('\t')
-                try:
-                    logger.info('snp {} is being changed from {} to {}'.format(snp[0], manifest.snps[manifest.names.index(snp[0])], snp[1]))
-                    manifest.snps[manifest.names.index(snp[0])] = snp[1].strip().encode()
-                    logger.info('Success! Alleles of snp {} has been updated!'.format(snp[0]))
-                except ValueError:
-                    logger.error('Error! snp {} cannot be updated! Please check your input override file format.'.format(snp[0]))
-
-        return manifest
-    
-
-###################################################################################################################
-############### First analytic lines processed in manipulate_gtc(bpm, gtcDir, outDir, snpsToUpdate) ###############
-###################################################################################################################
-    logger.debug('Preparing to read in bpm file...')
-    manifest = BeadPoolManifest(bpm)
-    def get_manifest_csv():
-        import csv
-
-        def read_csv(file_path):
-            with open(file_path) as f:
-                reader = csv.reader(f)
-                for i in range(7):
-                    next(reader)
-                header = next(reader)
-                for row in reader:
-                    yield dict(zip(header, row))
-
-
-        file_path = self.bpm_csv
-        # for row in read_csv(file_path):
-        #     print(row.header)
-        rows = list(read_csv(file_path))
-        class Manifest:
-            def __init__(self):
-                self.names = []
-                self.alleles = []
-
-        manifest = Manifest()
-        for row in rows:
-            if 'Name' not in row or 'TopGenomicSeq' not in row:
+            return False
+
+'''
+function: readOverrides(overrides, manifest)
+description: reads the snp override file and checks every line against the bpm before anything is changed
+input: a text-file gathered at run time containing snps name and override value (tab-delimited, e.g. rs12248560.1  [T/A])
+and the ManifestIndex of the bpm
+output: tuple of a list of (snp name, override value) and a list of error messages
+'''
+def readOverrides(overrides, manifest):
+    import re
+
+    compiled = []
+    errors = []
+    with open(overrides, 'r') as snpsOverrides:
+        for lineNumber, snp in enumerate(snpsOverrides, 1):
+            if snp.strip() == '':
+                continue
+            snp = snp.rstrip('\n').split('\t')
+            if len(snp) < 2 or re.match(r'^\[[^/\]]+/[^/\]]+\]$', snp[1].strip()) is None:
+                errors.append('override line {}: {} is not a snp name and [A/B] alleles'.format(lineNumber, '\t'.join(snp)))
+                continue
+            try:
+                manifest.locate(snp[0])
+            except ValueError as error:
+                errors.append('override line {}: {}'.format(lineNumber, error))
                 continue
-            name = row['Name']
-            top_genomic_seq = row['TopGenomicSeq']
-            # get the string in top_genomic_seq which is in the format [alphabet/alphabet] and which will be in any index in the top_genomic_seq
-            allele = 'NA'
-            for i in range(len(top_genomic_seq) - 1):
-                if top_genomic_seq[i] == '[' and top_genomic_seq[i + 4] == ']':
-                    allele = top_genomic_seq[i + 1], top_genomic_seq[i + 3]
-                    break
-            manifest.names.append(name)
-            manifest.alleles.append(allele)
-        return manifest
-    manifest_csv = get_manifest_csv()
+            if len(snp[1].strip()) > manifest.snpWidth():
+                errors.append('override line {}: {} is longer than the {} characters of the bpm snp alleles'.format(lineNumber, snp[1].strip(), manifest.snpWidth()))
+                continue
+            compiled.append((snp[0], snp[1].strip()))
+
+    return compiled, errors
+
+
+'''
+function: snpOverride()
+description: will temporarily overwrite the original call in the bpm
+input: ManifestIndex of the bpm and the overrides from readOverrides
+output: returns an ephemeral bpm manifest used during the duration of the run only
+'''
+def snpOverride(manifest, overrides):
+    logger = logging.getLogger('snpOverride')
+
+    for name, snp in overrides:
+        logger.info('snp {} is being changed from {} to {}'.format(name, manifest.snps[manifest.locate(name)], snp))
+        manifest.override(name, snp)
+        logger.info('Success! Alleles of snp {} has been updated!'.format(name))
+
+    return manifest
+
+
+'''
+function: readUpdates(snpsToUpdate)
+description: splits the update file into independent jobs, one per output gtc
+input: path to the update file; each block starts with a line >source.gtc  outputName  [metadata] followed by its snp lines
+output: tuple of a list of job dictionaries with keys gtc, outputName, metaData (None if the block has none) and snps,
+and a list of error messages for lines that do not fit the format
+'''
+def readUpdates(snpsToUpdate):
+    jobs = []
+    errors = []
+    with open(snpsToUpdate) as updates:
+        for lineNumber, line in enumerate(updates, 1):
+            if line[0] == ">":
+                fields = line.rstrip().split()
+                if len(fields) not in (2, 3):
+                    errors.append('update line {}: {} is not >source.gtc outputName [metadata]'.format(lineNumber, line.rstrip()))
+                    fields = (fields + ['', ''])[:2]
+                jobs.append({'gtc': fields[0][1:], 'outputName': fields[1],
+                    'metaData': fields[2] if len(fields) == 3 else None, 'snps': []})
+            elif line.strip() != '':
+                if len(jobs) == 0:
+                    errors.append('update line {}: snp line before the first >source.gtc line'.format(lineNumber))
+                    continue
+                jobs[-1]['snps'].append(line)
+
+    return jobs, errors
+
+
+'''
+function: compileUpdates(jobs, gtcDir, translator)
+description: resolves every job from readUpdates into what it writes before any gtc is read or written: the source
+gtc must exist, output names must be unique, metadata keys must be known and every snp line must name a SNP of the
+bpm with an allele pair that translates.  Adds metaDataUpdates (toc ID -> bytes) and snpUpdates (compiled by
+genotypeTranslation.compileLines) to each job
+input: list of job dictionaries, gtc directory and GenotypeTranslator of the bpm (after overrides)
+output: list of error messages, empty when every job can be run
+'''
+def compileUpdates(jobs, gtcDir, translator):
+    import gthack.modules.genotypeTranslation as genotypeTranslation
+
+    errors = []
+    outputNames = set()
+    for job in jobs:
+        block = '>{} {}'.format(job['gtc'], job['outputName'])
+        if not os.path.isfile(os.path.join(gtcDir, job['gtc'])):
+            errors.append('{}: source gtc {} does not exist'.format(block, os.path.join(gtcDir, job['gtc'])))
+        if job['outputName'] in outputNames:
+            errors.append('{}: output {} is written by an earlier block'.format(block, job['outputName']))
+        outputNames.add(job['outputName'])
+
+        job['metaDataUpdates'] = {}
+        if job['metaData'] is not None:
+            job['metaDataUpdates'], metaDataErrors = compileMetaData(job['metaData'])
+            errors.extend('{}: {}'.format(block, error) for error in metaDataErrors)
+
+        locs, genotypes, base_calls, snpErrors = genotypeTranslation.compileLines(job['snps'], translator)
+        job['snpUpdates'] = (locs, genotypes, base_calls)
+        errors.extend('{}: {}'.format(block, error) for error in snpErrors)
+
+    return errors
+
+
+# ManifestIndex of a worker process, set once by initWorker so it is not sent along with every job
+workerManifest = None
+
+def initWorker(manifest):
+    global workerManifest
+    workerManifest = manifest
+
+
+# decoded source gtcs kept by a process, most recently used last; jobs are run grouped by source
+SOURCE_CACHE_SIZE = 4
+sourceCache = OrderedDict()
+
+'''
+function: loadSource(source)
+description: data dictionary of a source gtc, decoded once per process and kept in a small LRU so every output made
+from the same source reuses it.  The genotype and base call arrays are copied for each caller, all other elements
+(including the memory-mapped intensities) are shared and must not be edited
+input: path to source gtc
+output: data dictionary of all elements of that gtc file
+'''
+def loadSource(source):
+    import gthack.modules.gtcView as gtcView
+
+    if source in sourceCache:
+        sourceCache.move_to_end(source)
+    else:
+        sourceCache[source] = gtcView.getGtcInfo(gtc=source)
+        if len(sourceCache) > SOURCE_CACHE_SIZE:
+            sourceCache.popitem(last=False)
+
+    data = dict(sourceCache[source])
+    data[1002] = data[1002].copy()
+    data[1003] = data[1003].copy()
+    return data
+
+
+# sha1 of each source gtc, hashed once per process however many outputs are made from it
+sourceChecksums = {}
+
+'''
+function: getSourceChecksum(source)
+description: sha1 of a source gtc for the manipulation journal, read once per process and then remembered
+input: path to source gtc
+output: hex digest
+'''
+def getSourceChecksum(source):
+    import gthack.modules.manifestIndex as manifestIndex
+
+    if source not in sourceChecksums:
+        sourceChecksums[source] = manifestIndex.checksum(source)
+    return sourceChecksums[source]
+
+
+JOURNAL_FILE_NAME = 'manipulationJournal.txt'
+JOURNAL_COLUMNS = ['outputName', 'sourceGtc', 'sourceChecksum', 'jobChecksum', 'validation']
+
+'''
+function: jobChecksum(job)
+description: sha1 of everything a compiled job writes (see compileUpdates), so a resumed run notices an edited update
+or override file
+input: compiled job dictionary
+output: hex digest
+'''
+def jobChecksum(job):
+    import hashlib
+
+    digest = hashlib.sha1()
+    digest.update('{}\n{}\n'.format(job['gtc'], job['outputName']).encode())
+    for toc_id, value in sorted(job['metaDataUpdates'].items()):
+        digest.update('{}='.format(toc_id).encode() + value + b'\n')
+    for array in job['snpUpdates']:
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+'''
+class: ManipulationJournal(outDir)
+description: append-only record in the output directory of every gtc written by manipulate_gtc, with the checksum of
+its source gtc and of its job.  Each line is flushed to disk before the next one, so after a crash the journal lists
+exactly the outputs that were completed; entries can be added from several threads
+input: output directory
+output: ManipulationJournal object
+'''
+class ManipulationJournal:
+
+    def __init__(self, outDir):
+        import threading
+
+        self.journalPath = os.path.join(outDir, JOURNAL_FILE_NAME)
+        self.lock = threading.Lock()
+        newJournal = not os.path.exists(self.journalPath)
+        self.handle = open(self.journalPath, 'a')
+        if newJournal:
+            self.write(JOURNAL_COLUMNS)
+
+    def write(self, fields):
+        with self.lock:
+            self.handle.write('\t'.join(fields) + '\n')
+            self.handle.flush()
+            os.fsync(self.handle.fileno())
+
+    def record(self, job, sourceChecksum, passed):
+        self.write([job['outputName'], job['gtc'], sourceChecksum, jobChecksum(job), 'passed' if passed else 'failed'])
+
+    def close(self):
+        self.handle.close()
+
+
+'''
+function: readJournal(outDir)
+description: reads the manipulation journal of an output directory; a line cut short by a crash is ignored
+input: output directory
+output: dictionary of outputName -> latest journal entry (dictionary keyed by JOURNAL_COLUMNS)
+'''
+def readJournal(outDir):
+    entries = {}
+    journalPath = os.path.join(outDir, JOURNAL_FILE_NAME)
+    if not os.path.exists(journalPath):
+        return entries
+
+    with open(journalPath) as journal:
+        for line in journal:
+            fields = line.rstrip('\n').split('\t')
+            if not line.endswith('\n') or len(fields) != len(JOURNAL_COLUMNS) or fields == JOURNAL_COLUMNS:
+                continue
+            entries[fields[0]] = dict(zip(JOURNAL_COLUMNS, fields))
+
+    return entries
+
+
+'''
+function: commitOutput(tmpOutput, output)
+description: moves a fully written gtc into place; it is synced to disk first and then renamed over the output name,
+so the output name only ever refers to a complete gtc
+input: path of the written temporary file and the final path
+output: None
+'''
+def commitOutput(tmpOutput, output):
+    with open(tmpOutput, 'rb') as handle:
+        os.fsync(handle.fileno())
+    os.replace(tmpOutput, output)
+
+
+'''
+function: writeJob(job, gtcDir, outDir, patch)
+description: applies one compiled job (see compileUpdates) to its source gtc and writes the new gtc.  In patch mode the
+new gtc is a copy of the source with only the changed bytes rewritten; when a metadata value changes length the gtc is
+re-serialized with write_gtc as usual.  The gtc is written to a hidden temporary file and renamed when complete
+input: compiled job dictionary, gtc and output directories and whether to patch a copy of the source instead of
+re-serializing it (default: False)
+output: sha1 of the source gtc
+'''
+def writeJob(job, gtcDir, outDir, patch=False):
+    import gthack.modules.gtcPatch as gtcPatch
+    import gthack.modules.write_gtc as write_gtc
+    import gthack.modules.genotypeTranslation as genotypeTranslation
+
+    logger = logging.getLogger('writeJob')
+
+    source = os.path.join(gtcDir, job['gtc'])
+    output = os.path.join(outDir, '{}.gtc'.format(job['outputName']))
+    tmpOutput = os.path.join(outDir, '.{}.gtc.tmp'.format(job['outputName']))
+    if len(job['metaDataUpdates']) > 0:
+        logger.info('Metadata found.  Updating metadata...')
+
+    try:
+        if not (patch and gtcPatch.patchGtc(source, tmpOutput, job['metaDataUpdates'], job['snpUpdates'])):
+            data = loadSource(source)
+            data.update(job['metaDataUpdates'])
+            data = genotypeTranslation.applyUpdates(data, *job['snpUpdates'])
+
+            logger.info('Writing updated GTC to new GTC file...')
+            with open(tmpOutput, "wb") as output_handle:
+                write_gtc.write_gtc(data, output_handle)
+            del data
+        commitOutput(tmpOutput, output)
+    except BaseException:
+        if os.path.exists(tmpOutput):
+            os.remove(tmpOutput)
+        raise
+
+    return getSourceChecksum(source)
+
+
+'''
+function: runJob(job, gtcDir, outDir, manifest, patch)
+description: writes the new gtc of one compiled job (see writeJob) and validates it
+input: compiled job dictionary, gtc and output directories, ManifestIndex of the bpm (defaults to the one of the worker
+process) and whether to patch a copy of the source (default: False)
+output: tuple of True if the new gtc passed validation and the sha1 of the source gtc
+'''
+def runJob(job, gtcDir, outDir, manifest=None, patch=False):
+    if manifest is None:
+        manifest = workerManifest
+
+    sourceChecksum = writeJob(job, gtcDir, outDir, patch)
+    passed = validateUpdate(originalGTC=os.path.join(gtcDir, job['gtc']),
+                            outDir=outDir,
+                            outputName=job['outputName'],
+                            manifest=manifest)
+    return passed, sourceChecksum
+
+
+'''
+function: manipulate_gtc(self)
+description: wrapper method to update metadata, snps, validate them and convert to bytes for writing; with more than
+one worker the jobs of the update file are spread over a process pool that shares the manifest; with patch set the
+new gtcs are patched copies of their source (see gtcPatch.patchGtc).  With a single worker, validation can run on
+background threads while the next gtcs are written.  The update and override files are compiled and checked in full
+before any gtc is read; jobs then run grouped by source gtc.  Instead of an update file the calls can be injected from
+a VCF or genotype matrix (see genotypeInjection.compileInjection).  Every finished gtc is recorded in the manipulation journal; with
+resume set, jobs whose output passed validation in an earlier run, from the same source gtc and update lines, are skipped
+input: gtcFunction object
+output: writes updated gtcs, manipulationJournal.txt and manipulationSummary.txt (validation result per output, in update file order) to output directory specified at runtime
+'''
+def manipulate_gtc(self):
+    import gthack.modules.manifestIndex as manifestIndex
+    import gthack.modules.genotypeTranslation as genotypeTranslation
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    from itertools import repeat
+
+    logger = logging.getLogger('manipulate_gtc')
+    logger.debug('In method manipulate_gtc()')
+
+    bpm=self.bpm
+    bpm_csv=self.bpm_csv
+    gtcDir=self.gtcDir
+    outDir=self.outDir
+    snpsToUpdate=self.snpUpdateFile
+    overrides=self.overrides
+    workers=self.workers
+    patch=self.patch
+    validationThreads=self.validationThreads
+    resume=self.resume
+
+    manifest = manifestIndex.loadManifestIndex(bpm, bpm_csv, self.manifestCache)
     logger.debug('Successfully loaded BPM file')
 
-    #######################
-    # manifest overrides! #
-    #######################
+    #######################################################
+    # compile overrides and updates before any gtc I/O!   #
+    #######################################################
+    errors = []
     if overrides == None:
         logger.debug('No overrides present')
     else:
         logger.debug('Override file present')
+        overrides, overrideErrors = readOverrides(overrides, manifest)
+        errors.extend(overrideErrors)
         manifest = snpOverride(manifest=manifest, overrides=overrides)
-    
-    gtc = ''
-    total_gtcs = 0
-    data = {}
 
-    with open(snpsToUpdate) as updates:
-        for line in updates:
-            if line[0] == ">":
-                total_gtcs += 1
-                if total_gtcs == 1:
-                    gtc = line.rstrip().split()[0][1:]
-                    outputName = line.rstrip().split()[1]
-                    data = extractInformation.getGtcInfo(gtc=os.path.join(gtcDir, gtc))
-                    if len(line.rstrip().split()) == 3:  # means there is metadata to update
-                        logger.info('Writing updated GTC to new GTC file...')
-                        data = updateMetaData(data=data, metaData=line.rstrip().split()[2])
-                else:
-                    logger.info('Writing updated GTC to new GTC file...')
-                    with open(os.path.join(outDir, '{}.gtc'.format(outputName)),"wb") as output_handle:
-                        write_gtc.write_gtc(data, output_handle)
-
-                    validateUpdate(originalGTC=os.path.join(gtcDir, gtc),
-                                   outDir=outDir,
-                                   outputName=outputName)
-
-                    gtc = line.rstrip().split()[0][1:]
-                    outputName = line.rstrip().split()[1]
-                    data = extractInformation.getGtcInfo(gtc=os.path.join(gtcDir, gtc))
-                    if len(line.rstrip().split()) == 3:  # means there is metadata to update
-                        logger.info('Metadata found.  Updating metadata...')
-                        data = updateMetaData(data=data, metaData=line.rstrip().split()[2])
-
-            else:
-                data = snpUpdate(data=data, line=line)
-
-    # always the last gtc because out of lines in file at this point
-    logger.info('Writing final updated GTC to new GTC file...')
-    print('Writing final updated GTC to new GTC file...')
-    sys.stdout.flush()
-   
-    with open(os.path.join(outDir, '{}.gtc'.format(outputName)),"wb") as output_handle:
-        write_gtc.write_gtc(data, output_handle)
-
-    validateUpdate(originalGTC=os.path.join(gtcDir, gtc),
-                   outDir=outDir,
-                   outputName=outputName)
+    translator = genotypeTranslation.GenotypeTranslator(manifest)
 
+    if self.vcf != None or self.genotypeMatrix != None:
+        import gthack.modules.genotypeInjection as genotypeInjection
+        jobs, injectionErrors = genotypeInjection.compileInjection(self.vcf, self.genotypeMatrix, self.sampleMap, gtcDir, translator)
+        errors.extend(injectionErrors)
+    else:
+        jobs, updateErrors = readUpdates(snpsToUpdate)
+        errors.extend(updateErrors)
+        errors.extend(compileUpdates(jobs, gtcDir, translator))
+    if len(errors) > 0:
+        for error in errors:
+            logger.critical(error)
+            print(error)
+        logger.critical('{} error(s) in the input/override files; no gtcs were written'.format(len(errors)))
+        print('{} error(s) in the input/override files; no gtcs were written'.format(len(errors)))
+        sys.exit(1)
+    results = [None] * len(jobs)
+
+    if resume:
+        finished = readJournal(outDir)
+        for i, job in enumerate(jobs):
+            entry = finished.get(job['outputName'])
+            if entry is None or entry['validation'] != 'passed' or entry['jobChecksum'] != jobChecksum(job) \
+                    or not os.path.exists(os.path.join(outDir, '{}.gtc'.format(job['outputName']))):
+                continue
+            if entry['sourceChecksum'] == getSourceChecksum(os.path.join(gtcDir, job['gtc'])):
+                results[i] = True
+        logger.info('Resuming: {} of {} gtcs already finished'.format(results.count(True), len(jobs)))
+        print('Resuming: {} of {} gtcs already finished'.format(results.count(True), len(jobs)))
+    # grouped by source gtc (in order of first use) so each source is decoded once per process
+    firstUse = {}
+    for i, job in enumerate(jobs):
+        firstUse.setdefault(job['gtc'], i)
+    pending = sorted((i for i in range(len(jobs)) if results[i] is None), key=lambda i: firstUse[jobs[i]['gtc']])
+    logger.info('{} gtcs from {} source gtcs to write with {} worker(s)'.format(len(pending),
+        len(set(jobs[i]['gtc'] for i in pending)), workers))
+
+    journal = ManipulationJournal(outDir)
+
+    def record(i, sourceChecksum, passed):
+        results[i] = passed
+        journal.record(jobs[i], sourceChecksum, passed)
+
+    if workers > 1:
+        # consecutive jobs, mostly of the same source, are handed to a worker together
+        chunksize = max(1, len(pending) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=initWorker, initargs=(manifest,)) as executor:
+            for i, (passed, sourceChecksum) in zip(pending, executor.map(runJob, [jobs[i] for i in pending],
+                    repeat(gtcDir), repeat(outDir), repeat(None), repeat(patch), chunksize=chunksize)):
+                record(i, sourceChecksum, passed)
+    elif validationThreads > 0:
+        with ThreadPoolExecutor(max_workers=validationThreads) as validation:
+            futures = []
+            for i in pending:
+                sourceChecksum = writeJob(jobs[i], gtcDir, outDir, patch)
+                future = validation.submit(validateUpdate, originalGTC=os.path.join(gtcDir, jobs[i]['gtc']),
+                    outDir=outDir, outputName=jobs[i]['outputName'], manifest=manifest)
+                future.add_done_callback(lambda future, i=i, sourceChecksum=sourceChecksum: record(i, sourceChecksum, future.result()))
+                futures.append(future)
+            for future in futures:
+                future.result()
+    else:
+        for i in pending:
+            passed, sourceChecksum = runJob(jobs[i], gtcDir, outDir, manifest, patch)
+            record(i, sourceChecksum, passed)
+    journal.close()
+
+    with open(os.path.join(outDir, 'manipulationSummary.txt'), 'w') as summary:
+        summary.write('\t'.join(['outputName', 'sourceGtc', 'validation']) + '\n')
+        for job, passed in zip(jobs, results):
+            summary.write('\t'.join([job['outputName'], job['gtc'], 'passed' if passed else 'failed']) + '\n')
+
+    logger.info('{} of {} gtcs passed validation'.format(sum(results), len(results)))
+    print('{} of {} gtcs passed validation'.format(sum(results), len(results)))
     logger.info("All processing is finished!")
     print("All processing is finished!")
-    sys.exit()
\ No newline at end of file
+    sys.exit()
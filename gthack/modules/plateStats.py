@@ -0,0 +1,187 @@
+import copy
+import math
+import logging
+
+# columns of allSampleInfo.txt summarized per plate, with the name used for them in summaryStatsTable.txt
+STAT_COLUMNS = [('callRate', 'Callrate'), ('gc10', 'GC10'), ('logrDev', 'LogRdev')]
+
+# values kept per level of a QuantileSketch; medians are exact for plates of up to this many samples
+SKETCH_CAPACITY = 512
+
+
+'''
+class: QuantileSketch(capacity)
+description: mergeable quantile sketch (KLL-style compactor levels).  Up to capacity values are kept exactly; beyond
+that each level holding more than capacity values is sorted and every other value is promoted to the next level with
+twice the weight, so memory stays at about capacity * log2(n / capacity) values
+input: number of values kept per level (default: SKETCH_CAPACITY)
+output: QuantileSketch object
+'''
+class QuantileSketch:
+
+    def __init__(self, capacity=SKETCH_CAPACITY):
+        self.capacity = capacity
+        self.levels = [[]]
+        # alternate which half survives a compaction so the error does not drift in one direction
+        self.offsets = [0]
+
+    def add(self, value):
+        self.levels[0].append(value)
+        if len(self.levels[0]) > self.capacity:
+            self.compact(0)
+
+    def compact(self, level):
+        if level + 1 == len(self.levels):
+            self.levels.append([])
+            self.offsets.append(0)
+        values = sorted(self.levels[level])
+        self.levels[level + 1].extend(values[self.offsets[level]::2])
+        self.offsets[level] ^= 1
+        self.levels[level] = []
+        if len(self.levels[level + 1]) > self.capacity:
+            self.compact(level + 1)
+
+    def merge(self, other):
+        for level, values in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append([])
+                self.offsets.append(0)
+            self.levels[level].extend(values)
+        for level in range(len(self.levels)):
+            if len(self.levels[level]) > self.capacity:
+                self.compact(level)
+
+    def median(self):
+        if len(self.levels) == 1:
+            # nothing compacted yet: exact median, middle pair averaged as pandas does
+            values = sorted(self.levels[0])
+            if len(values) == 0:
+                return math.nan
+            middle = len(values) // 2
+            return values[middle] if len(values) % 2 == 1 else (values[middle - 1] + values[middle]) / 2.0
+
+        weighted = sorted((value, 2 ** level) for level, values in enumerate(self.levels) for value in values)
+        half = sum(weight for value, weight in weighted) / 2.0
+        seen = 0
+        for value, weight in weighted:
+            seen += weight
+            if seen >= half:
+                return value
+
+
+'''
+class: RunningStats()
+description: count, mean and variance (Welford), minimum, maximum and approximate median of a stream of values;
+NaN values are skipped as pandas does.  Two RunningStats merge into the statistics of both streams (Chan et al.)
+input: None
+output: RunningStats object
+'''
+class RunningStats:
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = math.nan
+        self.maximum = math.nan
+        self.sketch = QuantileSketch()
+
+    def add(self, value):
+        value = float(value)
+        if math.isnan(value):
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.minimum = value if self.count == 1 else min(self.minimum, value)
+        self.maximum = value if self.count == 1 else max(self.maximum, value)
+        self.sketch.add(value)
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.minimum, self.maximum = other.minimum, other.maximum
+        else:
+            self.minimum, self.maximum = min(self.minimum, other.minimum), max(self.maximum, other.maximum)
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.sketch.merge(other.sketch)
+
+    def variance(self):
+        # sample variance (ddof=1), as pandas var
+        return max(self.m2, 0.0) / (self.count - 1) if self.count > 1 else math.nan
+
+    def summary(self):
+        return [self.mean if self.count > 0 else math.nan, math.sqrt(self.variance()), self.minimum, self.maximum,
+            self.sketch.median(), self.variance()]
+
+
+'''
+class: PlateSummary()
+description: per-plate QC statistics of sampleInformation kept while rows are written, so summaryStatsTable.txt
+never needs the whole cohort in memory.  Summaries of parts of a cohort (e.g. from workers) can be merged
+input: None
+output: PlateSummary object
+'''
+class PlateSummary:
+
+    def __init__(self):
+        self.plates = {}
+
+    def add(self, plate, well, btid, values):
+        if plate not in self.plates:
+            self.plates[plate] = {'samples': 0, 'wells': set(), 'btids': set(),
+                'stats': {column: RunningStats() for column, name in STAT_COLUMNS}}
+        stats = self.plates[plate]
+        stats['samples'] += 1
+        stats['wells'].add(well)
+        stats['btids'].add(btid)
+        for column, name in STAT_COLUMNS:
+            stats['stats'][column].add(values[column])
+
+    def merge(self, other):
+        for plate, otherStats in other.plates.items():
+            if plate not in self.plates:
+                # copied, so later adds to either summary do not change the other
+                self.plates[plate] = copy.deepcopy(otherStats)
+                continue
+            stats = self.plates[plate]
+            stats['samples'] += otherStats['samples']
+            stats['wells'] |= otherStats['wells']
+            stats['btids'] |= otherStats['btids']
+            for column, name in STAT_COLUMNS:
+                stats['stats'][column].merge(otherStats['stats'][column])
+
+    '''
+    function: table()
+    description: the statistics as the table written to summaryStatsTable.txt, one row per plate in sorted order
+    input: None
+    output: pandas DataFrame indexed by plate
+    '''
+    def table(self):
+        import pandas
+
+        columns = ['totalSamples', 'totalUniqueWells', 'totalUniqueBTID']
+        for column, name in STAT_COLUMNS:
+            columns.extend(statistic + name for statistic in ['mean', 'stdDev', 'min', 'max', 'median', 'variance'])
+
+        rows = []
+        for plate in sorted(self.plates, key=str):
+            stats = self.plates[plate]
+            row = [stats['samples'], len(stats['wells']), len(stats['btids'])]
+            for column, name in STAT_COLUMNS:
+                row.extend(stats['stats'][column].summary())
+            rows.append(row)
+
+        table = pandas.DataFrame(rows, index=pandas.Index(sorted(self.plates, key=str), name='plate'), columns=columns)
+        return table
+
+    def write(self, path):
+        logger = logging.getLogger('plateStats')
+        self.table().to_csv(path, sep='\t', index=True)
+        logger.info('Wrote statistics of {} plates to {}'.format(len(self.plates), path))
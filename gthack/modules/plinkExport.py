@@ -0,0 +1,210 @@
+import os
+import sys
+import logging
+import numpy
+
+# first bytes of a .bed file: magic number and SNP-major mode
+BED_MAGIC = bytes([0x6c, 0x1b, 0x01])
+
+# gtc genotype (0=NC, 1=AA, 2=AB, 3=BB) -> 2-bit .bed code with allele A as the first .bim allele
+# (00 homozygous first allele, 01 missing, 10 heterozygous, 11 homozygous second allele)
+BED_CODES = numpy.array([0b01, 0b00, 0b10, 0b11], dtype=numpy.uint8)
+
+# gtc gender -> .fam sex code
+FAM_SEX = {'M': '1', 'F': '2'}
+
+# default size of the genotype block buffer, in MB
+BLOCK_MB = 256
+
+
+'''
+function: packGenotypes(genotypes)
+description: 2-bit packs genotypes along the sample axis, 4 samples per byte with the first sample in the lowest bits;
+a sample count that is not a multiple of 4 is padded with zero bits as .bed expects
+input: numpy uint8 array of gtc genotypes of shape (SNPs, samples)
+output: numpy uint8 array of shape (SNPs, ceil(samples / 4))
+'''
+def packGenotypes(genotypes):
+    codes = BED_CODES[genotypes]
+    if codes.shape[1] % 4 != 0:
+        codes = numpy.pad(codes, ((0, 0), (0, 4 - codes.shape[1] % 4)))
+    return codes[:, 0::4] | (codes[:, 1::4] << 2) | (codes[:, 2::4] << 4) | (codes[:, 3::4] << 6)
+
+
+'''
+function: writeBim(path, manifest)
+description: writes the .bim file of a manifest: chromosome, SNP name, 0 cM, MapInfo position and the A/B alleles parsed
+from TopGenomicSeq ('0' where the manifest csv has no allele pair)
+input: path of .bim file and ManifestIndex built with the manifest csv
+output: None
+'''
+def writeBim(path, manifest):
+    with open(path, 'w') as bim:
+        for name, chrom, position, alleleA, alleleB in zip(manifest.names.tolist(), manifest.chroms.tolist(),
+                manifest.map_infos.tolist(), manifest.allele_a.tolist(), manifest.allele_b.tolist()):
+            if (alleleA, alleleB) == ('N', 'A'):
+                alleleA, alleleB = '0', '0'
+            bim.write('{}\t{}\t0\t{}\t{}\t{}\n'.format(chrom, name.decode(), position, alleleA, alleleB))
+
+
+'''
+function: writeFam(path, samples)
+description: writes the .fam file, sample name as family and individual ID, no parents and missing phenotype
+input: path of .fam file and list of (sample name, gtc gender)
+output: None
+'''
+def writeFam(path, samples):
+    with open(path, 'w') as fam:
+        for sampleName, sex in samples:
+            fam.write('{0}\t{0}\t0\t0\t{1}\t-9\n'.format(sampleName, FAM_SEX.get(sex, '0')))
+
+
+'''
+function: readHeader(gtc)
+description: sample name, gender and manifest of a gtc, and where its genotype section starts; only the table of
+contents and these entries are read
+input: gtc path
+output: tuple of sample name, gender, manifest name, offset of the genotype section and its number of SNPs
+'''
+def readHeader(gtc):
+    import gthack.modules.gtcView as gtcView
+
+    with gtcView.GtcView(gtc) as view:
+        return view.string(10), view.char(1007).decode(), view.string(101), view.toc[1002], view.count(1002)
+
+
+'''
+function: fillBlock(buffer, gtcs, offsets, rows, start, stop)
+description: reads SNPs start to stop of some gtcs into their rows of the block buffer.  Each gtc is opened, read at
+the bytes of those SNPs and closed again, so no more than one file per thread is open however many gtcs are exported
+input: samples x SNPs block buffer, list of gtc paths, list of genotype section offsets (from readHeader), rows to fill
+and SNP range
+output: None
+'''
+def fillBlock(buffer, gtcs, offsets, rows, start, stop):
+    for row in rows:
+        with open(gtcs[row], 'rb') as gtc:
+            # the genotype section is an int32 count followed by one byte per SNP
+            gtc.seek(offsets[row] + 4 + start)
+            buffer[row, :stop - start] = numpy.frombuffer(gtc.read(stop - start), dtype=numpy.uint8)
+
+
+'''
+function: exportGtcs(bed, gtcs, offsets, numSnps, blockSnps, threads)
+description: writes the .bed rows of gtcs SNP block by SNP block.  For each block the genotypes of blockSnps SNPs of
+every gtc are read (on a pool of threads) into a samples x blockSnps buffer, packed and appended to the .bed, so
+every genotype is read once, every output byte is written once and memory stays at the size of the buffer
+input: open .bed file (after the magic bytes), list of gtc paths in .fam order, list of their genotype section
+offsets, number of SNPs, SNPs per block and number of threads
+output: None
+'''
+def exportGtcs(bed, gtcs, offsets, numSnps, blockSnps, threads=1):
+    from concurrent.futures import ThreadPoolExecutor
+    from itertools import repeat
+
+    logger = logging.getLogger('plinkExport')
+
+    threads = max(1, min(threads, len(gtcs)))
+    rows = [range(len(gtcs) * thread // threads, len(gtcs) * (thread + 1) // threads) for thread in range(threads)]
+    buffer = numpy.empty((len(gtcs), blockSnps), dtype=numpy.uint8)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for start in range(0, numSnps, blockSnps):
+            stop = min(start + blockSnps, numSnps)
+            list(executor.map(fillBlock, repeat(buffer), repeat(gtcs), repeat(offsets), rows, repeat(start), repeat(stop)))
+            bed.write(packGenotypes(buffer[:, :stop - start].T).tobytes())
+            logger.debug('Wrote SNPs {}-{} of {}'.format(start + 1, stop, numSnps))
+
+
+'''
+function: exportStore(bed, store, blockSnps)
+description: writes a .bed file from a cohort store, which is already SNP-major: blockSnps SNPs of every sample are
+read, packed and appended at a time
+input: open .bed file (after the magic bytes), CohortStore object and SNPs per block
+output: None
+'''
+def exportStore(bed, store, blockSnps):
+    for start in range(0, store.num_snps, blockSnps):
+        locs = numpy.arange(start, min(start + blockSnps, store.num_snps))
+        bed.write(packGenotypes(store.snps(locs, [1002])[1002]).tobytes())
+
+
+'''
+function: exportPlink(self)
+description: writes the genotypes of every gtc (or of a cohort store) matching the manifest as PLINK .bed/.bim/.fam
+files.  SNP order, chromosome and position come from the manifest and its csv, allele A/B from TopGenomicSeq
+input: gtcFunction object (bpm, bpm_csv, gtcDir or store, fileOutName as the output prefix, blockMB and threads)
+output: writes {fileOutName}.bed, .bim and .fam to the output directory
+'''
+def exportPlink(self):
+    import gthack.modules.manifestIndex as manifestIndex
+    from pathlib import Path
+    from os import fspath
+
+    logger = logging.getLogger('exportPlink')
+    logger.debug('In method exportPlink()')
+
+    manifest = manifestIndex.loadManifestIndex(self.bpm, self.bpm_csv, cacheDir=self.manifestCache)
+    prefix = os.path.join(self.outDir, self.fileOutName)
+    numSnps = len(manifest)
+
+    if self.store is not None:
+        import gthack.modules.cohortStore as cohortStore
+        store = cohortStore.openStore(self.store, manifest)
+        samples = [(row[1], row[4]) for row in store.samples]
+        gtcs = [row[0] for row in store.samples]
+    else:
+        if self.inventoryFile is not None:
+            import gthack.modules.inventory as inventory
+            input_gtc_list, mismatched = inventory.readInventory(self.inventoryFile, manifest.manifest_name)
+            input_gtc_list = [gtc for gtc in input_gtc_list if gtc not in mismatched]
+        elif self.recursive:
+            input_gtc_list = sorted(fspath(gtc) for gtc in Path(self.gtcDir).rglob('*.gtc'))
+        else:
+            input_gtc_list = sorted(os.path.join(self.gtcDir, gtc) for gtc in os.listdir(self.gtcDir) if gtc.endswith('.gtc'))
+
+        # headers first, so the number of samples (and the SNPs per block) is known before any genotype is read
+        samples = []
+        gtcs = []
+        offsets = []
+        for gtc in input_gtc_list:
+            sampleName, sex, manifestName, offset, count = readHeader(gtc)
+            if manifestName != manifest.manifest_name:
+                print("Sample {}, {} does not have a matching bpm for the manifest you are supplying. Skipping sample.".format(sampleName, gtc))
+                logger.warning("Sample {}, {} does not have a matching bpm for the manifest you are supplying. Skipping sample.".format(sampleName, gtc))
+                continue
+            if count != numSnps:
+                print('{} does not have {} SNPs like its manifest.  Skipping sample.'.format(gtc, numSnps))
+                logger.warning('{} does not have {} SNPs like its manifest.  Skipping sample.'.format(gtc, numSnps))
+                continue
+            samples.append((sampleName, sex))
+            gtcs.append(gtc)
+            offsets.append(offset)
+
+    if len(samples) == 0:
+        logger.critical('No samples made with manifest {} to export'.format(manifest.manifest_name))
+        print('No samples made with manifest {} to export'.format(manifest.manifest_name))
+        sys.exit(1)
+
+    logger.info('Exporting {} samples x {} SNPs to {}.bed/.bim/.fam'.format(len(samples), numSnps, prefix))
+    print('Exporting {} samples x {} SNPs to {}.bed/.bim/.fam'.format(len(samples), numSnps, prefix))
+    writeBim(prefix + '.bim', manifest)
+    writeFam(prefix + '.fam', samples)
+
+    # written under a temporary name, so an export that stops midway never leaves a .bed that looks complete
+    blockSnps = max(1, self.blockMB * 1024 * 1024 // len(samples))
+    logger.info('Reading genotypes in blocks of {} SNPs'.format(blockSnps))
+    try:
+        with open(prefix + '.bed.tmp', 'wb') as bed:
+            bed.write(BED_MAGIC)
+            if self.store is not None:
+                exportStore(bed, store, blockSnps)
+            else:
+                exportGtcs(bed, gtcs, offsets, numSnps, blockSnps, self.threads)
+        os.replace(prefix + '.bed.tmp', prefix + '.bed')
+    except BaseException:
+        if os.path.exists(prefix + '.bed.tmp'):
+            os.remove(prefix + '.bed.tmp')
+        raise
+
+    logger.info('Wrote {}.bed, {}.bim and {}.fam'.format(prefix, prefix, prefix))
+    print('Wrote {}.bed, {}.bim and {}.fam'.format(prefix, prefix, prefix))
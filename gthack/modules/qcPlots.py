@@ -0,0 +1,195 @@
+import os
+import sys
+import logging
+
+# columns of allSampleInfo.txt that are plotted by sampleInformation
+SAMPLE_INFO_PLOTS = ['callRate', 'gc10', 'logrDev']
+
+# above this many samples the strip panels show a random subset of points (box plots and lines still use every sample)
+STRIP_SAMPLE_LIMIT = 5000
+# above this many samples the panels show the density of each sex instead of points
+DENSITY_SAMPLE_LIMIT = 50000
+
+
+'''
+function: plotPanels(fig, data, column, title, lowerStdThree, upperStdThree)
+description: draws the three panels of a QC figure: all samples, all samples with mean and std dev lines, and
+samples within 3 std devs of the mean
+input: cleared matplotlib figure, DataFrame with columns sampleGroup, sex and the plotted column, name of the column,
+title and the 3 std dev bounds
+output: list of the 3 axes
+'''
+def plotPanels(fig, data, column, title, lowerStdThree, upperStdThree):
+    import seaborn as sns
+
+    values = data[column]
+    mean = values.mean()
+    upperStdSix = mean + (values.std()*6)
+    lowerStdSix = mean - (values.std()*6)
+    removeOutliers = data.loc[(values > lowerStdThree) & (values < upperStdThree)]
+
+    axs = fig.subplots(ncols=3)
+    for ax, panelData in zip(axs, [data, data, removeOutliers]):
+        if len(data) > DENSITY_SAMPLE_LIMIT:
+            sns.violinplot(x='sampleGroup', y=column, hue='sex', data=panelData, palette="colorblind", inner='quart', cut=0, ax=ax)
+            continue
+        sns.boxplot(x='sampleGroup', y=column, data=panelData, showfliers=False, color='white', ax=ax)
+        if len(panelData) > STRIP_SAMPLE_LIMIT:
+            panelData = panelData.sample(n=STRIP_SAMPLE_LIMIT, random_state=0)
+        sns.stripplot(x='sampleGroup', y=column, hue='sex', data=panelData, palette="colorblind", ax=ax)
+
+    axs[0].set_title(title[0], fontsize=10)
+    axs[1].set_title(title[1], fontsize=10)
+    axs[2].set_title(title[2], fontsize=10)
+    axs[1].set_ylabel('')
+    axs[2].set_ylabel('')
+    axs[1].axhline(upperStdThree, ls='--', color='blue')
+    axs[1].axhline(lowerStdThree, ls='--', color='blue')
+    axs[1].axhline(upperStdSix, ls=':', color='orange')
+    axs[1].axhline(lowerStdSix, ls=':', color='orange')
+    axs[1].axhline(mean, ls='-.', color = 'green', linewidth=2)
+    for ax in axs:
+        ax.tick_params(axis='y', which='major', labelsize=8)
+        if ax.get_legend() is not None:
+            ax.legend(loc=0)
+
+    return axs
+
+
+# table and settings of a plotting worker process, set once by initWorker; the figure is reused for every plot
+workerTable = None
+workerSettings = None
+workerFigure = None
+
+def initWorker(table, titleBreak, dtype):
+    global workerTable, workerSettings, workerFigure
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    workerTable = table
+    workerSettings = (titleBreak, dtype)
+    workerFigure = plt.figure(figsize=(11, 7))
+
+
+'''
+function: renderPlot(column, output)
+description: renders the QC figure of one column of the worker table into a png, reusing the worker figure
+input: name of the column and path of the png to write
+output: path of the png
+'''
+def renderPlot(column, output):
+    import pandas
+
+    titleBreak, dtype = workerSettings
+    data = pandas.DataFrame({'sampleGroup': 'samples', 'sex': workerTable['sex'].astype(str),
+        column: workerTable[column].astype(dtype)})
+    mean = data[column].mean()
+    upperStdThree = mean + (data[column].std()*3)
+    lowerStdThree = mean - (data[column].std()*3)
+    title = [str(column) + titleBreak + 'across all samples',
+        str(column) + titleBreak + 'across all samples \n annotated mean and std devs',
+        str(column) + titleBreak + 'across all samples \n with < 3 std devs from mean']
+
+    workerFigure.clf()
+    plotPanels(workerFigure, data, column, title, lowerStdThree, upperStdThree)
+    workerFigure.set_size_inches(11, 7)
+    workerFigure.savefig(output)
+    workerFigure.clf()
+    return output
+
+
+'''
+function: renderPlots(table, plots, titleBreak, dtype, workers)
+description: renders QC figures of several columns of a table on the non-interactive Agg backend, spread over a
+process pool when workers > 1
+input: DataFrame with a sex column, list of (column, output png) pairs, text between column name and title
+(' ' or '\n '), type the column values are read as and number of worker processes
+output: list of the pngs written
+'''
+def renderPlots(table, plots, titleBreak, dtype, workers=1):
+    from concurrent.futures import ProcessPoolExecutor
+
+    logger = logging.getLogger('qcPlots')
+
+    if len(table) == 0:
+        logger.warning('No samples to plot; skipping {} plots'.format(len(plots)))
+        print('No samples to plot; skipping {} plots'.format(len(plots)))
+        return []
+    if len(table) > DENSITY_SAMPLE_LIMIT:
+        logger.info('{} samples: plotting densities instead of points'.format(len(table)))
+    elif len(table) > STRIP_SAMPLE_LIMIT:
+        logger.info('{} samples: plotting a random {} points per panel'.format(len(table), STRIP_SAMPLE_LIMIT))
+
+    columns = [column for column, output in plots]
+    outputs = [output for column, output in plots]
+    if workers > 1 and len(plots) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(plots)), initializer=initWorker, initargs=(table, titleBreak, dtype)) as executor:
+            written = list(executor.map(renderPlot, columns, outputs))
+    else:
+        import matplotlib.pyplot as plt
+        initWorker(table, titleBreak, dtype)
+        written = [renderPlot(column, output) for column, output in plots]
+        plt.close(workerFigure)
+
+    logger.info('Wrote {} plots'.format(len(written)))
+    return written
+
+
+'''
+function: sampleInfoPlots(summaryData, outDir, prefix, workers)
+description: renders the callRate, gc10 and logrDev figures of sampleInformation
+input: DataFrame of allSampleInfo.txt, output directory, file name prefix (including its separator) and number of workers
+output: list of the pngs written
+'''
+def sampleInfoPlots(summaryData, outDir, prefix, workers=1):
+    plots = [(i, os.path.join(outDir, prefix + str(i) + "Plots.png")) for i in SAMPLE_INFO_PLOTS]
+    return renderPlots(summaryData, plots, ' ', float, workers)
+
+
+'''
+function: intensityPlots(intensities, prefix, workers)
+description: renders one figure per control probe column of getIntensities, written to the working directory
+input: DataFrame of controlProbeIntensityValues.txt (sex column and probe columns), file name prefix and number of workers
+output: list of the pngs written
+'''
+def intensityPlots(intensities, prefix, workers=1):
+    plots = [(i, prefix + str(i) + "Plots.png") for i in intensities.columns if i != 'sex']
+    return renderPlots(intensities, plots, '\n ', int, workers)
+
+
+'''
+function: replot(self)
+description: renders the QC figures again from tables already written by sampleInformation (allSampleInfo.txt) or
+getIntensities (controlProbeIntensityValues.txt) in the output directory, without reading any gtc
+input: gtcFunction object (outDir, fileOutName (None for both default tables), prefix and workers)
+output: writes the figures as sampleInformation and getIntensities do
+'''
+def replot(self):
+    import pandas
+
+    logger = logging.getLogger('replot')
+
+    if self.fileOutName is not None:
+        tables = [os.path.join(self.outDir, self.fileOutName)]
+    else:
+        tables = [os.path.join(self.outDir, table) for table in ['allSampleInfo.txt', 'controlProbeIntensityValues.txt']
+            if os.path.isfile(os.path.join(self.outDir, table))]
+    if len(tables) == 0:
+        logger.critical('No allSampleInfo.txt or controlProbeIntensityValues.txt in {} to plot'.format(self.outDir))
+        print('No allSampleInfo.txt or controlProbeIntensityValues.txt in {} to plot'.format(self.outDir))
+        sys.exit(1)
+
+    for table in tables:
+        data = pandas.read_table(table, index_col=0)
+        if all(column in data.columns for column in SAMPLE_INFO_PLOTS):
+            data = data.reset_index()
+            written = sampleInfoPlots(data, self.outDir, self.prefix + "_" if self.prefix != '' else self.prefix, self.workers)
+        elif 'sex' in data.columns and any(column.endswith('_1X') for column in data.columns):
+            written = intensityPlots(data, self.prefix, self.workers)
+        else:
+            logger.critical('{} is not a table written by sampleInformation or getIntensities'.format(table))
+            print('{} is not a table written by sampleInformation or getIntensities'.format(table))
+            sys.exit(1)
+        logger.info('Plotted {} figures from {}'.format(len(written), table))
+        print('Plotted {} figures from {}'.format(len(written), table))
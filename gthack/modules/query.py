@@ -0,0 +1,162 @@
+import os
+import sys
+import logging
+import numpy
+
+# per-SNP sections returned by a query, with their output column names
+QUERY_SECTIONS = [(1002, 'genotype'), (1003, 'baseCall'), (1004, 'gcScore'), (1012, 'bAlleleFreq'), (1013, 'logRRatio')]
+GENOTYPES = numpy.array(['NC', 'AA', 'AB', 'BB'])
+
+
+'''
+function: readSnpList(snps, manifest)
+description: resolves the SNP names of a query list (first tab-delimited column of each line, # lines skipped) to
+bpm indices once, before any gtc is opened.  A SNP listed more than once is queried once
+input: path to SNP list and ManifestIndex of the bpm
+output: tuple of SNP names, numpy array of their indices and a list of error messages
+'''
+def readSnpList(snps, manifest):
+    names = []
+    seen = set()
+    locs = []
+    errors = []
+    with open(snps) as snpList:
+        for lineNumber, line in enumerate(snpList, 1):
+            if line.strip() == '' or line.startswith('#'):
+                continue
+            name = line.rstrip('\n').split('\t')[0].strip()
+            if name in seen:
+                continue
+            try:
+                locs.append(manifest.locate(name))
+                names.append(name)
+                seen.add(name)
+            except ValueError as error:
+                errors.append('snp list line {}: {}'.format(lineNumber, error))
+    if len(names) == 0 and len(errors) == 0:
+        errors.append('snp list {} has no SNP names'.format(snps))
+    return names, numpy.array(locs, dtype=numpy.int64), errors
+
+
+'''
+function: querySnps(gtc, locs, manifestName)
+description: reads the genotype, base call, GC score, B allele frequency and log R ratio of a few SNPs of one gtc.
+Only the table of contents and the pages holding the requested elements of each section are read (gtcView), so
+the cost grows with the number of SNPs, not with the size of the arrays
+input: gtc path, numpy array of bpm indices and the manifest name the gtc has to be made with
+output: tuple of sample name and dictionary of toc ID -> numpy array of the values in the order of locs (None if
+the gtc was made with another manifest)
+'''
+def querySnps(gtc, locs, manifestName):
+    import gthack.modules.gtcView as gtcView
+
+    with gtcView.GtcView(gtc) as view:
+        sampleName = view.string(10)
+        if view.string(101) != manifestName:
+            return sampleName, None
+        return sampleName, {toc_id: view.array(toc_id)[locs] for toc_id, column in QUERY_SECTIONS}
+
+
+'''
+function: queryRows(gtc, sampleName, names, values, sections, queryFormat)
+description: output rows of one queried gtc
+input: gtc path, sample name, SNP names, values from querySnps, the (toc ID, column) pairs to write and 'long' (one
+row per SNP) or 'wide' (one row per gtc)
+output: list of rows (lists of strings)
+'''
+def queryRows(gtc, sampleName, names, values, sections, queryFormat):
+    columns = []
+    for toc_id, column in sections:
+        if toc_id == 1002:
+            columns.append(GENOTYPES[values[toc_id]])
+        elif toc_id == 1003:
+            columns.append(numpy.char.decode(values[toc_id], 'ascii'))
+        else:
+            columns.append(values[toc_id].astype(str))
+    if queryFormat == 'long':
+        return [[gtc, sampleName, name] + [column[i] for column in columns] for i, name in enumerate(names)]
+    return [[gtc, sampleName] + [column[i] for i in range(len(names)) for column in columns]]
+
+
+'''
+function: storeValues(store, locs)
+description: the queried SNPs of every sample of a cohort store, read as one SNP-major slice
+input: CohortStore object and numpy array of bpm indices
+output: generator of (gtc path, (sample name, dictionary of toc ID -> numpy array)), in store order
+'''
+def storeValues(store, locs):
+    values = store.snps(locs)
+    for index, row in enumerate(store.samples):
+        yield row[0], (row[1], {toc_id: sectionValues[:, index] for toc_id, sectionValues in values.items()})
+
+
+'''
+function: query(self)
+description: genotype, base call, GC score, B allele frequency and log R ratio of a list of SNPs across every gtc,
+read on a pool of threads and written in gtc order as a long (gtc, sampleName, snp, values) or wide (one row per
+gtc, columns snp.genotype, snp.baseCall, ...) table.  With a cohort store the values are read from the store
+instead, without the base call (the store does not keep it)
+input: gtcFunction object
+output: writes fileOutName to the output directory
+'''
+def query(self):
+    import gthack.modules.manifestIndex as manifestIndex
+    from concurrent.futures import ThreadPoolExecutor
+    from itertools import repeat
+    from pathlib import Path
+    from os import fspath
+
+    logger = logging.getLogger('query')
+    logger.debug('In method query()')
+
+    manifest = manifestIndex.loadManifestIndex(self.bpm, cacheDir=self.manifestCache)
+    names, locs, errors = readSnpList(self.snps, manifest)
+    if len(errors) > 0:
+        for error in errors:
+            logger.critical(error)
+            print(error)
+        logger.critical('{} error(s) in snp list {}; nothing was queried'.format(len(errors), self.snps))
+        print('{} error(s) in snp list {}; nothing was queried'.format(len(errors), self.snps))
+        sys.exit(1)
+
+    sections = QUERY_SECTIONS
+    if self.store is not None:
+        import gthack.modules.cohortStore as cohortStore
+        store = cohortStore.openStore(self.store, manifest)
+        sections = [(toc_id, column) for toc_id, column in QUERY_SECTIONS if toc_id in store.sections]
+        input_gtc_list = [row[0] for row in store.samples]
+    elif self.inventoryFile is not None:
+        import gthack.modules.inventory as inventory
+        input_gtc_list, mismatched = inventory.readInventory(self.inventoryFile, manifest.manifest_name)
+        input_gtc_list = [gtc for gtc in input_gtc_list if gtc not in mismatched]
+    elif self.recursive:
+        input_gtc_list = sorted(fspath(gtc) for gtc in Path(self.gtcDir).rglob('*.gtc'))
+    else:
+        input_gtc_list = sorted(os.path.join(self.gtcDir, gtc) for gtc in os.listdir(self.gtcDir) if gtc.endswith('.gtc'))
+
+    logger.info('Querying {} SNPs in {} gtcs with {} thread(s)'.format(len(names), len(input_gtc_list), self.threads))
+    print('Querying {} SNPs in {} gtcs with {} thread(s)'.format(len(names), len(input_gtc_list), self.threads))
+
+    if self.queryFormat == 'long':
+        header = ['gtc', 'sampleName', 'snp'] + [column for toc_id, column in sections]
+    else:
+        header = ['gtc', 'sampleName'] + ['{}.{}'.format(name, column) for name in names for toc_id, column in sections]
+
+    queried = 0
+    with open(os.path.join(self.outDir, self.fileOutName), 'w') as output, \
+            ThreadPoolExecutor(max_workers=max(1, self.threads)) as executor:
+        output.write('\t'.join(header) + '\n')
+        if self.store is not None:
+            queried_gtcs = storeValues(store, locs)
+        else:
+            queried_gtcs = zip(input_gtc_list, executor.map(querySnps, input_gtc_list, repeat(locs), repeat(manifest.manifest_name)))
+        for gtc, (sampleName, values) in queried_gtcs:
+            if values is None:
+                print("Sample {}, {} does not have a matching bpm for the manifest you are supplying. Skipping sample.".format(sampleName, gtc))
+                logger.warning("Sample {}, {} does not have a matching bpm for the manifest you are supplying. Skipping sample.".format(sampleName, gtc))
+                continue
+            output.writelines('\t'.join(row) + '\n' for row in queryRows(gtc, sampleName, names, values, sections, self.queryFormat))
+            queried += 1
+
+    logger.info('Wrote {} SNPs of {} gtcs to {}'.format(len(names), queried, os.path.join(self.outDir, self.fileOutName)))
+    print('Wrote {} SNPs of {} gtcs to {}'.format(len(names), queried, os.path.join(self.outDir, self.fileOutName)))
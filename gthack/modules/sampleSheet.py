@@ -1,121 +1,139 @@
-from IlluminaBeadArrayFiles import *
-import struct
-from io import BytesIO
 import os
 import sys
 import logging
-import pandas
-import pympler
-from pympler import muppy
-from pympler import summary
-#from multiprocessing import Process
-import multiprocessing
-import glob
 
 '''
-function: baseData(self)
-description: extracts information from each gtc file in the directory to get all base metadata information formated into csv for sample sheet
-input: gtcFunction object
-output: does not return anything, however, a temporary file [data] csv is generated on the local system
+function: readConfig(config)
+description: reads the sample sheet configuration (key:value lines)
+input: path to configuration file
+output: dictionary of key -> [value]
 '''
-def checkConfig(config, gtcDir):
-	logger = logging.getLogger('checkConfig')
-	logger.debug('In module sampleSheet.py in baseData() in submodule checkConfig')
+def readConfig(config):
+	logger = logging.getLogger('readConfig')
+	logger.debug('In module sampleSheet.py in readConfig()')
 
-	totalGtcs = sum([1 for gtcFile in os.listdir(gtcDir) if gtcFile.endswith('.gtc')])
-	
 	configParams = {}
 	with open(config, 'r') as baseParameters:
 		for line in baseParameters:
 			configParams[line.split(':')[0]] = [line.split(':')[1].rstrip()]
+	return configParams
+
+'''
+function: checkConfig(configParams, totalGtcs)
+description: checks there are enough gtcs for the control wells of the configuration
+input: configuration from readConfig and number of gtcs of the sample sheet
+output: error message, or None if the configuration can be used
+'''
+def checkConfig(configParams, totalGtcs):
+	if totalGtcs - len(configParams['control_wells']) >= 0:
+		return None
+	return 'There are not enough .gtc files to assign new values that are not controls'
+
+# toc IDs read from each gtc: sample name, plate, well, sex, sentrix barcode
+SAMPLE_SHEET_FIELDS = [10, 11, 12, 1007, 1016]
+
+# gtcs handed to a worker process at a time
+CHUNK_SIZE = 32
+
+SAMPLE_SHEET_COLUMNS = ['Sample_ID','SentrixBarcode_A','SentrixPosition_A','Sample_Plate','Sample_Well','Gender','Sample_Name','Instrument_ID','Race','MRN','Name','DOB','exclude','Notes']
 
-	try:
-		assert ((totalGtcs - len(configParams['control_wells']) <= totalGtcs) and (totalGtcs - len(configParams['control_wells']) >= 0))
-		return configParams, totalGtcs
-		
-	except AssertionError:
-		print('There are not enough .gtc files to assign new values that are not controls')
-		logger.critical('There are not enough .gtc files to assign new values that are not controls')
-		sys.exit()
 
 '''
-function: baseData(self)
-description: extracts information from each gtc file in the directory to get all base metadata information formated into csv for sample sheet
-input: gtcFunction object
-output: does not return anything, however, a temporary file [data] csv is generated on the local system
+function: readHeaders(gtcs, gtcDir)
+description: reads only the sample sheet fields (SAMPLE_SHEET_FIELDS) of a run of gtcs; sex is returned as text
+input: list of gtc file names and the directory they are in
+output: list of data dictionaries, in the order of gtcs
 '''
-def baseData(self):
+def readHeaders(gtcs, gtcDir):
 	import gthack.modules.extractInformation as extractInformation
-	import random
 
-	bpm=self.bpm
-	gtcDir=self.gtcDir
-	outDir=self.outDir
-	sampleSheetUpdatesInput = self.sampleSheetUpdates
-	config = self.config
-	pseudoInstID = self.pseudoInstID
-	pseudoMrn = self.pseudoMrn
+	headers = []
+	for gtcFile in gtcs:
+		data = extractInformation.getGtcInfo(os.path.join(gtcDir, gtcFile), SAMPLE_SHEET_FIELDS)
+		if isinstance(data[1007], bytes):
+			data[1007] = data[1007].decode()
+		headers.append(data)
+	return headers
 
-	logger = logging.getLogger('generateSampleSheet')
-	logger.debug('In method generateSampleSheet')
 
-	
-	def updateData(gtcFile, data, sampleSheetUpdates, default, exclude, gtcMatchFile):
-		logger = logging.getLogger('updateData')
-		logger.debug('In module sampleSheet.py in baseData() in submodule updateData')
-		if sampleSheetUpdates == None:
-			manifestGender = 'Unknown'
-			if data[1007] == 'F':
-				manifestSex = 'Female'
-			elif data[1007] == 'M':
-				manifestSex = 'Male'
-			elif data[1007] == 'U':
-				manifestSex = "Unknown"
-			colValues = [
-				data[10],
-				data[1016],
-				gtcFile.split('_')[1][:-4],
-				data[11],
-				data[12],
-				manifestSex,
-				data[10],
-				str(default['instID']),
-				'',
-				str(default['mrn']),
-				'UNKNOWN, UNKNOWN',
-				'00-00-0000',
-				exclude,
-				'validationPlate'
-				]
-			gtcMatchFile.write('\t'.join([gtcFile, data[10], data[12], manifestSex,
-				str(default['instID']), str(default['mrn']), 'UNKNOWN, UNKNOWN', '00-00-0000']) + '\n')
+'''
+function: updateData(gtcFile, data, sampleSheetUpdates, default, exclude)
+description: sample sheet row of one gtc, from its own metadata with the default (random) instrument ID and MRN or
+from a row of the sample sheet updates
+input: gtc file name, data dictionary from readHeaders, update row as dictionary (or None), dictionary of default
+instID and mrn, and the exclude value
+output: tuple of the sample sheet row and the row of gtcFiles_paired_sampleSheet.txt
+'''
+def updateData(gtcFile, data, sampleSheetUpdates, default, exclude):
+	logger = logging.getLogger('updateData')
+	logger.debug('In module sampleSheet.py in baseData() in submodule updateData')
+	if sampleSheetUpdates == None:
+		manifestSex = 'Unknown'
+		if data[1007] == 'F':
+			manifestSex = 'Female'
+		elif data[1007] == 'M':
+			manifestSex = 'Male'
+		colValues = [
+			data[10],
+			data[1016],
+			gtcFile.split('_')[1][:-4],
+			data[11],
+			data[12],
+			manifestSex,
+			data[10],
+			str(default['instID']),
+			'',
+			str(default['mrn']),
+			'UNKNOWN, UNKNOWN',
+			'00-00-0000',
+			exclude,
+			'validationPlate'
+			]
+		matchValues = [gtcFile, data[10], data[12], manifestSex,
+			str(default['instID']), str(default['mrn']), 'UNKNOWN, UNKNOWN', '00-00-0000']
 
-		else:
-			logger.debug('Updating {} in manifest sample sheet'.format(sampleSheetUpdates['patientName']))
-			colValues = [
-				data[10],
-				data[1016],
-				gtcFile.split('_')[1][:-4],
-				data[11],
-				data[12],
-				sampleSheetUpdates['sex'],
-				data[10],
-				sampleSheetUpdates['instrumentID'],
-				'',
-				sampleSheetUpdates['mrn'],
-				sampleSheetUpdates['patientName'],
-				sampleSheetUpdates['DOB'],
-				exclude,
-				'validationPlate'
-				]
-
-			gtcMatchFile.write('\t'.join([gtcFile, data[10], data[12], sampleSheetUpdates['sex'],
-				sampleSheetUpdates['instrumentID'], sampleSheetUpdates['mrn'], sampleSheetUpdates['patientName'],
-				sampleSheetUpdates['DOB']]) + '\n')
-
-		
-		return colValues
+	else:
+		logger.debug('Updating {} in manifest sample sheet'.format(sampleSheetUpdates['patientName']))
+		colValues = [
+			data[10],
+			data[1016],
+			gtcFile.split('_')[1][:-4],
+			data[11],
+			data[12],
+			sampleSheetUpdates['sex'],
+			data[10],
+			sampleSheetUpdates['instrumentID'],
+			'',
+			sampleSheetUpdates['mrn'],
+			sampleSheetUpdates['patientName'],
+			sampleSheetUpdates['DOB'],
+			exclude,
+			'validationPlate'
+			]
+		matchValues = [gtcFile, data[10], data[12], sampleSheetUpdates['sex'],
+			sampleSheetUpdates['instrumentID'], sampleSheetUpdates['mrn'], sampleSheetUpdates['patientName'],
+			sampleSheetUpdates['DOB']]
+
+	return colValues, matchValues
+
+
+'''
+function: baseData(sheet, configParams, randomInstIDs, randomMrns, executor)
+description: extracts information from each gtc file of a sample sheet to get all base metadata information formated for the [Data] section.
+Gtc headers are read by the worker pool when given; rows, update assignments and random IDs are made in this process, in gtc name order
+input: sample sheet (dictionary of gtcDir, gtcFiles and sampleSheetUpdates), configuration from readConfig, random instrument IDs and MRNs (one per gtc)
+and a ProcessPoolExecutor (or None to read in this process)
+output: tuple of the [Data] rows as a DataFrame sorted by well (None if not all sample sheet updates were used) and the rows of the gtc pairing file
+'''
+def baseData(sheet, configParams, randomInstIDs, randomMrns, executor=None):
+	import pandas
+	from itertools import repeat
+
+	gtcDir = sheet['gtcDir']
+	gtcFiles = sheet['gtcFiles']
 
+	logger = logging.getLogger('generateSampleSheet')
+	logger.debug('In method generateSampleSheet')
 
 	'''
 	TODO:
@@ -128,166 +146,200 @@ def baseData(self):
 	# sex needs to be coded as Male and Female not M and F
 	# make sample sheet columns and order mutable based on config file
 	'''
-	manifest = BeadPoolManifest(bpm)
-	gtcMatchData = open(os.path.join(outDir, 'gtcFiles_paired_sampleSheet.txt'), 'w')
-	configParams, totalGtcs = checkConfig(config = config, gtcDir = gtcDir)
-	if sampleSheetUpdatesInput != None:
-		sampleSheetUpdates = pandas.read_table(sampleSheetUpdatesInput, dtype=str)
+	if sheet['sampleSheetUpdates'] != None:
+		sampleSheetUpdates = pandas.read_table(sheet['sampleSheetUpdates'], dtype=str).to_dict('records')
 	else:
-		sampleSheetUpdates = pandas.DataFrame()
-	smplSheetcols = ['Sample_ID','SentrixBarcode_A','SentrixPosition_A','Sample_Plate','Sample_Well','Gender','Sample_Name','Instrument_ID','Race','MRN','Name','DOB','exclude','Notes']
-	outputInfo = []
+		sampleSheetUpdates = []
 
-	randomInstIDs = random.sample(range(int(pseudoInstID.split(',')[0]), int(pseudoInstID.split(',')[1])), totalGtcs)
-	randomMrns = random.sample(range(int(pseudoMrn.split(',')[0]), int(pseudoMrn.split(',')[1])), totalGtcs)
-
-	
-
-	def gtcProcessing(gtcFile, randMRN, randInstID, finalList):
-		import types
-		
-		#print('Pre-Processing Memory Leak Check for gtc {}:\n'.format(gtcFile))			
-		#all_objects_in_gtc = muppy.get_objects()
-		#subsetObjects = muppy.filter(all_objects_in_gtc, Type=types.MethodType)
-		#preProcess = summary.summarize(subsetObjects)
-		if gtcFile.endswith('.gtc'):
-			colValues = []
-			data = extractInformation.getGtcInfo(os.path.join(gtcDir, gtcFile))
-			if data[12] in configParams['control_wells']:
-				colValues = updateData(gtcFile=gtcFile, data=data, sampleSheetUpdates=None, default={'instID':randInstID, 'mrn':randMRN}, exclude=0, gtcMatchFile=gtcMatchData)
-			elif gtcFile in configParams['exclude_gtcs']:
-				colValues = updateData(gtcFile=gtcFile, data=data, sampleSheetUpdates=None, default={'instID':randInstID, 'mrn':randMRN}, exclude=1, gtcMatchFile=gtcMatchData)			
-			elif len(sampleSheetUpdates.index) > 0:
-				colValues = updateData(gtcFile=gtcFile, data=data, sampleSheetUpdates=sampleSheetUpdates.iloc[0].to_dict(), default=None, exclude=0, gtcMatchFile=gtcMatchData)
-				sampleSheetUpdates.drop(0, inplace=True)
-				sampleSheetUpdates.reset_index(drop=True, inplace=True)	
-			else:
-				colValues = updateData(gtcFile=gtcFile, data=data, sampleSheetUpdates=None, default={'instID':randInstID, 'mrn':randMRN}, exclude=0, gtcMatchFile=gtcMatchData)
-				
-			singleSample = dict(zip(smplSheetcols, colValues))
-			#print('Pre- vs Post-Processing Memory Leak Check for gtc {}:\n'.format(gtcFile))			
-			#all_objects_in_gtc = muppy.get_objects()
-			#subsetObjects = muppy.filter(all_objects_in_gtc, Type=types.MethodType)
-			#postProcess = summary.summarize(subsetObjects)
-			finalList.append(singleSample)
-			#print(summary.get_diff(preProcess, postProcess))
-
-	
-	dataManager = multiprocessing.Manager()
-	finalList = dataManager.list()
-	listOfJobs = []
-	for gtcFile in enumerate(glob.glob(os.path.join(gtcDir, "*.gtc"))):
-		randMRN = randomMrns[gtcFile[0]]
-		randInstID =  randomInstIDs[gtcFile[0]]
-		gtcFile = gtcFile[1].split('/')[-1]
-		processes = multiprocessing.Process(target = gtcProcessing, args=(gtcFile, randMRN, randInstID, finalList))
-		listOfJobs.append(processes)
-		processes.start()
-
-	for eachJob in listOfJobs:
-		eachJob.join()
-
-	# convert a proxy list to normal list object for use in downstream code
-	convertedList = [i for i in finalList]
+	chunks = [gtcFiles[start:start + CHUNK_SIZE] for start in range(0, len(gtcFiles), CHUNK_SIZE)]
+	if executor is not None and len(chunks) > 1:
+		headers = [data for chunk in executor.map(readHeaders, chunks, repeat(gtcDir)) for data in chunk]
+	else:
+		headers = [data for chunk in chunks for data in readHeaders(chunk, gtcDir)]
 
-	try:
-		assert len(sampleSheetUpdates.index) == 0
-		dataManifest= pandas.DataFrame(convertedList)
-		dataManifest.sort_values(by=['Sample_Well'], inplace=True)
-		dataManifest.to_csv(os.path.join(outDir, '_tmp_data.csv'), index=False)
-		gtcMatchData.flush()
-		gtcMatchData.close()
-		del dataManifest
-	except AssertionError:
+	outputInfo = []
+	matchInfo = []
+	updates = iter(sampleSheetUpdates)
+	for index, (gtcFile, data) in enumerate(zip(gtcFiles, headers)):
+		default = {'instID': randomInstIDs[index], 'mrn': randomMrns[index]}
+		if data[12] in configParams['control_wells']:
+			colValues, matchValues = updateData(gtcFile=gtcFile, data=data, sampleSheetUpdates=None, default=default, exclude=0)
+		elif gtcFile in configParams['exclude_gtcs']:
+			colValues, matchValues = updateData(gtcFile=gtcFile, data=data, sampleSheetUpdates=None, default=default, exclude=1)
+		else:
+			update = next(updates, None)
+			colValues, matchValues = updateData(gtcFile=gtcFile, data=data, sampleSheetUpdates=update, default=None if update else default, exclude=0)
+		outputInfo.append(dict(zip(SAMPLE_SHEET_COLUMNS, colValues)))
+		matchInfo.append(matchValues)
+
+	if next(updates, None) is not None:
 		print('Not all samples in sample update list were used in gtc file')
 		logger.error('Not all samples in sample update list were used in gtc file')
+		return None, matchInfo
+
+	dataManifest= pandas.DataFrame(outputInfo, columns=SAMPLE_SHEET_COLUMNS)
+	dataManifest.sort_values(by=['Sample_Well'], inplace=True, kind='stable')
+	return dataManifest, matchInfo
 
 '''
-function: updateHeader(self)
+function: updateHeader(bpm, configParams)
 description: generates the header portion of the sample sheet
-input: gtcFunction object
-output: nothing is returned, however, a temporary file [header] csv is generated on the local system
+input: path to bpm file and configuration from readConfig
+output: list of the [Header] and [Manifests] lines, ending with the [Data] line
 '''
-def updateHeader(self):
+def updateHeader(bpm, configParams):
 	from datetime import datetime
 
-	outDir = self.outDir
-	bpm = self.bpm
-	config = self.config
-	gtcDir = self.gtcDir
-
 	logger = logging.getLogger('updateHeader')
 	logger.debug('In method updateHeader')
 
-	configParams, totalGtcs = checkConfig(config=config, gtcDir=gtcDir)
-
-	smplSheetcols = ['Sample_ID','SentrixBarcode_A','SentrixPosition_A','Sample_Plate','Sample_Well','Gender','Sample_Name','Instrument_ID','Race','MRN','Name','DOB','exclude','Notes']
-
-	placeHolder = ['' for i in range(0, len(smplSheetcols))]
+	header = []
+	placeHolder = ['' for i in range(0, len(SAMPLE_SHEET_COLUMNS))]
 	placeHolder[0] = '[Header]'
-	headerFile = open(os.path.join(outDir, '_tmp_headerFile.csv'), 'w')
-	headerFile.write(','.join(placeHolder) + '\n')
+	header.append(','.join(placeHolder) + '\n')
 
 	placeHolder[0] = 'Institute Name'
 	placeHolder[1] = configParams['institute_name'][0]
-	headerFile.write(','.join(placeHolder) + '\n')
+	header.append(','.join(placeHolder) + '\n')
 
 	placeHolder[0] = 'Investigator Name'
 	placeHolder[1] = configParams['investigator_name'][0]
-	headerFile.write(','.join(placeHolder) + '\n')
+	header.append(','.join(placeHolder) + '\n')
 
 	placeHolder[0] = 'Project Name'
 	placeHolder[1] = configParams['project_name'][0]
-	headerFile.write(','.join(placeHolder) + '\n')
+	header.append(','.join(placeHolder) + '\n')
 
 	placeHolder[0] = 'Date'
 	placeHolder[1] =  datetime.today().strftime("%m/%d/%y")
-	headerFile.write(','.join(placeHolder) + '\n')
+	header.append(','.join(placeHolder) + '\n')
 
-	placeHolder = ['' for i in range(0, len(smplSheetcols))]
-	headerFile.write(','.join(placeHolder) + '\n')
+	placeHolder = ['' for i in range(0, len(SAMPLE_SHEET_COLUMNS))]
+	header.append(','.join(placeHolder) + '\n')
 
 	placeHolder[0] = '[Manifests]'
-	headerFile.write(','.join(placeHolder) + '\n')
+	header.append(','.join(placeHolder) + '\n')
 
 	placeHolder[0] = 'A'
 	placeHolder[1] = bpm.split('/')[-1][:-4]
 	placeHolder[2] = configParams['egt_cluster_file'][0]
-	headerFile.write(','.join(placeHolder) + '\n')
+	header.append(','.join(placeHolder) + '\n')
 
-	placeHolder = ['' for i in range(0, len(smplSheetcols))]
-	headerFile.write(','.join(placeHolder) + '\n')
+	placeHolder = ['' for i in range(0, len(SAMPLE_SHEET_COLUMNS))]
+	header.append(','.join(placeHolder) + '\n')
 
 	placeHolder[0] = '[Data]'
-	headerFile.write(','.join(placeHolder)+'\n')
-
-	headerFile.flush()
-	headerFile.close()
+	header.append(','.join(placeHolder)+'\n')
 
-	del placeHolder
+	return header
 
 
 '''
-function: generateSampleSheet(outDir, fileName)
-description: combines the temorary [header] and [data] csv files to generate final manifest
-input: path to output directory and the name of the final sample sheet
+function: generateSampleSheet(outDir, fileName, header, dataManifest)
+description: writes the final sample sheet in one pass: the header lines followed by the [Data] rows
+input: path to output directory, the name of the final sample sheet, header lines from updateHeader and [Data] rows from baseData
 output: does not return anything, however, a final csv sample sheet is generated on the local system
 '''
-def generateSampleSheet(outDir, fileName):
-	import subprocess
-	
+def generateSampleSheet(outDir, fileName, header, dataManifest):
 	logger = logging.getLogger('generateSampleSheet')
 	logger.debug('In method generateSampleSheet()')
 
-	finalFile = open(os.path.join(outDir, fileName), 'w')
+	with open(os.path.join(outDir, fileName), 'w') as finalFile:
+		finalFile.writelines(header)
+		dataManifest.to_csv(finalFile, index=False)
+
 
+'''
+function: readBatch(batch)
+description: reads a sample sheet batch file: tab-delimited with header gtcDir, fileOutName and optionally
+sampleSheetUpdates, one sample sheet per line
+input: path to batch file
+output: tuple of the list of sample sheets (dictionaries) and a list of error messages
+'''
+def readBatch(batch):
+	errors = []
+	sheets = []
+	with open(batch) as batchFile:
+		header = batchFile.readline().rstrip('\n').split('\t')
+		for column in ['gtcDir', 'fileOutName']:
+			if column not in header:
+				errors.append('sample sheet batch {} has no {} column'.format(batch, column))
+		if errors:
+			return sheets, errors
+		for lineNumber, line in enumerate(batchFile, 2):
+			if line.strip() == '':
+				continue
+			values = dict(zip(header, line.rstrip('\n').split('\t')))
+			sheets.append({'gtcDir': values['gtcDir'], 'fileOutName': values['fileOutName'],
+				'sampleSheetUpdates': values.get('sampleSheetUpdates') or None, 'line': lineNumber})
+	return sheets, errors
+
+
+'''
+function: createSampleSheets(self)
+description: writes one sample sheet, or one per line of a batch file, reading the configuration and each gtc directory once.
+All sheets share one worker pool, and their random instrument IDs and MRNs are drawn together so they are unique across the batch
+input: gtcFunction object
+output: writes each sample sheet and its gtc pairing file to the output directory
+'''
+def createSampleSheets(self):
+	import random
+	from concurrent.futures import ProcessPoolExecutor
+
+	logger = logging.getLogger('createSampleSheet')
+
+	if self.sampleSheetBatch is not None:
+		sheets, errors = readBatch(self.sampleSheetBatch)
+		for sheet in sheets:
+			# pairing files are named after their sample sheet so the sheets of a batch do not overwrite each other
+			sheet['pairedFile'] = os.path.splitext(sheet['fileOutName'])[0] + '_gtcFiles_paired_sampleSheet.txt'
+	else:
+		sheets = [{'gtcDir': self.gtcDir, 'fileOutName': self.fileOutName, 'sampleSheetUpdates': self.sampleSheetUpdates,
+			'pairedFile': 'gtcFiles_paired_sampleSheet.txt', 'line': None}]
+		errors = []
+
+	configParams = readConfig(self.config)
+	for sheet in sheets:
+		where = '' if sheet['line'] is None else 'batch line {}: '.format(sheet['line'])
+		if not os.path.isdir(sheet['gtcDir']):
+			errors.append('{}gtc directory {} does not exist'.format(where, sheet['gtcDir']))
+			continue
+		if sheet['sampleSheetUpdates'] is not None and not os.path.isfile(sheet['sampleSheetUpdates']):
+			errors.append('{}sample sheet updates {} do not exist'.format(where, sheet['sampleSheetUpdates']))
+		sheet['gtcFiles'] = sorted(gtcFile for gtcFile in os.listdir(sheet['gtcDir']) if gtcFile.endswith('.gtc'))
+		error = checkConfig(configParams, len(sheet['gtcFiles']))
+		if error is not None:
+			errors.append(where + error)
+	if len(set(sheet['fileOutName'] for sheet in sheets)) != len(sheets):
+		errors.append('sample sheets of a batch need different fileOutName values')
+
+	if len(errors) > 0:
+		for error in errors:
+			logger.critical(error)
+			print(error)
+		sys.exit(1)
+
+	totalGtcs = sum(len(sheet['gtcFiles']) for sheet in sheets)
+	randomInstIDs = random.sample(range(int(self.pseudoInstID.split(',')[0]), int(self.pseudoInstID.split(',')[1])), totalGtcs)
+	randomMrns = random.sample(range(int(self.pseudoMrn.split(',')[0]), int(self.pseudoMrn.split(',')[1])), totalGtcs)
+	header = updateHeader(self.bpm, configParams)
+
+	executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
 	try:
-		subprocess.check_call(['cat', os.path.join(outDir, '_tmp_headerFile.csv'), os.path.join(outDir, '_tmp_data.csv')],
-			stdout=finalFile)
-		finalFile.flush()
-		finalFile.close()
-	except subprocess.CalledProcessError:
-		pass
-
-	subprocess.run(['rm', os.path.join(outDir, '_tmp_headerFile.csv')])
-	subprocess.run(['rm', os.path.join(outDir, '_tmp_data.csv')])
\ No newline at end of file
+		start = 0
+		for sheet in sheets:
+			end = start + len(sheet['gtcFiles'])
+			dataManifest, matchInfo = baseData(sheet, configParams, randomInstIDs[start:end], randomMrns[start:end], executor)
+			start = end
+
+			with open(os.path.join(self.outDir, sheet['pairedFile']), 'w') as gtcMatchData:
+				gtcMatchData.writelines('\t'.join(matchValues) + '\n' for matchValues in matchInfo)
+			if dataManifest is None:
+				logger.error('Sample sheet {} was not written'.format(sheet['fileOutName']))
+				continue
+			generateSampleSheet(outDir=self.outDir, fileName=sheet['fileOutName'], header=header, dataManifest=dataManifest)
+			logger.info('Wrote sample sheet {} of {} gtcs'.format(sheet['fileOutName'], len(sheet['gtcFiles'])))
+			print('Wrote sample sheet {} of {} gtcs'.format(sheet['fileOutName'], len(sheet['gtcFiles'])))
+	finally:
+		if executor is not None:
+			executor.shutdown()
@@ -0,0 +1,248 @@
+import os
+import sys
+import logging
+import numpy
+
+'''
+SPEC_DEFAULTS: every key of a synthesis spec with its default.  The spec is a text file of key:value lines (as the
+sample sheet config).  Name patterns are python format strings over the fields {index} (0-based output number),
+{template} (template gtc name without .gtc), {plate} (1-based, 96 outputs per plate), {well} (A01-H12, row-major),
+{row} and {column}; an empty pattern keeps the value of the template
+'''
+SPEC_DEFAULTS = {
+    'templates': '',  # comma-separated gtc names in --gtcDir, used in turn; default is every gtc in --gtcDir
+    'count': '1',  # number of gtcs to write
+    'seed': '0',  # each output is generated from (seed, index), independent of the number of workers
+    'outputName': 'synthetic_{index:06d}',
+    'sampleName': '{template}_{index:06d}',
+    'plateName': 'SYNTHETIC_{plate:04d}',
+    'well': '{well}',
+    'sentrixBarcode': '',
+    'sex': 'keep',  # keep, M, F, U or random (M or F)
+    'genotypeRate': '0',  # fraction of SNPs per output changed to one of the other genotypes
+    'noCallRate': '0',  # fraction of SNPs per output set to a no call
+    'intensityJitter': '0',  # standard deviation of the relative gaussian noise applied to raw X and Y intensities
+}
+
+PATTERN_KEYS = ['outputName', 'sampleName', 'plateName', 'well', 'sentrixBarcode']
+RATE_KEYS = ['genotypeRate', 'noCallRate', 'intensityJitter']
+SEX_VALUES = ['keep', 'M', 'F', 'U', 'random']
+
+# outputs handed to a worker at a time
+CHUNK_SIZE = 32
+
+
+'''
+function: patternFields(index, template)
+description: values the name patterns of a synthesis spec can use for one output
+input: 0-based output number and template gtc name
+output: dictionary of field name -> value
+'''
+def patternFields(index, template):
+    position = index % 96
+    return {'index': index, 'template': template[:-4] if template.endswith('.gtc') else template,
+        'plate': index // 96 + 1, 'well': 'ABCDEFGH'[position // 12] + '{:02d}'.format(position % 12 + 1),
+        'row': 'ABCDEFGH'[position // 12], 'column': position % 12 + 1}
+
+
+'''
+function: readSpec(spec, gtcDir)
+description: reads and checks a synthesis spec before any gtc is read or written
+input: path to spec file and directory of the template gtcs
+output: tuple of the spec (dictionary with count/seed as int, rates as float and the list of templates) and a list of
+error messages
+'''
+def readSpec(spec, gtcDir):
+    errors = []
+    values = dict(SPEC_DEFAULTS)
+    with open(spec) as specFile:
+        for lineNumber, line in enumerate(specFile, 1):
+            if line.strip() == '' or line.startswith('#'):
+                continue
+            key, _, value = line.rstrip('\n').partition(':')
+            if key.strip() not in SPEC_DEFAULTS:
+                errors.append('spec line {}: {} is not one of {}'.format(lineNumber, key, ', '.join(SPEC_DEFAULTS)))
+                continue
+            values[key.strip()] = value.strip()
+
+    for key in ['count', 'seed']:
+        try:
+            values[key] = int(values[key])
+            assert values[key] >= 0
+        except (ValueError, AssertionError):
+            errors.append('spec {} must be a whole number, not {}'.format(key, values[key]))
+    for key in RATE_KEYS:
+        try:
+            values[key] = float(values[key])
+            assert 0 <= values[key] <= 1
+        except (ValueError, AssertionError):
+            errors.append('spec {} must be a number between 0 and 1, not {}'.format(key, values[key]))
+    if values['sex'] not in SEX_VALUES:
+        errors.append('spec sex must be one of {}, not {}'.format(', '.join(SEX_VALUES), values['sex']))
+
+    if values['templates'] == '':
+        values['templates'] = sorted(gtc for gtc in os.listdir(gtcDir) if gtc.endswith('.gtc'))
+    else:
+        values['templates'] = [gtc.strip() for gtc in values['templates'].split(',')]
+    if len(values['templates']) == 0:
+        errors.append('there are no template gtcs in {}'.format(gtcDir))
+    for template in values['templates']:
+        if not os.path.isfile(os.path.join(gtcDir, template)):
+            errors.append('template gtc {} does not exist'.format(os.path.join(gtcDir, template)))
+
+    for key in PATTERN_KEYS:
+        try:
+            name = values[key].format(**patternFields(0, 'template.gtc'))
+            assert len(name.encode()) <= 127
+        except (KeyError, ValueError, IndexError, AssertionError):
+            errors.append('spec {} pattern {} does not format with fields {} into at most 127 characters'
+                .format(key, values[key], ', '.join(patternFields(0, ''))))
+    if values['outputName'] == '':
+        errors.append('spec outputName pattern cannot be empty')
+    elif not errors:
+        # every output name is formatted up front, so outputs can never overwrite each other
+        firstIndex = {}
+        for index in range(values['count']):
+            name = values['outputName'].format(**patternFields(index, values['templates'][index % len(values['templates'])]))
+            if name in firstIndex:
+                errors.append('spec outputName pattern {} gives outputs {} and {} the same name {}; include {{index}}'
+                    .format(values['outputName'], firstIndex[name], index, name))
+                break
+            firstIndex[name] = index
+
+    return values, errors
+
+
+'''
+function: synthesizeGtc(index, spec, gtcDir, outDir, translator)
+description: writes one synthetic gtc: the template (index modulo the number of templates) with new metadata, a random
+share of genotypes changed or set to no call (base calls, call rate and call counts updated to match), optional sex
+and jittered raw intensities.  All randomness comes from a generator seeded with (seed, index)
+input: 0-based output number, spec from readSpec, gtc and output directories and GenotypeTranslator of the bpm
+output: list of summary values (outputName, template, sampleName, sex, genotypes changed, net no calls added)
+'''
+def synthesizeGtc(index, spec, gtcDir, outDir, translator):
+    import gthack.modules.manipulateGTC as manipulateGTC
+    import gthack.modules.genotypeTranslation as genotypeTranslation
+    import gthack.modules.write_gtc as write_gtc
+
+    random = numpy.random.default_rng([spec['seed'], index])
+    template = spec['templates'][index % len(spec['templates'])]
+    fields = patternFields(index, template)
+    data = manipulateGTC.loadSource(os.path.join(gtcDir, template))
+
+    for key in PATTERN_KEYS[1:]:
+        if spec[key] != '':
+            data[manipulateGTC.METADATA_KEYS[key]] = spec[key].format(**fields).encode()
+    if spec['sex'] == 'random':
+        data[1007] = random.choice([b'M', b'F'])
+    elif spec['sex'] != 'keep':
+        data[1007] = spec['sex'].encode()
+
+    genotypes = data[1002]
+    changed = numpy.flatnonzero(random.random(len(genotypes)) < spec['genotypeRate'])
+    noCalls = numpy.flatnonzero(random.random(len(genotypes)) < spec['noCallRate'])
+    newGenotypes = genotypes.copy()
+    # a call moves to one of the two other genotypes, a no call to any genotype
+    shift = random.integers(1, 3, len(changed))
+    newGenotypes[changed] = numpy.where(genotypes[changed] == 0, random.integers(1, 4, len(changed)),
+        (genotypes[changed].astype(numpy.int64) - 1 + shift) % 3 + 1)
+    newGenotypes[noCalls] = 0
+
+    locs = numpy.union1d(changed, noCalls)
+    indels = numpy.isin(translator.allele_a[locs], [ord('I'), ord('D')])
+    addedNoCalls = int(numpy.count_nonzero(newGenotypes[locs] == 0) - numpy.count_nonzero(genotypes[locs] == 0))
+    data = genotypeTranslation.applyUpdates(data, locs, newGenotypes[locs], translator.baseCalls(locs, newGenotypes[locs], indels))
+    if addedNoCalls != 0:
+        gc50, calls, no_calls, intensity_only = data[1011]
+        data[1011] = (gc50, max(0, calls - addedNoCalls), max(0, no_calls + addedNoCalls), intensity_only)
+        data[1006] = min(1.0, max(0.0, data[1006] - addedNoCalls / float(len(genotypes))))
+
+    if spec['intensityJitter'] > 0:
+        for toc_id in [1000, 1001]:
+            jitter = 1 + random.normal(0, spec['intensityJitter'], len(data[toc_id]))
+            data[toc_id] = numpy.clip(numpy.rint(data[toc_id] * jitter), 0, 65535).astype('<u2')
+
+    outputName = spec['outputName'].format(**fields)
+    output = os.path.join(outDir, '{}.gtc'.format(outputName))
+    tmpOutput = os.path.join(outDir, '.{}.gtc.tmp'.format(outputName))
+    try:
+        with open(tmpOutput, 'wb') as output_handle:
+            write_gtc.write_gtc(data, output_handle)
+        manipulateGTC.commitOutput(tmpOutput, output)
+    except BaseException:
+        if os.path.exists(tmpOutput):
+            os.remove(tmpOutput)
+        raise
+
+    sampleName = data[10].decode() if isinstance(data[10], bytes) else data[10]
+    sex = data[1007].decode() if isinstance(data[1007], bytes) else data[1007]
+    return [outputName, template, sampleName, sex, str(len(changed)), str(addedNoCalls)]
+
+
+# GenotypeTranslator and spec of a worker process, set once by initWorker
+workerTranslator = None
+workerSpec = None
+
+def initWorker(translator, spec):
+    global workerTranslator, workerSpec
+    workerTranslator = translator
+    workerSpec = spec
+
+
+'''
+function: synthesizeChunk(indices, gtcDir, outDir)
+description: synthesizeGtc for a run of outputs in a worker process
+input: list of output numbers, gtc and output directories
+output: list of summary values per output
+'''
+def synthesizeChunk(indices, gtcDir, outDir):
+    return [synthesizeGtc(index, workerSpec, gtcDir, outDir, workerTranslator) for index in indices]
+
+
+'''
+function: synthesize(self)
+description: writes a synthetic cohort of gtcs from one or a few templates as described by a spec (see SPEC_DEFAULTS),
+spread over a process pool.  Output is identical for the same spec and templates whatever the number of workers
+input: gtcFunction object
+output: writes the synthetic gtcs and synthesisSummary.txt (one line per output, in output order) to the output directory
+'''
+def synthesize(self):
+    import gthack.modules.manifestIndex as manifestIndex
+    import gthack.modules.genotypeTranslation as genotypeTranslation
+    from concurrent.futures import ProcessPoolExecutor
+    from itertools import repeat
+
+    logger = logging.getLogger('synthesize')
+    logger.debug('In method synthesize()')
+
+    spec, errors = readSpec(self.spec, self.gtcDir)
+    if len(errors) > 0:
+        for error in errors:
+            logger.critical(error)
+            print(error)
+        logger.critical('{} error(s) in spec {}; no gtcs were written'.format(len(errors), self.spec))
+        print('{} error(s) in spec {}; no gtcs were written'.format(len(errors), self.spec))
+        sys.exit(1)
+
+    manifest = manifestIndex.loadManifestIndex(self.bpm, self.bpm_csv, self.manifestCache)
+    translator = genotypeTranslation.GenotypeTranslator(manifest)
+
+    # each worker keeps recently used templates decoded (manipulateGTC.loadSource)
+    chunks = [list(range(start, min(start + CHUNK_SIZE, spec['count']))) for start in range(0, spec['count'], CHUNK_SIZE)]
+    logger.info('Writing {} synthetic gtcs from {} template(s) with {} worker(s)'.format(spec['count'], len(spec['templates']), self.workers))
+    print('Writing {} synthetic gtcs from {} template(s) with {} worker(s)'.format(spec['count'], len(spec['templates']), self.workers))
+
+    with open(os.path.join(self.outDir, 'synthesisSummary.txt'), 'w') as summary:
+        summary.write('\t'.join(['outputName', 'templateGtc', 'sampleName', 'sex', 'genotypesChanged', 'noCallsAdded']) + '\n')
+        if self.workers > 1:
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=initWorker, initargs=(translator, spec)) as executor:
+                for rows in executor.map(synthesizeChunk, chunks, repeat(self.gtcDir), repeat(self.outDir)):
+                    summary.writelines('\t'.join(row) + '\n' for row in rows)
+        else:
+            initWorker(translator, spec)
+            for chunk in chunks:
+                summary.writelines('\t'.join(row) + '\n' for row in synthesizeChunk(chunk, self.gtcDir, self.outDir))
+
+    logger.info('Wrote {} synthetic gtcs to {}'.format(spec['count'], self.outDir))
+    print('Wrote {} synthetic gtcs to {}'.format(spec['count'], self.outDir))
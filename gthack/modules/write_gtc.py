@@ -1,124 +1,236 @@
-from IlluminaBeadArrayFiles import GenotypeCalls, BeadArrayUtility
-import struct
-from io import BytesIO
-import logging
-
-logger = logging.getLogger('write_gtc')
-logger.debug('In module write_gtc.py')
-
-def handle_int(value):
-    return struct.pack("<i", value)
-
-def handle_short(value):
-    return struct.pack("<H", value)
-
-def handle_char(value):
-    return struct.pack("c", value)
-
-def handle_byte(value):
-    #print(value)
-    return struct.pack("B", value)
-
-def handle_float(value):
-    return struct.pack("<f", value)
-
-def handle_gc50(value):
-    return struct.pack("<fiii", value[0], value[1], value[2], value[3])
-
-def handle_percentiles(value):
-    return struct.pack("<HHH", value[0], value[1], value[2])
-
-def handle_string(value):
-    assert len(value) <= 127
-    return (
-        struct.pack("B", len(value)) + 
-        (value.encode() if isinstance(value, str) else value)
-    )
-
-def handle_basecalls(value):
-    return value
-
-def handle_scanner_data(value):
-    return handle_string(value.name) + handle_int(value.pmt_green) + handle_int(value.pmt_red) + handle_string(value.version) + handle_string(value.user)
-
-def handle_normalization_transform(value):
-#    return struct.pack("<iffffff", value.version, value.offset_x, value.offset_y, value.scale_x, value.scale_y, value.shear, value.theta)
-    return struct.pack("<iffffffiiiiii", value.version, value.offset_x, value.offset_y, value.scale_x, value.scale_y, value.shear,
-                   value.theta, 0,0,0,0,0,0)
-
-toc2handler = {}
-toc2handler[GenotypeCalls._GenotypeCalls__ID_NUM_SNPS] = handle_int
-toc2handler[GenotypeCalls._GenotypeCalls__ID_PLOIDY] = handle_int
-toc2handler[GenotypeCalls._GenotypeCalls__ID_PLOIDY_TYPE] = handle_int
-toc2handler[GenotypeCalls._GenotypeCalls__ID_SAMPLE_NAME] = handle_string
-toc2handler[GenotypeCalls._GenotypeCalls__ID_SAMPLE_PLATE] = handle_string
-toc2handler[GenotypeCalls._GenotypeCalls__ID_SAMPLE_WELL] = handle_string
-toc2handler[GenotypeCalls._GenotypeCalls__ID_CLUSTER_FILE] = handle_string
-toc2handler[GenotypeCalls._GenotypeCalls__ID_SNP_MANIFEST] = handle_string
-toc2handler[GenotypeCalls._GenotypeCalls__ID_IMAGING_DATE] = handle_string
-toc2handler[GenotypeCalls._GenotypeCalls__ID_AUTOCALL_DATE] = handle_string
-toc2handler[GenotypeCalls._GenotypeCalls__ID_AUTOCALL_VERSION] = handle_string
-toc2handler[GenotypeCalls._GenotypeCalls__ID_NORMALIZATION_TRANSFORMS] = handle_normalization_transform
-toc2handler[GenotypeCalls._GenotypeCalls__ID_CONTROLS_X] = handle_short
-toc2handler[GenotypeCalls._GenotypeCalls__ID_CONTROLS_Y] = handle_short
-toc2handler[GenotypeCalls._GenotypeCalls__ID_RAW_X] = handle_short
-toc2handler[GenotypeCalls._GenotypeCalls__ID_RAW_Y] = handle_short
-toc2handler[GenotypeCalls._GenotypeCalls__ID_GENOTYPES] = handle_byte
-toc2handler[GenotypeCalls._GenotypeCalls__ID_BASE_CALLS] = handle_basecalls
-toc2handler[GenotypeCalls._GenotypeCalls__ID_GENOTYPE_SCORES] = handle_float
-toc2handler[GenotypeCalls._GenotypeCalls__ID_SCANNER_DATA] = handle_scanner_data
-toc2handler[GenotypeCalls._GenotypeCalls__ID_CALL_RATE] = handle_float
-toc2handler[GenotypeCalls._GenotypeCalls__ID_GENDER] = handle_char
-toc2handler[GenotypeCalls._GenotypeCalls__ID_LOGR_DEV] = handle_float
-toc2handler[GenotypeCalls._GenotypeCalls__ID_GC10] = handle_float
-toc2handler[GenotypeCalls._GenotypeCalls__ID_GC50] = handle_gc50
-toc2handler[GenotypeCalls._GenotypeCalls__ID_B_ALLELE_FREQS] = handle_float
-toc2handler[GenotypeCalls._GenotypeCalls__ID_LOGR_RATIOS] = handle_float
-toc2handler[GenotypeCalls._GenotypeCalls__ID_PERCENTILES_X] = handle_percentiles
-toc2handler[GenotypeCalls._GenotypeCalls__ID_PERCENTILES_Y] = handle_percentiles
-toc2handler[GenotypeCalls._GenotypeCalls__ID_SLIDE_IDENTIFIER] = handle_string
-
-list_types = []
-list_types.append(GenotypeCalls._GenotypeCalls__ID_NORMALIZATION_TRANSFORMS)
-list_types.append(GenotypeCalls._GenotypeCalls__ID_CONTROLS_X)
-list_types.append(GenotypeCalls._GenotypeCalls__ID_CONTROLS_Y)
-list_types.append(GenotypeCalls._GenotypeCalls__ID_RAW_X)
-list_types.append(GenotypeCalls._GenotypeCalls__ID_RAW_Y)
-list_types.append(GenotypeCalls._GenotypeCalls__ID_GENOTYPES)
-list_types.append(GenotypeCalls._GenotypeCalls__ID_BASE_CALLS)
-list_types.append(GenotypeCalls._GenotypeCalls__ID_GENOTYPE_SCORES)
-list_types.append(GenotypeCalls._GenotypeCalls__ID_B_ALLELE_FREQS)
-list_types.append(GenotypeCalls._GenotypeCalls__ID_LOGR_RATIOS)
-
-
-def write_gtc(data, handle):
-    logger.debug('In sub-method of write_gtc.py, write_gtc(data, handle)')
-    handle.write(b'g')
-    handle.write(b't')
-    handle.write(b'c')
-    handle.write(handle_byte(5))
-
-    num_entries = len(data)
-    handle.write(handle_int(num_entries))
-    offset = 8 + num_entries * 6;
-
-
-    buffer = BytesIO()
-    for toc_id in data:
-        # write the toc ID
-        handle.write(handle_short(toc_id))
-
-        # write the data into the buffer
-        if toc_id in list_types:
-            handle.write(handle_int(offset + buffer.tell()))
-            buffer.write(handle_int(len(data[toc_id])))
-            for element in data[toc_id]:
-                buffer.write(toc2handler[toc_id](element))
-        else:
-            if toc2handler[toc_id] == handle_int:
-                handle.write(handle_int(data[toc_id]))
-            else:
-                handle.write(handle_int(offset + buffer.tell()))
-                buffer.write(toc2handler[toc_id](data[toc_id]))
-    buffer.seek(0)
-    handle.write(buffer.read1(-1))
\ No newline at end of file
+from IlluminaBeadArrayFiles import GenotypeCalls, BeadArrayUtility
+import struct
+import os
+from io import BytesIO, UnsupportedOperation
+import logging
+import numpy
+
+logger = logging.getLogger('write_gtc')
+logger.debug('In module write_gtc.py')
+
+def handle_int(value):
+    return struct.pack("<i", value)
+
+def handle_short(value):
+    return struct.pack("<H", value)
+
+def handle_char(value):
+    return struct.pack("c", value)
+
+def handle_byte(value):
+    #print(value)
+    return struct.pack("B", value)
+
+def handle_float(value):
+    return struct.pack("<f", value)
+
+def handle_gc50(value):
+    return struct.pack("<fiii", value[0], value[1], value[2], value[3])
+
+def handle_percentiles(value):
+    return struct.pack("<HHH", value[0], value[1], value[2])
+
+def handle_string(value):
+    assert len(value) <= 127
+    return (
+        struct.pack("B", len(value)) + 
+        (value.encode() if isinstance(value, str) else value)
+    )
+
+def handle_basecalls(value):
+    return value
+
+def handle_scanner_data(value):
+    return handle_string(value.name) + handle_int(value.pmt_green) + handle_int(value.pmt_red) + handle_string(value.version) + handle_string(value.user)
+
+def handle_normalization_transform(value):
+#    return struct.pack("<iffffff", value.version, value.offset_x, value.offset_y, value.scale_x, value.scale_y, value.shear, value.theta)
+    return struct.pack("<iffffffiiiiii", value.version, value.offset_x, value.offset_y, value.scale_x, value.scale_y, value.shear,
+                   value.theta, 0,0,0,0,0,0)
+
+toc2handler = {}
+toc2handler[GenotypeCalls._GenotypeCalls__ID_NUM_SNPS] = handle_int
+toc2handler[GenotypeCalls._GenotypeCalls__ID_PLOIDY] = handle_int
+toc2handler[GenotypeCalls._GenotypeCalls__ID_PLOIDY_TYPE] = handle_int
+toc2handler[GenotypeCalls._GenotypeCalls__ID_SAMPLE_NAME] = handle_string
+toc2handler[GenotypeCalls._GenotypeCalls__ID_SAMPLE_PLATE] = handle_string
+toc2handler[GenotypeCalls._GenotypeCalls__ID_SAMPLE_WELL] = handle_string
+toc2handler[GenotypeCalls._GenotypeCalls__ID_CLUSTER_FILE] = handle_string
+toc2handler[GenotypeCalls._GenotypeCalls__ID_SNP_MANIFEST] = handle_string
+toc2handler[GenotypeCalls._GenotypeCalls__ID_IMAGING_DATE] = handle_string
+toc2handler[GenotypeCalls._GenotypeCalls__ID_AUTOCALL_DATE] = handle_string
+toc2handler[GenotypeCalls._GenotypeCalls__ID_AUTOCALL_VERSION] = handle_string
+toc2handler[GenotypeCalls._GenotypeCalls__ID_NORMALIZATION_TRANSFORMS] = handle_normalization_transform
+toc2handler[GenotypeCalls._GenotypeCalls__ID_CONTROLS_X] = handle_short
+toc2handler[GenotypeCalls._GenotypeCalls__ID_CONTROLS_Y] = handle_short
+toc2handler[GenotypeCalls._GenotypeCalls__ID_RAW_X] = handle_short
+toc2handler[GenotypeCalls._GenotypeCalls__ID_RAW_Y] = handle_short
+toc2handler[GenotypeCalls._GenotypeCalls__ID_GENOTYPES] = handle_byte
+toc2handler[GenotypeCalls._GenotypeCalls__ID_BASE_CALLS] = handle_basecalls
+toc2handler[GenotypeCalls._GenotypeCalls__ID_GENOTYPE_SCORES] = handle_float
+toc2handler[GenotypeCalls._GenotypeCalls__ID_SCANNER_DATA] = handle_scanner_data
+toc2handler[GenotypeCalls._GenotypeCalls__ID_CALL_RATE] = handle_float
+toc2handler[GenotypeCalls._GenotypeCalls__ID_GENDER] = handle_char
+toc2handler[GenotypeCalls._GenotypeCalls__ID_LOGR_DEV] = handle_float
+toc2handler[GenotypeCalls._GenotypeCalls__ID_GC10] = handle_float
+toc2handler[GenotypeCalls._GenotypeCalls__ID_GC50] = handle_gc50
+toc2handler[GenotypeCalls._GenotypeCalls__ID_B_ALLELE_FREQS] = handle_float
+toc2handler[GenotypeCalls._GenotypeCalls__ID_LOGR_RATIOS] = handle_float
+toc2handler[GenotypeCalls._GenotypeCalls__ID_PERCENTILES_X] = handle_percentiles
+toc2handler[GenotypeCalls._GenotypeCalls__ID_PERCENTILES_Y] = handle_percentiles
+toc2handler[GenotypeCalls._GenotypeCalls__ID_SLIDE_IDENTIFIER] = handle_string
+
+list_types = []
+list_types.append(GenotypeCalls._GenotypeCalls__ID_NORMALIZATION_TRANSFORMS)
+list_types.append(GenotypeCalls._GenotypeCalls__ID_CONTROLS_X)
+list_types.append(GenotypeCalls._GenotypeCalls__ID_CONTROLS_Y)
+list_types.append(GenotypeCalls._GenotypeCalls__ID_RAW_X)
+list_types.append(GenotypeCalls._GenotypeCalls__ID_RAW_Y)
+list_types.append(GenotypeCalls._GenotypeCalls__ID_GENOTYPES)
+list_types.append(GenotypeCalls._GenotypeCalls__ID_BASE_CALLS)
+list_types.append(GenotypeCalls._GenotypeCalls__ID_GENOTYPE_SCORES)
+list_types.append(GenotypeCalls._GenotypeCalls__ID_B_ALLELE_FREQS)
+list_types.append(GenotypeCalls._GenotypeCalls__ID_LOGR_RATIOS)
+
+
+# numpy dtype of the elements of every array section; each is written as an int32 count followed by the packed elements
+array_types = {}
+array_types[GenotypeCalls._GenotypeCalls__ID_CONTROLS_X] = numpy.dtype('<u2')
+array_types[GenotypeCalls._GenotypeCalls__ID_CONTROLS_Y] = numpy.dtype('<u2')
+array_types[GenotypeCalls._GenotypeCalls__ID_RAW_X] = numpy.dtype('<u2')
+array_types[GenotypeCalls._GenotypeCalls__ID_RAW_Y] = numpy.dtype('<u2')
+array_types[GenotypeCalls._GenotypeCalls__ID_GENOTYPES] = numpy.dtype('u1')
+array_types[GenotypeCalls._GenotypeCalls__ID_BASE_CALLS] = numpy.dtype('S2')
+array_types[GenotypeCalls._GenotypeCalls__ID_GENOTYPE_SCORES] = numpy.dtype('<f4')
+array_types[GenotypeCalls._GenotypeCalls__ID_B_ALLELE_FREQS] = numpy.dtype('<f4')
+array_types[GenotypeCalls._GenotypeCalls__ID_LOGR_RATIOS] = numpy.dtype('<f4')
+
+
+'''
+function: serialize_section(toc_id, value)
+description: the bytes of one toc entry that are written after the table of contents.  Array sections are converted
+to their typed numpy array once and passed on as a buffer instead of being packed element by element
+input: toc ID and its value from the data dictionary
+output: list of bytes-like chunks
+'''
+def serialize_section(toc_id, value):
+    if toc_id in array_types:
+        if toc_id == GenotypeCalls._GenotypeCalls__ID_BASE_CALLS and not isinstance(value, numpy.ndarray):
+            value = [element.encode() if isinstance(element, str) else element for element in value]
+        array = numpy.ascontiguousarray(value, dtype=array_types[toc_id])
+        return [handle_int(len(array)), array.view(numpy.uint8)]
+    if toc_id in list_types:
+        return [handle_int(len(value)) + b''.join(toc2handler[toc_id](element) for element in value)]
+    return [toc2handler[toc_id](value)]
+
+
+'''
+function: write_chunks(handle, chunks)
+description: writes all chunks to the handle; for a real file in a single writev call where the platform has one
+(repeated only for whatever a partial write left over), otherwise chunk by chunk
+input: open binary file handle and list of bytes-like chunks
+output: None
+'''
+def write_chunks(handle, chunks):
+    try:
+        fd = handle.fileno()
+        writev = os.writev
+    except (AttributeError, UnsupportedOperation):
+        handle.writelines(chunks)
+        return
+
+    handle.flush()
+    chunks = [memoryview(chunk).cast('B') for chunk in chunks]
+    max_chunks = os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') else 1024
+    while chunks:
+        written = writev(fd, chunks[:max_chunks])
+        while chunks and written >= len(chunks[0]):
+            written -= len(chunks[0])
+            chunks.pop(0)
+        if chunks and written > 0:
+            chunks[0] = chunks[0][written:]
+
+
+'''
+function: write_gtc(data, handle)
+description: serializes a gtc data dictionary (as returned by getGtcInfo) in dictionary order.  All sections are
+converted first so every toc offset is known up front, then header, table of contents and sections are written in one pass
+input: data dictionary of toc ID -> value and an open binary file handle
+output: None
+'''
+def write_gtc(data, handle):
+    logger.debug('In sub-method of write_gtc.py, write_gtc(data, handle)')
+
+    num_entries = len(data)
+    offset = 8 + num_entries * 6
+
+    toc = BytesIO()
+    sections = []
+    for toc_id in data:
+        toc.write(handle_short(toc_id))
+        if toc_id not in list_types and toc2handler[toc_id] == handle_int:
+            toc.write(handle_int(data[toc_id]))
+        else:
+            toc.write(handle_int(offset))
+            for chunk in serialize_section(toc_id, data[toc_id]):
+                sections.append(chunk)
+                offset += memoryview(chunk).nbytes
+
+    write_chunks(handle, [b'gtc' + handle_byte(5) + handle_int(num_entries), toc.getvalue()] + sections)
+
+
+'''
+function: benchmark(num_snps, repeats, outDir)
+description: times write_gtc on synthetic samples of the given array sizes, written to a temporary file
+input: list of SNP counts (default: 700k and 1.7M), number of writes per size and directory for the temporary file
+output: dictionary of SNP count -> best seconds per file; the timings are also printed
+'''
+def benchmark(num_snps=(700000, 1700000), repeats=3, outDir=None):
+    import time
+    import tempfile
+    from collections import namedtuple
+
+    scanner = namedtuple('ScannerData', ['name', 'pmt_green', 'pmt_red', 'version', 'user'])
+    transform = namedtuple('NormalizationTransform', ['version', 'offset_x', 'offset_y', 'scale_x', 'scale_y', 'shear', 'theta'])
+    random = numpy.random.default_rng(0)
+
+    timings = {}
+    for snps in num_snps:
+        data = {
+            201: '1/1/2020 12:00 PM', 300: '3.0.0', 1006: 0.99, 100: 'cluster.egt', 1009: 0.8,
+            1011: (0.8, snps - 10, 10, 0), 1007: b'F', 200: '1/1/2020 11:00 AM', 1008: 0.15, 1: snps, 2: 2, 3: 1,
+            1014: (100, 200, 300), 1015: (100, 200, 300), 10: 'sample', 11: 'plate', 12: 'A01', 101: 'manifest.bpm',
+            1016: '200000000000', 1005: scanner('scanner', 0, 0, '1.0', 'user'),
+            400: [transform(1, 0.0, 0.0, 1.0, 1.0, 0.0, 0.0)] * 24,
+            500: random.integers(0, 65535, 92, dtype=numpy.uint16), 501: random.integers(0, 65535, 92, dtype=numpy.uint16),
+            1000: random.integers(0, 65535, snps, dtype=numpy.uint16), 1001: random.integers(0, 65535, snps, dtype=numpy.uint16),
+            1002: random.integers(0, 4, snps, dtype=numpy.uint8),
+            1003: numpy.array([b'AA', b'AG', b'GG', b'--'])[random.integers(0, 4, snps)],
+            1004: random.random(snps, dtype=numpy.float32), 1012: random.random(snps, dtype=numpy.float32),
+            1013: random.random(snps, dtype=numpy.float32),
+        }
+
+        best = None
+        with tempfile.TemporaryDirectory(dir=outDir) as tmpDir:
+            for repeat in range(repeats):
+                start = time.perf_counter()
+                with open(os.path.join(tmpDir, 'benchmark.gtc'), 'wb') as handle:
+                    write_gtc(data, handle)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+        timings[snps] = best
+        print('write_gtc: {} SNPs in {:.3f} seconds per file'.format(snps, best))
+
+    return timings
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Times write_gtc on synthetic samples')
+    parser.add_argument('--snps', default='700000,1700000', type=str, help='Comma-separated SNP counts of the synthetic samples')
+    parser.add_argument('--repeats', default=3, type=int, help='Number of writes per SNP count; the best is reported')
+    parser.add_argument('--outDir', default=None, type=str, help='Directory for the temporary gtc (default: system temporary directory)')
+    args = parser.parse_args()
+
+    benchmark([int(snps) for snps in args.snps.split(',')], args.repeats, args.outDir)
@@ -0,0 +1,119 @@
+import numpy
+import pytest
+
+from IlluminaBeadArrayFiles import RefStrand
+import gthack.modules.manifestIndex as manifestIndex
+import gthack.modules.genotypeTranslation as genotypeTranslation
+
+COMPLEMENT_MAP = dict(zip("ABCDGHKMRTVYNID", "TVGHCDMKYABRNID"))
+BASES = 'ACGT'
+
+
+def snpUpdate(manifest, loc, pair):
+    # scalar translation of one snp line as the original manipulate_gtc snpUpdate did it; None where it matched no condition
+    manifestSnpsStr = str(manifest.snps[loc])
+    manifestSnps = [manifestSnpsStr[1], manifestSnpsStr[-2]]
+    if manifest.ref_strands[loc] == RefStrand.Minus:
+        manifestSnps = [COMPLEMENT_MAP[snp] for snp in manifestSnps]
+
+    newSnps = [pair[0], pair[1]]
+    if newSnps[0] != newSnps[1] and newSnps[0] != '-':
+        genotype = 2
+    elif newSnps[0] == '-' and newSnps[1] == '-':
+        return 0, '--'
+    elif newSnps[0] == newSnps[1]:
+        if newSnps[0] not in manifestSnps:
+            newSnps = [COMPLEMENT_MAP[snp] for snp in newSnps]
+        genotype = 1 if newSnps[0] == manifestSnps[0] else 3
+    else:
+        return None
+
+    if newSnps[0] in ['I', 'D']:
+        allele_a, allele_b = manifestSnps
+    else:
+        allele_a, allele_b = str(manifest.allele_a[loc]), str(manifest.allele_b[loc])
+    return genotype, {1: allele_a + allele_a, 2: allele_a + allele_b, 3: allele_b + allele_b}[genotype]
+
+
+def randomManifest(random, numSnps):
+    snps, alleles = [], []
+    for loc in range(numSnps):
+        if random.random() < 0.2:
+            snps.append('[I/D]' if random.random() < 0.5 else '[D/I]')
+            alleles.append(('N', 'A'))
+        else:
+            pair = random.choice(list(BASES), 2, replace=False)
+            snps.append('[{}/{}]'.format(*pair))
+            top = random.choice(list(BASES), 2, replace=False)
+            alleles.append((top[0], top[1]))
+    columns = {
+        'names': numpy.array(['rs{}'.format(loc).encode() for loc in range(numSnps)], dtype=bytes),
+        'snps': numpy.array(snps, dtype=str),
+        'ref_strands': numpy.array(random.choice([RefStrand.Plus, RefStrand.Minus], numSnps), dtype=numpy.int8),
+        'normalization_ids': numpy.zeros(numSnps, dtype=numpy.int32),
+        'chroms': numpy.array(['1'] * numSnps, dtype=str),
+        'map_infos': numpy.arange(numSnps, dtype=numpy.int64),
+        'allele_a': numpy.array([allele[0] for allele in alleles], dtype='U1'),
+        'allele_b': numpy.array([allele[1] for allele in alleles], dtype='U1'),
+    }
+    return manifestIndex.ManifestIndex(columns, 'random.bpm', [])
+
+
+def randomPair(random, manifest, loc):
+    bpm = [str(manifest.snps[loc])[1], str(manifest.snps[loc])[-2]]
+    if bpm[0] in 'ID':
+        choices = ['II', 'DD', 'ID', 'DI', '--', '-I']
+    else:
+        a, b = bpm
+        ca, cb = COMPLEMENT_MAP[a], COMPLEMENT_MAP[b]
+        # homozygous on either strand, heterozygous, no calls and '-X' pairs
+        choices = [a + a, b + b, ca + ca, cb + cb, a + b, b + a, ca + cb, '--', '-' + a]
+    return choices[random.integers(len(choices))]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_translate_matches_snpUpdate(seed):
+    random = numpy.random.default_rng(seed)
+    manifest = randomManifest(random, 500)
+    translator = genotypeTranslation.GenotypeTranslator(manifest)
+
+    locs = random.integers(0, len(manifest), 5000)
+    pairs = [randomPair(random, manifest, loc) for loc in locs]
+    genotypes, base_calls, valid = translator.translate(locs, numpy.array([list(pair.encode()) for pair in pairs], dtype=numpy.uint8))
+
+    for i, (loc, pair) in enumerate(zip(locs, pairs)):
+        expected = snpUpdate(manifest, loc, pair)
+        if expected is None:
+            # '-X' pairs matched no condition of snpUpdate and are rejected by the translator
+            assert not valid[i], pair
+            continue
+        assert valid[i], pair
+        assert (genotypes[i], bytes(base_calls[i]).decode()) == expected, (str(manifest.snps[loc]), manifest.ref_strands[loc], pair)
+
+
+def test_minus_strand_complement():
+    manifest = randomManifest(numpy.random.default_rng(0), 1)
+    manifest.snps[0] = '[A/G]'
+    manifest.ref_strands[0] = RefStrand.Minus
+    manifest.allele_a[0], manifest.allele_b[0] = 'A', 'G'
+    translator = genotypeTranslation.GenotypeTranslator(manifest)
+
+    # on the minus strand the bpm A allele is T, so TT and its complement AA are both AA
+    pairs = numpy.array([list(b'TT'), list(b'AA'), list(b'CC'), list(b'TC')], dtype=numpy.uint8)
+    genotypes, base_calls, valid = translator.translate(numpy.zeros(4, dtype=numpy.int64), pairs)
+    assert genotypes.tolist() == [1, 1, 3, 2]
+    assert [bytes(call).decode() for call in base_calls] == ['AA', 'AA', 'GG', 'AG']
+    assert valid.all()
+
+
+def test_on_bpm_alleles():
+    manifest = randomManifest(numpy.random.default_rng(0), 2)
+    manifest.snps[0], manifest.snps[1] = '[A/G]', '[I/D]'
+    manifest.ref_strands[0] = manifest.ref_strands[1] = RefStrand.Plus
+    translator = genotypeTranslation.GenotypeTranslator(manifest)
+
+    # either strand of the bpm pair matches (CC is GG on the other strand), mixing strands, other alleles and SNVs
+    # at an indel do not; '-' is ignored
+    locs = numpy.array([0, 0, 0, 0, 0, 0, 0, 1, 1])
+    pairs = numpy.array([list(pair) for pair in [b'AG', b'TC', b'CC', b'AC', b'AT', b'--', b'G-', b'ID', b'AA']], dtype=numpy.uint8)
+    assert translator.onBpmAlleles(locs, pairs).tolist() == [True, True, True, False, False, True, True, True, False]
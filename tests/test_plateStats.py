@@ -0,0 +1,79 @@
+import numpy
+import pandas
+import pytest
+
+import gthack.modules.plateStats as plateStats
+
+# samples per plate; all but the last are within SKETCH_CAPACITY, where medians must be exact
+PLATE_SIZES = {'P1': 1, 'P2': 2, 'P3': 96, 'P4': plateStats.SKETCH_CAPACITY - 1, 'P5': plateStats.SKETCH_CAPACITY, 'P6': 3000}
+
+
+def randomRows(seed):
+    random = numpy.random.default_rng(seed)
+    rows = []
+    for plate, size in PLATE_SIZES.items():
+        for sample in range(size):
+            rows.append({'plate': plate, 'well': 'ABCDEFGH'[sample % 8] + '{:02d}'.format(sample % 12 + 1),
+                'BTID': 'S{}'.format(random.integers(size)),
+                'callRate': random.uniform(0.9, 1.0), 'gc10': random.uniform(0.3, 0.7), 'logrDev': random.normal(0.15, 0.05)})
+    # a missing value is skipped as pandas does
+    rows[3]['gc10'] = numpy.nan
+    random.shuffle(rows)
+    return rows
+
+
+def groupbyTable(rows):
+    # the summaryStatsTable.txt of sampleInformation before plate statistics were kept while rows are written
+    aggregates = {'totalSamples': ('plate', 'count'), 'totalUniqueWells': ('well', 'nunique'), 'totalUniqueBTID': ('BTID', 'nunique')}
+    for column, name in plateStats.STAT_COLUMNS:
+        for statistic, aggfunc in [('mean', 'mean'), ('stdDev', 'std'), ('min', 'min'), ('max', 'max'), ('median', 'median'), ('variance', 'var')]:
+            aggregates[statistic + name] = (column, aggfunc)
+    return pandas.DataFrame(rows).groupby('plate').agg(**aggregates)
+
+
+def summarize(rows):
+    summary = plateStats.PlateSummary()
+    for row in rows:
+        summary.add(row['plate'], row['well'], row['BTID'], row)
+    return summary
+
+
+def assertMatches(table, rows):
+    expected = groupbyTable(rows)
+    assert list(table.columns) == list(expected.columns)
+    assert list(table.index) == list(expected.index)
+    exact = [plate for plate, size in PLATE_SIZES.items() if size <= plateStats.SKETCH_CAPACITY]
+    pandas.testing.assert_frame_equal(table.loc[exact], expected.loc[exact], check_dtype=False, rtol=1e-9)
+
+    # beyond capacity everything but the median is still exact; the median is within a few ranks of the true one
+    medians = ['median' + name for column, name in plateStats.STAT_COLUMNS]
+    large = [plate for plate in PLATE_SIZES if plate not in exact]
+    pandas.testing.assert_frame_equal(table.loc[large].drop(columns=medians), expected.loc[large].drop(columns=medians),
+        check_dtype=False, rtol=1e-9)
+    for plate in large:
+        for column, name in plateStats.STAT_COLUMNS:
+            values = numpy.array([row[column] for row in rows if row['plate'] == plate and not numpy.isnan(row[column])])
+            rank = (values < table.loc[plate, 'median' + name]).mean()
+            assert abs(rank - 0.5) < 0.02, (plate, column, rank)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_table_matches_groupby(seed):
+    rows = randomRows(seed)
+    assertMatches(summarize(rows).table(), rows)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_merged_halves_match_one_pass(seed):
+    rows = randomRows(seed)
+    first, second = summarize(rows[:len(rows) // 2]), summarize(rows[len(rows) // 2:])
+    merged = plateStats.PlateSummary()
+    merged.merge(first)
+    merged.merge(second)
+    assertMatches(merged.table(), rows)
+
+    # plates taken over from another summary are copies, so adding to the merged summary leaves the part unchanged
+    before = first.table()
+    for row in rows[:10]:
+        merged.add(row['plate'], row['well'], 'NEW', row)
+    pandas.testing.assert_frame_equal(first.table(), before)
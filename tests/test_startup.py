@@ -0,0 +1,46 @@
+import os
+import sys
+import time
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# libraries that must only be imported by the methods that use them
+HEAVY_MODULES = ['matplotlib', 'seaborn', 'pandas', 'IlluminaBeadArrayFiles']
+
+# cold start budget of `gtcFuncs --help`, in seconds
+STARTUP_BUDGET = 1.0
+
+
+def run(args):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(ROOT), os.environ.get('PYTHONPATH', '')]))
+    return subprocess.run([sys.executable] + args, cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+
+
+def importedModules(importtime):
+    # lines of -X importtime are "import time: self | cumulative | module", nested modules indented
+    return set(line.split('|')[-1].strip().split('.')[0] for line in importtime.splitlines() if line.startswith('import time:'))
+
+
+def test_help_imports_no_heavy_modules():
+    result = run(['-X', 'importtime', '-m', 'gthack.gtcFuncs', '--help'])
+    imported = importedModules(result.stderr)
+    assert [module for module in HEAVY_MODULES if module in imported] == []
+
+
+def test_help_within_budget():
+    # best of 3, so one slow start on a busy machine does not fail the test
+    timings = []
+    for attempt in range(3):
+        start = time.perf_counter()
+        run(['-m', 'gthack.gtcFuncs', '--help'])
+        timings.append(time.perf_counter() - start)
+    assert min(timings) < STARTUP_BUDGET
+
+
+def test_modules_import_lazily():
+    result = run(['-c', 'import sys, gthack.modules.getSampleInfo, gthack.modules.getIntensities; '
+        'print(" ".join(sorted(sys.modules)))'])
+    imported = set(result.stdout.split())
+    assert [module for module in HEAVY_MODULES if module in imported] == []